@@ -0,0 +1,103 @@
+"""Benchmark of the csv builders of ProcessData on growing synthetic corpora.
+
+``rankings_to_csv`` and ``agg_data_to_csv`` are run on corpora generated by
+``benchmarks.corpus`` at 1x, 10x and 100x the size of the real data by default
+(about 1k, 10k and 100k match files). Both builders accumulate their rows in a
+``FrameBuilder``, so they should scale linearly: the time per match file
+should stay roughly constant as the corpus grows (the original ``pd.concat``
+loops were quadratic).
+
+Usage: python -m benchmarks.bench_builders [--scales 1 10 100] [--corpus-dir D]
+       [--workers N]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.corpus import generate_corpus
+from src.data.make_dataset import ProcessData
+
+
+def time_builders(corpus_path, work_path, n_workers=1):
+    """Time ``rankings_to_csv`` then ``agg_data_to_csv`` on one corpus.
+
+    Parameters
+    ----------
+    corpus_path : str
+        the directory of the generated corpus (the raw data path)
+    work_path : str
+        the directory to write the csv files to
+    n_workers : int, optional
+        the number of worker processes used by ProcessData
+
+    Returns
+    -------
+    timings : dict
+        the wall-clock time of each builder in seconds
+    """
+
+    proc_path = os.path.join(work_path, "processed") + "/"
+    os.makedirs(proc_path, exist_ok=True)
+    data = ProcessData(
+        corpus_path.rstrip("/") + "/",
+        proc_path,
+        2003,
+        2013,
+        "rankings_data.csv",
+        "aggregate_data.csv",
+        n_workers=n_workers,
+    )
+
+    timings = {}
+    for name, builder in [
+        ("rankings_to_csv", data.rankings_to_csv),
+        ("agg_data_to_csv", data.agg_data_to_csv),
+    ]:
+        t0 = time.perf_counter()
+        builder()
+        timings[name] = time.perf_counter() - t0
+    return timings
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--corpus-dir",
+        help="where to keep the generated corpora (reused between runs); "
+        + "default a temporary directory",
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    print(
+        "%8s %10s %20s %20s" % ("scale", "matches", "rankings us/match", "agg us/match")
+    )
+    with tempfile.TemporaryDirectory() as tmp_path:
+        corpus_dir = args.corpus_dir or tmp_path
+        for scale in args.scales:
+            corpus_path = os.path.join(corpus_dir, "scale_" + str(scale))
+            summary = generate_corpus(corpus_path, scale, args.seed)
+            n_matches = summary["n_matches"]
+
+            work_path = os.path.join(tmp_path, "work_" + str(scale))
+            timings = time_builders(corpus_path, work_path, args.workers)
+
+            print(
+                "%8d %10d %20.2f %20.2f"
+                % (
+                    scale,
+                    n_matches,
+                    1e6 * timings["rankings_to_csv"] / n_matches,
+                    1e6 * timings["agg_data_to_csv"] / n_matches,
+                )
+            )
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,233 @@
+"""Benchmark of every stage of the data pipeline on synthetic corpora.
+
+Each stage calls the ``src.data`` entry point on a corpus generated by
+``benchmarks.corpus`` (at 1x, 10x and 100x the size of the real data by
+default). Every stage is run twice: once for its wall-clock time and once
+under ``tracemalloc`` for its peak (Python) memory. The stages are:
+
+* rankings_html: parse the rankings html files (``rankings_to_csv``)
+* info_files: parse the match info files (``match_headers_frame``)
+* merge: join the matches with the rankings (``join_rankings``)
+* series_html: parse the howstat series pages (``series_data_to_csv``)
+* match_index: index the matches by date (``MatchIndex.from_directory``)
+* points: compute the points won in each series (``calc_points_per_series``)
+* propagation: compute the monthly ratings (``propagate_rankings_data``)
+* ratings_engine: replay the series through ``RatingsEngine``
+
+The results are written as json (by default to
+``benchmarks/results/pipeline_<commit>.json``), and two result files can be
+compared with ``--compare``.
+
+Usage: python -m benchmarks.bench_pipeline [--scales 1 10 100] [--corpus-dir D]
+       python -m benchmarks.bench_pipeline --compare OLD.json NEW.json
+"""
+
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.corpus import generate_corpus
+from src.data import make_rankings_data
+from src.data.make_dataset import ProcessData
+from src.data.match_index import MatchIndex
+
+
+class PipelineRun:
+    """The inputs and intermediate outputs shared by the stages of one run."""
+
+    def __init__(self, corpus_path, work_path):
+
+        self.raw_path = corpus_path.rstrip("/") + "/"
+        self.interim_path = os.path.join(work_path, "interim") + "/"
+        self.proc_path = os.path.join(work_path, "processed") + "/"
+        os.makedirs(self.interim_path, exist_ok=True)
+        os.makedirs(self.proc_path, exist_ok=True)
+
+        self.data = ProcessData(
+            self.raw_path,
+            self.proc_path,
+            2003,
+            2013,
+            "rankings_data.csv",
+            "aggregate_data.csv",
+        )
+        self.info_files = glob.glob(self.raw_path + "match_data/*_info.csv")
+        self.matches = None
+        self.match_index = None
+
+    def rankings_html(self):
+        self.data.rankings_to_csv()
+
+    def info_files_stage(self):
+        self.data.unresolved_venues_ = []
+        self.matches = self.data.match_headers_frame(self.info_files)
+
+    def merge(self):
+        self.data.join_rankings(
+            self.matches, datetime.date(2004, 3, 1), datetime.date(2013, 3, 31)
+        )
+
+    def series_html(self):
+        make_rankings_data.series_data_to_csv(
+            self.raw_path + "series_data/", self.interim_path, self.proc_path
+        )
+
+    def match_index_stage(self):
+        self.match_index = MatchIndex.from_directory(self.raw_path + "match_data/")
+
+    def points(self):
+        # the points are appended to any existing file, so start afresh
+        fname = self.proc_path + "series_points_data.csv"
+        if os.path.exists(fname):
+            os.remove(fname)
+        make_rankings_data.calc_points_per_series(
+            "01/01/2000", "31/12/2029", self.proc_path, self.match_index
+        )
+
+    def propagation(self):
+        make_rankings_data.propagate_rankings_data(2013, 4, 2022, 12, self.proc_path)
+
+    def ratings_engine(self):
+        make_rankings_data.aggregate_rankings_data(self.proc_path, self.match_index)
+
+
+# the stages in the order they are run (later stages use earlier outputs)
+STAGES = [
+    ("rankings_html", PipelineRun.rankings_html),
+    ("info_files", PipelineRun.info_files_stage),
+    ("merge", PipelineRun.merge),
+    ("series_html", PipelineRun.series_html),
+    ("match_index", PipelineRun.match_index_stage),
+    ("points", PipelineRun.points),
+    ("propagation", PipelineRun.propagation),
+    ("ratings_engine", PipelineRun.ratings_engine),
+]
+
+
+def run_stages(corpus_path, work_path):
+    """Time and measure the peak memory of every stage on a corpus.
+
+    Returns
+    -------
+    results : dict
+        the wall-clock seconds and peak traced MiB of each stage
+    """
+
+    run = PipelineRun(corpus_path, work_path)
+    results = {}
+    for name, stage in STAGES:
+        t0 = time.perf_counter()
+        stage(run)
+        seconds = time.perf_counter() - t0
+
+        tracemalloc.start()
+        stage(run)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results[name] = {"seconds": seconds, "peak_mib": peak / 2**20}
+        print("    %-16s %10.3f s %10.1f MiB" % (name, seconds, peak / 2**20))
+
+    return results
+
+
+def git_commit():
+    """The short hash of the current commit ('unknown' outside a git repo)."""
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(old_fname, new_fname):
+    """Print the ratio of new to old time and memory for every stage."""
+
+    with open(old_fname, "r") as f:
+        old = json.load(f)
+    with open(new_fname, "r") as f:
+        new = json.load(f)
+
+    print("%s (%s) -> %s (%s)" % (old_fname, old["commit"], new_fname, new["commit"]))
+    print("%6s %-16s %10s %10s" % ("scale", "stage", "time", "memory"))
+    for scale, stages in new["scales"].items():
+        for name, result in stages["stages"].items():
+            old_result = old["scales"].get(scale, {}).get("stages", {}).get(name)
+            if old_result is None:
+                continue
+            print(
+                "%6s %-16s %9.2fx %9.2fx"
+                % (
+                    scale,
+                    name,
+                    result["seconds"] / max(old_result["seconds"], 1e-9),
+                    result["peak_mib"] / max(old_result["peak_mib"], 1e-9),
+                )
+            )
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--corpus-dir",
+        help="where to keep the generated corpora (reused between runs); "
+        + "default a temporary directory",
+    )
+    parser.add_argument("--output", help="the json results file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        compare(*args.compare)
+        return
+
+    commit = git_commit()
+    output = args.output or os.path.join(
+        "benchmarks", "results", "pipeline_" + commit + ".json"
+    )
+    report = {
+        "commit": commit,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "scales": {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_path:
+        corpus_dir = args.corpus_dir or tmp_path
+        for scale in args.scales:
+            corpus_path = os.path.join(corpus_dir, "scale_" + str(scale))
+            print("scale", scale, "corpus:", corpus_path)
+            t0 = time.perf_counter()
+            summary = generate_corpus(corpus_path, scale, args.seed)
+            print("    generated in %.1f s: %s" % (time.perf_counter() - t0, summary))
+
+            work_path = os.path.join(tmp_path, "work_" + str(scale))
+            report["scales"][str(scale)] = {
+                "corpus": summary,
+                "stages": run_stages(corpus_path, work_path),
+            }
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("results written to", output)
+
+
+if __name__ == "__main__":
+
+    main()
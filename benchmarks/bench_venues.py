@@ -0,0 +1,71 @@
+"""Micro-benchmark of the per-match cost of resolving the venue country.
+
+Compares the original approach (re-reading ``venue_info.csv`` and scanning it
+for every match) with a single ``VenueRegistry`` lookup.
+
+Usage: python -m benchmarks.bench_venues [raw_datapath]
+"""
+
+import glob
+import sys
+import timeit
+
+import pandas as pd
+
+from src.data.venues import VenueRegistry
+
+
+def read_venues(raw_datapath):
+    """Collect the raw venue string from every match info file."""
+
+    venues = []
+    for fname in sorted(glob.glob(raw_datapath + "match_data/*_info.csv")):
+        with open(fname, "r") as f:
+            for line in f:
+                if line.startswith("info,venue,"):
+                    venues.append(",".join(line.split(",")[2:]).strip())
+                    break
+    return venues
+
+
+def lookup_csv_scan(venue_file, venues):
+    """Resolve venues the original way: read and scan the csv each time."""
+
+    for venue in venues:
+        df_venues = pd.read_csv(venue_file, header=0)
+        df_venues.loc[df_venues["venue"] == venue.replace('"', "")].country.to_string(
+            index=False, header=False
+        ).strip()
+
+
+def lookup_registry(venue_file, venues):
+    """Resolve venues with a registry loaded once."""
+
+    registry = VenueRegistry(venue_file)
+    for venue in venues:
+        if venue in registry:
+            registry.country(venue)
+
+
+def main(raw_datapath="data/raw/"):
+
+    venue_file = raw_datapath + "venue_info.csv"
+    venues = read_venues(raw_datapath)
+    n_matches = len(venues)
+
+    t_scan = min(
+        timeit.repeat(lambda: lookup_csv_scan(venue_file, venues), number=1, repeat=3)
+    )
+    t_reg = min(
+        timeit.repeat(lambda: lookup_registry(venue_file, venues), number=1, repeat=3)
+    )
+
+    print("matches:", n_matches)
+    print("csv scan per match (us):  %10.2f" % (1e6 * t_scan / n_matches))
+    print("registry per match (us):  %10.2f" % (1e6 * t_reg / n_matches))
+    print("speed-up:                 %10.1fx" % (t_scan / t_reg))
+
+
+if __name__ == "__main__":
+
+    main(*sys.argv[1:])
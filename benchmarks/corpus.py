@@ -0,0 +1,365 @@
+"""Deterministic generator of a synthetic cricsheet / rankings / series corpus.
+
+The corpus has the layout of ``data/raw`` so the ``src.data`` entry points
+can run on it unchanged:
+
+* ``match_data/<id>_info.csv`` and ``match_data/<id>.csv``: cricsheet match
+  info and (short) delivery files
+* ``venue_info.csv``: the venue of every match mapped to its home country
+* ``rankings_data/rankings_data_<year>.html``: monthly rankings tables for
+  2003 to 2013, in the format of the archived ICC pages
+* ``series_data/series_data_<decade>.html``: howstat series tables for
+  2000 to 2029
+
+At scale 1 the corpus is about the size of the real data (10 teams, ~380
+series and ~1,100 matches); at scale N there are N times as many teams,
+series and matches. The same scale and seed always give identical files.
+
+Usage: python -m benchmarks.corpus output_path [--scale N] [--seed S]
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import random
+
+from src.data.make_dataset import MONTHS
+
+TEAMS = [
+    "Australia",
+    "Bangladesh",
+    "England",
+    "India",
+    "New Zealand",
+    "Pakistan",
+    "South Africa",
+    "Sri Lanka",
+    "West Indies",
+    "Zimbabwe",
+]
+
+# the number of series per team at scale 1 and the period they span
+SERIES_PER_TEAM = 38
+FIRST_DATE = datetime.date(2000, 1, 1)
+LAST_DATE = datetime.date(2022, 12, 31)
+# the rankings html files cover these years
+RANKINGS_YEARS = range(2003, 2014)
+# howstat has one series page per decade
+DECADES = {"2000_09": 2000, "2010_19": 2010, "2020_29": 2020}
+
+CORPUS_FILE = "corpus.json"
+
+
+def team_names(scale):
+    """The teams of a corpus: the real test teams, then numbered ones."""
+
+    n_teams = len(TEAMS) * scale
+    return TEAMS + ["Team " + str(i) for i in range(len(TEAMS) + 1, n_teams + 1)]
+
+
+def make_series(teams, n_series, rng):
+    """Generate the series (start date, home, away, num matches, wins).
+
+    Returns
+    -------
+    series : list of dict
+        the series, sorted by start date
+    """
+
+    n_days = (LAST_DATE - FIRST_DATE).days - 60
+    series = []
+    for _ in range(n_series):
+        home, away = rng.sample(teams, 2)
+        num_matches = rng.choice([1, 2, 2, 3, 3, 3, 4, 5])
+        results = [rng.choice(["home", "away", "draw"]) for _ in range(num_matches)]
+        series.append(
+            {
+                "start": FIRST_DATE + datetime.timedelta(days=rng.randrange(n_days)),
+                "home": home,
+                "away": away,
+                "num_matches": num_matches,
+                "results": results,
+            }
+        )
+    series.sort(key=lambda s: (s["start"], s["home"], s["away"]))
+    return series
+
+
+def write_matches(path, series, venues, rng, balls_per_innings):
+    """Write the info and delivery files of every match of every series."""
+
+    match_path = os.path.join(path, "match_data")
+    os.makedirs(match_path, exist_ok=True)
+    match_id = 1000000
+    for s in series:
+        home, away = s["home"], s["away"]
+        venue = rng.choice(venues[home])
+        for number, result in enumerate(s["results"], 1):
+            match_id += 1
+            start = s["start"] + datetime.timedelta(days=10 * (number - 1))
+            dates = [start + datetime.timedelta(days=d) for d in range(5)]
+            season = str(start.year)
+            teams = [home, away] if rng.random() < 0.5 else [away, home]
+
+            lines = ["version,2.1.0", "info,balls_per_over,6"]
+            lines += ["info,team," + team for team in teams]
+            lines += ["info,gender,male", "info,season," + season]
+            lines += ["info,date," + date.strftime("%Y/%m/%d") for date in dates]
+            lines += [
+                "info,event," + away + " in " + home + " Test Series",
+                "info,match_number," + str(number),
+                "info,venue," + venue,
+                "info,toss_winner," + rng.choice(teams),
+                "info,toss_decision," + rng.choice(["bat", "field"]),
+            ]
+            if result == "draw":
+                lines.append("info,outcome,draw")
+            else:
+                lines.append("info,winner," + (home if result == "home" else away))
+            with open(os.path.join(match_path, str(match_id) + "_info.csv"), "w") as f:
+                f.write("\n".join(lines) + "\n")
+
+            write_deliveries(
+                os.path.join(match_path, str(match_id) + ".csv"),
+                match_id,
+                season,
+                start,
+                venue,
+                teams,
+                rng,
+                balls_per_innings,
+            )
+
+
+def write_deliveries(fname, match_id, season, start, venue, teams, rng, n_balls):
+    """Write a delivery file with two innings of ``n_balls`` balls each."""
+
+    with open(fname, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            [
+                "match_id",
+                "season",
+                "start_date",
+                "venue",
+                "innings",
+                "ball",
+                "batting_team",
+                "bowling_team",
+                "striker",
+                "non_striker",
+                "bowler",
+                "runs_off_bat",
+                "extras",
+                "wides",
+                "noballs",
+                "byes",
+                "legbyes",
+                "penalty",
+                "wicket_type",
+                "player_dismissed",
+                "other_wicket_type",
+                "other_player_dismissed",
+            ]
+        )
+        for innings, (batting, bowling) in enumerate(
+            [(teams[0], teams[1]), (teams[1], teams[0])], 1
+        ):
+            batters = [batting + " batter " + str(i) for i in range(1, 12)]
+            bowlers = [bowling + " bowler " + str(i) for i in range(1, 6)]
+            striker, non_striker, next_batter = 0, 1, 2
+            for i in range(n_balls):
+                runs = rng.choice([0, 0, 0, 1, 1, 2, 4, 6])
+                wide = rng.random() < 0.02
+                wicket = next_batter < 11 and rng.random() < 0.03
+                writer.writerow(
+                    [
+                        match_id,
+                        season,
+                        start.isoformat(),
+                        venue,
+                        innings,
+                        str(i // 6) + "." + str(i % 6 + 1),
+                        batting,
+                        bowling,
+                        batters[striker],
+                        batters[non_striker],
+                        bowlers[(i // 6) % 5],
+                        0 if wide else runs,
+                        1 if wide else 0,
+                        1 if wide else "",
+                        "",
+                        "",
+                        "",
+                        "",
+                        "bowled" if wicket else "",
+                        batters[striker] if wicket else "",
+                        "",
+                        "",
+                    ]
+                )
+                if wicket:
+                    striker, next_batter = next_batter, next_batter + 1
+                elif runs % 2 == 1:
+                    striker, non_striker = non_striker, striker
+
+
+def write_venues(path, venues):
+    """Write the venue file mapping each venue to its home team."""
+
+    with open(os.path.join(path, "venue_info.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["venue", "country"])
+        for team, team_venues in venues.items():
+            for venue in team_venues:
+                writer.writerow([venue, team])
+
+
+def write_rankings(path, teams, rng):
+    """Write a rankings html file per year with a random walk of ratings."""
+
+    rankings_path = os.path.join(path, "rankings_data")
+    os.makedirs(rankings_path, exist_ok=True)
+    ratings = {team: rng.uniform(20, 130) for team in teams}
+    for year in RANKINGS_YEARS:
+        parts = ["<html><body>"]
+        for month in MONTHS:
+            for team in teams:
+                ratings[team] = min(140, max(1, ratings[team] + rng.gauss(0, 3)))
+            table = sorted(teams, key=lambda team: -round(ratings[team]))
+            parts.append('<a name="' + month + '"> </a>')
+            parts.append("<div><span>" + month + "</span></div>")
+            parts.append(
+                '<table class="dataBox"><thead><tr><td></td><td>Team</td>'
+                + "<td>Rating</td></tr></thead>"
+            )
+            for rank, team in enumerate(table, 1):
+                parts.append(
+                    "<tr><td>"
+                    + str(rank)
+                    + "</td><td>"
+                    + team
+                    + "</td><td>"
+                    + str(round(ratings[team]))
+                    + "</td></tr>"
+                )
+            parts.append("</table>")
+        parts.append("</body></html>")
+        fname = os.path.join(rankings_path, "rankings_data_" + str(year) + ".html")
+        with open(fname, "w") as f:
+            f.write("\n".join(parts))
+
+
+def series_result(s):
+    """The howstat result text of a series, e.g. 'India 2-0' or 'Drawn 1-1'."""
+
+    home_wins = s["results"].count("home")
+    away_wins = s["results"].count("away")
+    if home_wins > away_wins:
+        return s["home"] + " " + str(home_wins) + "-" + str(away_wins)
+    if away_wins > home_wins:
+        return s["away"] + " " + str(away_wins) + "-" + str(home_wins)
+    return "Drawn " + str(home_wins) + "-" + str(away_wins)
+
+
+def write_series(path, series):
+    """Write the howstat series pages, one per decade."""
+
+    series_path = os.path.join(path, "series_data")
+    os.makedirs(series_path, exist_ok=True)
+    for decade, first_year in DECADES.items():
+        parts = [
+            '<html><body><table><tr><td><table class="TableLined">',
+            "<tr><td>Series</td><td>First Match</td><td>Matches</td>"
+            + "<td>Winner</td></tr>",
+        ]
+        for code, s in enumerate(series):
+            if not first_year <= s["start"].year < first_year + 10:
+                continue
+            parts.append(
+                "<tr><td>"
+                + '<a class="LinkTable" href="SeriesStats.asp?SeriesCode='
+                + str(code)
+                + '">'
+                + str(s["start"].year)
+                + " "
+                + s["home"]
+                + " v. "
+                + s["away"]
+                + "</a></td><td>"
+                + s["start"].strftime("%d/%m/%Y")
+                + '</td><td align="right">'
+                + str(s["num_matches"])
+                + "&nbsp;</td><td>"
+                + series_result(s)
+                + "</td></tr>"
+            )
+        parts.append("</table></td></tr></table></body></html>")
+        fname = os.path.join(series_path, "series_data_" + decade + ".html")
+        with open(fname, "w") as f:
+            f.write("\n".join(parts))
+
+
+def generate_corpus(path, scale=1, seed=0, balls_per_innings=30):
+    """Generate (or reuse) a synthetic corpus.
+
+    Parameters
+    ----------
+    path : str
+        the directory to write the corpus to
+    scale : int, optional
+        the size of the corpus relative to the real data
+    seed : int, optional
+        the random seed
+    balls_per_innings : int, optional
+        the length of each innings in the delivery files (kept short, since
+        no benchmarked stage reads the deliveries)
+
+    Returns
+    -------
+    summary : dict
+        the corpus parameters and the number of teams, series and matches
+    """
+
+    params = {"scale": scale, "seed": seed, "balls_per_innings": balls_per_innings}
+    corpus_file = os.path.join(path, CORPUS_FILE)
+    if os.path.exists(corpus_file):
+        with open(corpus_file, "r") as f:
+            summary = json.load(f)
+        if all(summary.get(key) == value for key, value in params.items()):
+            return summary
+
+    rng = random.Random(seed)
+    teams = team_names(scale)
+    venues = {team: [team + " Ground " + str(i) for i in range(1, 4)] for team in teams}
+    series = make_series(teams, SERIES_PER_TEAM * len(teams), rng)
+
+    os.makedirs(path, exist_ok=True)
+    write_venues(path, venues)
+    write_matches(path, series, venues, rng, balls_per_innings)
+    write_rankings(path, teams, rng)
+    write_series(path, series)
+
+    summary = dict(
+        params,
+        n_teams=len(teams),
+        n_series=len(series),
+        n_matches=sum(s["num_matches"] for s in series),
+    )
+    with open(corpus_file, "w") as f:
+        json.dump(summary, f)
+
+    return summary
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="the directory to write the corpus to")
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(generate_corpus(args.path, args.scale, args.seed))
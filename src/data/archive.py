@@ -0,0 +1,175 @@
+"""Reader of the cricsheet match files straight from the zip archive.
+
+The cricsheet download is a single zip of ``<id>_info.csv`` and ``<id>.csv``
+files. ``MatchArchive`` lists its members and decompresses them on demand,
+so the match files can be read (or selected by match id) without being
+extracted to thousands of small files.
+"""
+
+import csv
+import io
+import os
+import zipfile
+import zlib
+
+from src.data.match_info import match_id_from_filename
+
+
+class MatchArchive:
+    """The match info and delivery files of a cricsheet zip archive.
+
+    The member list is read once; each member is only decompressed when it
+    is opened. The archive can be sent to worker processes (the zip file is
+    re-opened in each of them).
+
+    Parameters
+    ----------
+    fname : str
+        the zip archive, e.g. ``data/raw/tests_male_csv2.zip``
+    """
+
+    def __init__(self, fname):
+
+        self.fname_ = fname
+        self.zipfile_ = None
+        self.infos_ = {}
+        self.matches_ = {}
+        for info in self.zipfile.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or not name.endswith(".csv"):
+                continue
+            # skip any csv which is not a match file (e.g. a readme table)
+            try:
+                match_id = match_id_from_filename(name)
+            except ValueError:
+                continue
+            self.infos_[info.filename] = info
+            kind = "info" if name.endswith("_info.csv") else "deliveries"
+            self.matches_.setdefault(match_id, {})[kind] = info.filename
+
+    @property
+    def zipfile(self):
+        """zipfile.ZipFile: the open archive, opened on first use."""
+        if self.zipfile_ is None:
+            self.zipfile_ = zipfile.ZipFile(self.fname_, "r")
+        return self.zipfile_
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["zipfile_"] = None
+        return state
+
+    def __len__(self):
+        return len(self.matches_)
+
+    def close(self):
+        """Close the archive (it is re-opened if a member is read again)."""
+
+        if self.zipfile_ is not None:
+            self.zipfile_.close()
+            self.zipfile_ = None
+
+    def match_ids(self):
+        """The sorted ids of the matches in the archive."""
+
+        return sorted(self.matches_)
+
+    def info_members(self, match_ids=None):
+        """The _info.csv members (of the given matches, default all)."""
+
+        return self._members("info", match_ids)
+
+    def delivery_members(self, match_ids=None):
+        """The delivery csv members (of the given matches, default all)."""
+
+        return self._members("deliveries", match_ids)
+
+    def _members(self, kind, match_ids):
+        if match_ids is None:
+            match_ids = self.match_ids()
+        return [
+            self.matches_[match_id][kind]
+            for match_id in match_ids
+            if kind in self.matches_.get(match_id, {})
+        ]
+
+    def fingerprint(self, member):
+        """The size and CRC-32 of a member, read from the archive directory.
+
+        These identify the member's contents without decompressing it.
+        """
+
+        info = self.infos_[member]
+        return [info.file_size, info.CRC]
+
+    def open(self, member, newline=None):
+        """Open a member as a text file, decompressing it as it is read.
+
+        As for the builtin ``open``, line endings are translated unless
+        ``newline=""`` (as for reading with the csv module).
+        """
+
+        return io.TextIOWrapper(
+            self.zipfile.open(member, "r"), encoding="utf-8", newline=newline
+        )
+
+    def extract(self, match_datapath):
+        """Extract the match files into a directory, where they changed.
+
+        A file is only (re)written if it is missing or its size or CRC-32
+        differs from the member's, so unchanged files keep their contents
+        and modification times. Files are written to a temporary name and
+        renamed, so an interrupted extraction never leaves a partial file.
+
+        Parameters
+        ----------
+        match_datapath : str
+            the directory to extract to, e.g. ``data/raw/match_data/``
+
+        Returns
+        -------
+        extracted : list of str
+            the files which were written
+        """
+
+        os.makedirs(match_datapath, exist_ok=True)
+        extracted = []
+        for member, info in self.infos_.items():
+            fname = os.path.join(match_datapath, os.path.basename(member))
+            if _file_crc(fname, info.file_size) == info.CRC:
+                continue
+            tmp_fname = fname + ".part"
+            with self.zipfile.open(member, "r") as src, open(tmp_fname, "wb") as dst:
+                while True:
+                    block = src.read(1 << 16)
+                    if not block:
+                        break
+                    dst.write(block)
+            os.replace(tmp_fname, fname)
+            extracted.append(fname)
+
+        return extracted
+
+    def iter_rows(self, match_ids=None):
+        """Yield the raw csv rows of the delivery members one by one.
+
+        Parameters
+        ----------
+        match_ids : list of int, optional
+            the matches to read (default all, in match id order)
+        """
+
+        for member in self.delivery_members(match_ids):
+            with self.open(member, newline="") as f:
+                reader = csv.reader(f)
+                next(reader)  # skip the header
+                yield from reader
+
+
+def _file_crc(fname, size):
+    """The CRC-32 of a file (None if it is missing or not of the given size)."""
+
+    if not os.path.exists(fname) or os.path.getsize(fname) != size:
+        return None
+    with open(fname, "rb") as f:
+        return zlib.crc32(f.read())
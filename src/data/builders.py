@@ -0,0 +1,93 @@
+"""Helpers to accumulate rows and materialise them as a DataFrame in one go."""
+
+import pandas as pd
+
+
+class FrameBuilder:
+    """Columnar row accumulator with a fixed schema.
+
+    Rows are appended to plain Python lists (one per column) and the
+    DataFrame is only built once, in ``to_frame``. This avoids the quadratic
+    cost of growing a DataFrame with ``pd.concat`` inside a loop.
+
+    Parameters
+    ----------
+    schema : dict
+        an (ordered) mapping of column name to dtype
+    """
+
+    def __init__(self, schema):
+
+        self.schema_ = dict(schema)
+        self.columns_ = {col: [] for col in self.schema_}
+        self.nrows_ = 0
+
+    def __len__(self):
+        return self.nrows_
+
+    def append(self, row=None, **values):
+        """Append a single row.
+
+        Parameters
+        ----------
+        row : dict or sequence, optional
+            the row values, either keyed by column or in schema order
+        **values
+            the row values as keyword arguments (alternative to ``row``)
+        """
+
+        if row is None:
+            row = values
+        if isinstance(row, dict):
+            for col, column in self.columns_.items():
+                column.append(row[col])
+        else:
+            if len(row) != len(self.columns_):
+                raise ValueError(
+                    "row has "
+                    + str(len(row))
+                    + " values but the schema has "
+                    + str(len(self.columns_))
+                    + " columns"
+                )
+            for column, value in zip(self.columns_.values(), row):
+                column.append(value)
+        self.nrows_ += 1
+
+    def extend(self, rows):
+        """Append an iterable of rows (dicts or sequences in schema order)."""
+
+        for row in rows:
+            self.append(row)
+
+    def extend_columns(self, columns):
+        """Append whole columns at once, e.g. from another DataFrame.
+
+        Parameters
+        ----------
+        columns : dict or pd.DataFrame
+            a mapping of column name to equal-length sequences of values
+        """
+
+        lengths = {len(columns[col]) for col in self.columns_}
+        if len(lengths) > 1:
+            raise ValueError("columns have unequal lengths")
+        for col, column in self.columns_.items():
+            column.extend(list(columns[col]))
+        self.nrows_ += lengths.pop() if lengths else 0
+
+    def to_frame(self):
+        """Materialise the accumulated rows as a DataFrame.
+
+        Returns
+        -------
+        df : pd.DataFrame
+            the DataFrame with the columns and dtypes of the schema
+        """
+
+        data = {
+            col: pd.Series(self.columns_[col], dtype=dtype)
+            for col, dtype in self.schema_.items()
+        }
+
+        return pd.DataFrame(data, columns=list(self.schema_))
@@ -0,0 +1,488 @@
+"""Columnar, season-partitioned store of the ball-by-ball delivery data.
+
+The cricsheet delivery csv files repeat the match, venue, team and player
+names as text on every ball. The store keeps one compressed ``.npz`` file per
+season, with one typed array per column:
+
+* teams, venues, players and wicket types are dictionary-encoded as integer
+  codes against dictionaries shared by all partitions (-1 means missing)
+* innings, over, ball and the run columns are small integers (missing
+  extras are stored as 0)
+* the ``ball`` column of the csv (e.g. ``12.3``) is split into the integer
+  ``over`` (12) and ``ball`` (3) columns
+
+Since ``np.load`` reads the arrays of an ``.npz`` file lazily, only the
+requested columns of the requested seasons are ever read from disk.
+"""
+
+import argparse
+import csv
+import glob
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# the columns of the delivery csv files
+CSV_COLUMNS = [
+    "match_id",
+    "season",
+    "start_date",
+    "venue",
+    "innings",
+    "ball",
+    "batting_team",
+    "bowling_team",
+    "striker",
+    "non_striker",
+    "bowler",
+    "runs_off_bat",
+    "extras",
+    "wides",
+    "noballs",
+    "byes",
+    "legbyes",
+    "penalty",
+    "wicket_type",
+    "player_dismissed",
+    "other_wicket_type",
+    "other_player_dismissed",
+]
+
+# dictionary-encoded columns, the dictionary they use and the code dtype
+CATEGORICAL_COLUMNS = {
+    "venue": ("venues", "int16"),
+    "batting_team": ("teams", "int16"),
+    "bowling_team": ("teams", "int16"),
+    "striker": ("players", "int32"),
+    "non_striker": ("players", "int32"),
+    "bowler": ("players", "int32"),
+    "wicket_type": ("wicket_types", "int8"),
+    "player_dismissed": ("players", "int32"),
+    "other_wicket_type": ("wicket_types", "int8"),
+    "other_player_dismissed": ("players", "int32"),
+}
+
+# integer columns and their dtypes
+INTEGER_COLUMNS = {
+    "match_id": "int32",
+    "innings": "int8",
+    "over": "int16",
+    "ball": "int8",
+    "runs_off_bat": "int16",
+    "extras": "int16",
+    "wides": "int16",
+    "noballs": "int16",
+    "byes": "int16",
+    "legbyes": "int16",
+    "penalty": "int16",
+}
+
+# the columns held in the store, in order ("season" is the partition key)
+STORE_COLUMNS = [
+    "match_id",
+    "season",
+    "start_date",
+    "venue",
+    "innings",
+    "over",
+    "ball",
+    "batting_team",
+    "bowling_team",
+    "striker",
+    "non_striker",
+    "bowler",
+    "runs_off_bat",
+    "extras",
+    "wides",
+    "noballs",
+    "byes",
+    "legbyes",
+    "penalty",
+    "wicket_type",
+    "player_dismissed",
+    "other_wicket_type",
+    "other_player_dismissed",
+]
+
+DICTIONARY_FILE = "dictionaries.json"
+PARTITION_FILE = "deliveries.npz"
+
+
+class Dictionary:
+    """Append-only mapping between category values and integer codes.
+
+    Parameters
+    ----------
+    values : list of str, optional
+        the initial values, whose codes are their positions in the list
+    """
+
+    def __init__(self, values=None):
+
+        self.values_ = list(values) if values is not None else []
+        self.codes_ = {value: code for code, value in enumerate(self.values_)}
+
+    def __len__(self):
+        return len(self.values_)
+
+    def encode(self, values, dtype="int32"):
+        """Encode an array of values, adding any new values to the dictionary.
+
+        Parameters
+        ----------
+        values : array-like
+            the values to encode (missing values are encoded as -1)
+        dtype : str, optional
+            the dtype of the returned codes
+
+        Returns
+        -------
+        codes : np.ndarray
+            the integer codes
+        """
+
+        # factorize locally, then only map the unique values to global codes
+        local_codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        global_codes = np.empty(len(uniques) + 1, dtype=dtype)
+        global_codes[-1] = -1
+        for i, value in enumerate(uniques):
+            code = self.codes_.get(value)
+            if code is None:
+                code = len(self.values_)
+                self.codes_[value] = code
+                self.values_.append(value)
+            global_codes[i] = code
+
+        return global_codes[local_codes]
+
+    def lookup(self, values):
+        """Get the codes of known values (unknown values are ignored)."""
+
+        return np.array(
+            [self.codes_[value] for value in values if value in self.codes_],
+            dtype="int64",
+        )
+
+
+def season_partition(season):
+    """Directory name of the partition of a season, e.g. 'season=2011-12'."""
+
+    return "season=" + str(season).replace("/", "-")
+
+
+def read_season(fname):
+    """Read the season of a delivery file from its first data row."""
+
+    with open(fname, "r", newline="") as f:
+        reader = csv.reader(f)
+        next(reader)
+        return next(reader)[1]
+
+
+def ball_numbers(over, ball, previous_over, previous_ball):
+    """The ball-within-over numbers of deliveries from their csv values.
+
+    Cricsheet writes the ball as a decimal, so the tenth ball of over 179
+    is ``179.1`` (after ``179.9``) and the twentieth ``179.2``. A ball whose
+    number drops back within an over to one whose tenfold follows the
+    previous ball is read as that tenfold.
+
+    Parameters
+    ----------
+    over, ball : int or np.ndarray
+        the over and ball numbers as written
+    previous_over, previous_ball : int or np.ndarray
+        those of the previous delivery of the same innings, as written or as
+        read by this function (-1 if there is none)
+
+    Returns
+    -------
+    ball : int or np.ndarray
+        the ball numbers, counting every delivery of the over
+    """
+
+    tens = (
+        (over == previous_over) & (ball < previous_ball) & (ball * 10 > previous_ball)
+    )
+    if np.ndim(tens) == 0:
+        return ball * 10 if tens else ball
+    return np.where(tens, ball * 10, ball)
+
+
+def split_ball(ball, innings=None):
+    """Split csv ball values such as '12.3' into over and ball numbers.
+
+    Parameters
+    ----------
+    ball : array-like of str
+        the ball column as text, in delivery order
+    innings : array-like, optional
+        a key of the innings of each ball (e.g. the match id and innings),
+        so that the balls of consecutive innings are not compared
+
+    Returns
+    -------
+    over, ball : np.ndarray
+        the over and ball-within-over numbers (see ``ball_numbers``)
+    """
+
+    parts = pd.Series(ball, dtype=object).str.split(".", n=1, expand=True)
+    over = parts[0].astype("int64").to_numpy()
+    ball = parts[1].astype("int64").to_numpy()
+
+    previous_over = np.r_[-1, over[:-1]]
+    if innings is not None:
+        innings = np.asarray(innings)
+        previous_over[1:][innings[1:] != innings[:-1]] = -1
+    ball = ball_numbers(over, ball, previous_over, np.r_[-1, ball[:-1]])
+
+    return over.astype("int16"), ball.astype("int8")
+
+
+def encode_deliveries(df, dictionaries):
+    """Encode a frame of raw (text) delivery rows as typed column arrays.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        the delivery rows, read from csv as text
+    dictionaries : dict of Dictionary
+        the shared dictionaries, updated with any new values
+
+    Returns
+    -------
+    columns : dict of np.ndarray
+        the typed columns of the store (without the season)
+    """
+
+    columns = {}
+    innings = df["match_id"].astype(str) + "_" + df["innings"].astype(str)
+    over, ball = split_ball(df["ball"], innings.to_numpy())
+    for col in STORE_COLUMNS:
+        if col == "season":
+            continue
+        elif col == "over":
+            columns[col] = over
+        elif col == "ball":
+            columns[col] = ball
+        elif col == "start_date":
+            columns[col] = pd.to_datetime(df[col]).to_numpy().astype("datetime64[D]")
+        elif col in CATEGORICAL_COLUMNS:
+            name, dtype = CATEGORICAL_COLUMNS[col]
+            columns[col] = dictionaries[name].encode(df[col], dtype)
+        else:
+            values = pd.to_numeric(df[col]).fillna(0)
+            columns[col] = values.to_numpy().astype(INTEGER_COLUMNS[col])
+
+    return columns
+
+
+def build_delivery_store(match_datapath, store_path, exclude=None):
+    """Convert the delivery csv files to the columnar store.
+
+    Parameters
+    ----------
+    match_datapath : str
+        the directory containing the cricsheet match csv files
+    store_path : str
+        the directory to write the store to (existing partitions are replaced,
+        and those of seasons without any delivery files are removed)
+    exclude : list of str, optional
+        the names of delivery files to leave out, e.g. the files quarantined
+        by ``src.data.validate``
+
+    Returns
+    -------
+    n_deliveries : dict
+        the number of deliveries written for each season
+    """
+
+    exclude = {os.path.basename(fname) for fname in exclude or []}
+    fnames = [
+        fname
+        for fname in sorted(glob.glob(os.path.join(match_datapath, "*.csv")))
+        if not fname.endswith("_info.csv") and os.path.basename(fname) not in exclude
+    ]
+
+    # group the files by season so each partition is built on its own
+    seasons = {}
+    for fname in fnames:
+        seasons.setdefault(read_season(fname), []).append(fname)
+
+    dictionaries = {name: Dictionary() for name, _ in CATEGORICAL_COLUMNS.values()}
+    n_deliveries = {}
+    os.makedirs(store_path, exist_ok=True)
+    for season in sorted(seasons):
+        df = pd.concat(
+            [pd.read_csv(fname, dtype=str) for fname in seasons[season]],
+            ignore_index=True,
+        )
+        columns = encode_deliveries(df, dictionaries)
+
+        partition = os.path.join(store_path, season_partition(season))
+        os.makedirs(partition, exist_ok=True)
+        np.savez_compressed(os.path.join(partition, PARTITION_FILE), **columns)
+        n_deliveries[season] = len(df)
+        print("wrote", len(df), "deliveries for season", season)
+
+    # remove the partitions of seasons which no longer have any files, so
+    # they can't be loaded with the dictionaries of this build
+    partitions = {season_partition(season) for season in seasons}
+    for partition in glob.glob(os.path.join(store_path, "season=*")):
+        if os.path.basename(partition) not in partitions:
+            shutil.rmtree(partition)
+
+    # the dictionaries are built afresh, so they are only valid for the
+    # partitions written above
+    with open(os.path.join(store_path, DICTIONARY_FILE), "w") as f:
+        json.dump(
+            {
+                "seasons": sorted(seasons),
+                **{name: d.values_ for name, d in dictionaries.items()},
+            },
+            f,
+        )
+
+    return n_deliveries
+
+
+def load_dictionaries(store_path):
+    """Load the shared dictionaries (and list of seasons) of a store."""
+
+    with open(os.path.join(store_path, DICTIONARY_FILE), "r") as f:
+        return json.load(f)
+
+
+def _load_partition(fname, season, columns, needed, team_codes, match_ids):
+    """Load the needed columns of a partition and filter its rows.
+
+    Rows are kept if a team with one of the ``team_codes`` is batting or
+    bowling and their match is one of the ``match_ids`` (either filter is
+    skipped if None).
+    """
+
+    with np.load(fname) as partition:
+        arrays = {col: partition[col] for col in needed}
+
+    n_rows = len(next(iter(arrays.values()))) if arrays else 0
+    mask = np.ones(n_rows, dtype=bool)
+    if team_codes is not None:
+        mask &= np.isin(arrays["batting_team"], team_codes) | np.isin(
+            arrays["bowling_team"], team_codes
+        )
+    if match_ids is not None:
+        mask &= np.isin(arrays["match_id"], match_ids)
+    if not mask.all():
+        arrays = {col: values[mask] for col, values in arrays.items()}
+
+    frame = {}
+    for col in columns:
+        if col == "season":
+            frame[col] = np.full(int(mask.sum()), season, dtype=object)
+        else:
+            frame[col] = arrays[col]
+    return pd.DataFrame(frame, columns=columns)
+
+
+def _decode(df, columns, dictionaries):
+    """Replace the codes of the categorical columns with pandas categoricals."""
+
+    for col in columns:
+        if col in CATEGORICAL_COLUMNS:
+            name = CATEGORICAL_COLUMNS[col][0]
+            df[col] = pd.Categorical.from_codes(
+                df[col].to_numpy().astype("int64"), dictionaries[name]
+            )
+    if "season" in columns:
+        df["season"] = pd.Categorical(df["season"], dictionaries["seasons"])
+
+
+def load_deliveries(
+    store_path,
+    columns=None,
+    seasons=None,
+    teams=None,
+    match_ids=None,
+    decode=True,
+):
+    """Load (a subset of) the delivery data from the columnar store.
+
+    Parameters
+    ----------
+    store_path : str
+        the directory of the store
+    columns : list of str, optional
+        the columns to load (default all, see ``STORE_COLUMNS``)
+    seasons : list of str, optional
+        only load these seasons, e.g. ``["2011/12", "2012"]``
+    teams : list of str, optional
+        only load deliveries in which one of these teams is batting or bowling
+    match_ids : list of int, optional
+        only load deliveries from these matches
+    decode : bool, optional
+        if True, return dictionary-encoded columns as pandas categoricals;
+        otherwise return their integer codes
+
+    Returns
+    -------
+    df : pd.DataFrame
+        the selected deliveries
+    """
+
+    dictionaries = load_dictionaries(store_path)
+    if columns is None:
+        columns = STORE_COLUMNS
+    if seasons is None:
+        seasons = dictionaries["seasons"]
+    else:
+        seasons = [str(season) for season in seasons]
+
+    # columns needed for filtering are loaded even if not requested
+    needed = [col for col in columns if col != "season"]
+    team_codes = None
+    if teams is not None:
+        team_codes = Dictionary(dictionaries["teams"]).lookup(teams)
+        needed += ["batting_team", "bowling_team"]
+    if match_ids is not None:
+        needed += ["match_id"]
+    needed = list(dict.fromkeys(needed))
+
+    frames = []
+    for season in seasons:
+        fname = os.path.join(store_path, season_partition(season), PARTITION_FILE)
+        if os.path.exists(fname):
+            frames.append(
+                _load_partition(fname, season, columns, needed, team_codes, match_ids)
+            )
+
+    if len(frames) == 0:
+        df = pd.DataFrame(columns=columns)
+    else:
+        df = pd.concat(frames, ignore_index=True)
+
+    if decode:
+        _decode(df, columns, dictionaries)
+
+    return df
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Convert the delivery csv files to a columnar store."
+    )
+    parser.add_argument("match_datapath", help="the raw match data path")
+    parser.add_argument("store_path", help="the path to write the store to")
+    parser.add_argument(
+        "--quarantine",
+        help="a quarantine report (see src.data.validate) of files to leave out",
+    )
+    args = parser.parse_args()
+
+    exclude = None
+    if args.quarantine is not None:
+        exclude = pd.read_csv(args.quarantine)["file"].unique().tolist()
+    build_delivery_store(args.match_datapath, args.store_path, exclude=exclude)
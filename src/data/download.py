@@ -0,0 +1,319 @@
+"""Concurrent download of the raw data, with conditional requests.
+
+The rankings pages, howstat series pages and the cricsheet match archive
+are fetched by a pool of threads sharing one (connection-pooled) session.
+The match files of the archive are then extracted into ``match_data/``,
+which the pipeline reads.
+Every response's ``ETag`` and ``Last-Modified`` headers are kept in a cache
+file next to the raw data, so a refresh sends conditional requests and
+only the files which changed on the server are downloaded again. Failed
+downloads (including a connection dropped while the body is streamed)
+are retried with exponential backoff, and files are written to a
+temporary file and renamed, so an interrupted download never leaves a
+truncated file behind.
+
+Usage: python -m src.data.download data/raw/ [--jobs N]
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.data.archive import MatchArchive
+from src.data.manifest import file_hash
+
+# the source of each kind of raw file; the templates are filled in by
+# ``raw_downloads`` and can be replaced (e.g. to point at a local server)
+URLS = {
+    "rankings": "https://web.archive.org/web/20130320093711/"
+    + "http://www.icc-cricket.com/match_zone/test_ranking.php?year={year}",
+    "series": "http://www.howstat.com/cricket/Statistics/Series/SeriesList.asp"
+    + "?Group={first}0101{last}1231&Range={first}%20to%20{last}",
+    "matches": "https://cricsheet.org/downloads/tests_male_csv2.zip",
+}
+
+# the kinds of raw data
+SOURCES = ("rankings", "series", "matches")
+
+# the howstat series pages, one per decade
+SERIES_DECADES = {"2000_09": 2000, "2010_19": 2010, "2020_29": 2020}
+
+# the cache of response headers, kept in the raw data path
+CACHE_FILE = "download_cache.json"
+
+# responses worth retrying: rate limiting and (transient) server errors
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class DownloadError(Exception):
+    """Raised when a file can't be downloaded (after retrying)."""
+
+
+class _TransientError(Exception):
+    """A failure worth retrying: a dropped connection, timeout or busy server."""
+
+
+class Downloader:
+    """Fetches files concurrently over a pooled session.
+
+    Parameters
+    ----------
+    cache_file : str
+        the json file recording the headers of each downloaded file
+    n_jobs : int, optional
+        the maximum number of concurrent requests
+    retries : int, optional
+        the number of times a failed download is retried
+    backoff : float, optional
+        the wait (seconds) before the first retry, doubled for every retry
+    timeout : float, optional
+        the connect and read timeout of each request (seconds)
+    """
+
+    def __init__(self, cache_file, n_jobs=4, retries=3, backoff=1.0, timeout=30):
+
+        self.cache_file_ = cache_file
+        self.n_jobs_ = n_jobs
+        self.retries_ = retries
+        self.backoff_ = backoff
+        self.timeout_ = timeout
+        self.lock_ = threading.Lock()
+
+        try:
+            with open(cache_file, "r") as f:
+                self.cache_ = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.cache_ = {}
+
+        self.session_ = requests.Session()
+        adapter = HTTPAdapter(pool_connections=n_jobs, pool_maxsize=n_jobs)
+        self.session_.mount("http://", adapter)
+        self.session_.mount("https://", adapter)
+
+    def fetch_all(self, downloads):
+        """Download files concurrently, skipping those which are unchanged.
+
+        Parameters
+        ----------
+        downloads : list of tuple
+            the (url, filename) of each file
+
+        Returns
+        -------
+        statuses : dict
+            "downloaded" or "not modified" for each filename
+
+        Raises
+        ------
+        DownloadError
+            if any file could not be downloaded (the others are still kept)
+        """
+
+        with ThreadPoolExecutor(max_workers=self.n_jobs_) as executor:
+            futures = {
+                fname: executor.submit(self.fetch, url, fname)
+                for url, fname in downloads
+            }
+        self.save()
+
+        statuses = {}
+        errors = []
+        for fname, future in futures.items():
+            try:
+                statuses[fname] = future.result()
+            except DownloadError as err:
+                errors.append(str(err))
+        if errors:
+            raise DownloadError("\n".join(errors))
+        return statuses
+
+    def fetch(self, url, fname):
+        """Download a single file, unless it is unchanged on the server.
+
+        The whole fetch is retried with exponential backoff, so a transient
+        failure while the body is streamed is retried like a failed request.
+
+        Returns
+        -------
+        status : str
+            "downloaded" or "not modified"
+        """
+
+        for attempt in range(self.retries_ + 1):
+            try:
+                return self._fetch_once(url, fname)
+            except _TransientError as err:
+                if attempt == self.retries_:
+                    raise DownloadError("failed to download " + url + ": " + str(err))
+            time.sleep(self.backoff_ * 2**attempt)
+
+    def _fetch_once(self, url, fname):
+        """A single attempt at ``fetch``, raising _TransientError to retry."""
+
+        try:
+            response = self.session_.get(
+                url,
+                headers=self._conditional_headers(url, fname),
+                timeout=self.timeout_,
+                stream=True,
+            )
+        except (requests.ConnectionError, requests.Timeout) as err:
+            raise _TransientError(str(err))
+
+        try:
+            if response.status_code in RETRY_STATUS:
+                raise _TransientError("HTTP " + str(response.status_code))
+            if response.status_code == 304:
+                print("not modified:", fname)
+                return "not modified"
+            if response.status_code != 200:
+                raise DownloadError(
+                    "failed to download " + url + ": HTTP " + str(response.status_code)
+                )
+            self._write(response, url, fname)
+        finally:
+            response.close()
+
+        with self.lock_:
+            self.cache_[os.path.normpath(fname)] = {
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "sha256": file_hash(fname),
+            }
+        print("downloaded:", fname)
+        return "downloaded"
+
+    def _write(self, response, url, fname):
+        """Write the body of a response to a file, via a temporary file."""
+
+        os.makedirs(os.path.dirname(fname) or ".", exist_ok=True)
+        tmp_fname = fname + "." + str(threading.get_ident()) + ".part"
+        try:
+            with open(tmp_fname, "wb") as f:
+                for block in response.iter_content(1 << 16):
+                    f.write(block)
+            os.replace(tmp_fname, fname)
+        except requests.RequestException as err:
+            # e.g. the connection was reset or timed out during the body
+            raise _TransientError(str(err))
+        except OSError as err:
+            raise DownloadError("failed to download " + url + ": " + str(err))
+        finally:
+            if os.path.exists(tmp_fname):
+                os.remove(tmp_fname)
+
+    def _conditional_headers(self, url, fname):
+        """The validators of a file, if it is intact since it was downloaded."""
+
+        with self.lock_:
+            entry = self.cache_.get(os.path.normpath(fname))
+        if entry is None or entry["url"] != url or not os.path.exists(fname):
+            return {}
+        if file_hash(fname) != entry["sha256"]:
+            return {}
+        headers = {}
+        if entry["etag"] is not None:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"] is not None:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def save(self):
+        """Write the header cache atomically (via a rename)."""
+
+        os.makedirs(os.path.dirname(self.cache_file_) or ".", exist_ok=True)
+        tmp_fname = self.cache_file_ + ".tmp"
+        with self.lock_:
+            with open(tmp_fname, "w") as f:
+                json.dump(self.cache_, f, indent=1)
+        os.replace(tmp_fname, self.cache_file_)
+
+
+def raw_downloads(raw_path, year_start, year_end, urls=URLS, kinds=SOURCES):
+    """The url and filename of every raw data file.
+
+    Parameters
+    ----------
+    raw_path : str
+        the raw data path (with a trailing slash)
+    year_start, year_end : int
+        the years of the rankings pages
+    urls : dict, optional
+        the url templates of the rankings, series and match data
+    kinds : tuple of str, optional
+        the sources to download (a subset of ``SOURCES``)
+
+    Returns
+    -------
+    downloads : list of tuple
+        the (url, filename) of each file
+    """
+
+    downloads = []
+    if "rankings" in kinds:
+        for year in range(year_start, year_end + 1):
+            downloads.append(
+                (
+                    urls["rankings"].format(year=year),
+                    raw_path + "rankings_data/rankings_data_" + str(year) + ".html",
+                )
+            )
+    if "series" in kinds:
+        for decade, first in SERIES_DECADES.items():
+            downloads.append(
+                (
+                    urls["series"].format(first=first, last=first + 9),
+                    raw_path + "series_data/series_data_" + decade + ".html",
+                )
+            )
+    if "matches" in kinds:
+        downloads.append(
+            (urls["matches"], raw_path + os.path.basename(urls["matches"]))
+        )
+    return downloads
+
+
+def extract_matches(raw_path, urls=URLS):
+    """Extract the downloaded cricsheet archive into ``match_data/``.
+
+    Only the match files which changed are written (see
+    ``MatchArchive.extract``), so the pipeline only re-runs the stages whose
+    match files actually changed.
+
+    Returns
+    -------
+    extracted : list of str
+        the match files which were written
+    """
+
+    archive = MatchArchive(raw_path + os.path.basename(urls["matches"]))
+    try:
+        extracted = archive.extract(raw_path + "match_data/")
+    finally:
+        archive.close()
+    print("extracted", len(extracted), "changed match files")
+    return extracted
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Download the raw data.")
+    parser.add_argument("raw_path", help="the raw data path")
+    parser.add_argument(
+        "--jobs", type=int, default=4, help="number of concurrent downloads"
+    )
+    parser.add_argument("--retries", type=int, default=3)
+    args = parser.parse_args()
+
+    downloader = Downloader(
+        args.raw_path + CACHE_FILE, n_jobs=args.jobs, retries=args.retries
+    )
+    downloader.fetch_all(raw_downloads(args.raw_path, 2003, 2013))
+    extract_matches(args.raw_path)
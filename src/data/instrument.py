@@ -0,0 +1,290 @@
+"""Per-stage timing, memory and throughput instrumentation of the pipeline.
+
+Stages are marked with the ``stage`` context manager or the ``instrumented``
+decorator. They are only measured while a ``RunReport`` is active, so the
+instrumented functions run as normal (at the cost of one check) otherwise::
+
+    report = RunReport(trace_memory=True, profile_dir="profiles/")
+    with report.activate():
+        processed_data.rankings_to_csv()
+    report.save("run_report.json")
+
+Within a stage, ``record(files=..., rows=...)`` adds to the number of files
+and rows it processed. Stages may be nested; each record names its parent.
+"""
+
+import cProfile
+import datetime
+import functools
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+# the report which stages are currently recorded to (if any)
+_ACTIVE_REPORT = None
+
+
+def peak_rss_mib():
+    """The peak resident set size of the process so far (MiB), if known."""
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak / 2**20
+    return peak / 2**10
+
+
+class StageRecord:
+    """The measurements of a single run of a stage.
+
+    The CPU time is that of the main process only (not of any workers), and
+    the RSS peak is the high-water mark of the process when the stage ended.
+    """
+
+    def __init__(self, name, parent=None):
+
+        self.name = name
+        self.parent = parent
+        self.files = 0
+        self.rows = 0
+        self.wall_s = None
+        self.cpu_s = None
+        self.rss_peak_mib = None
+        self.traced_peak_mib = None
+        self.profile = None
+        self.traced_peak_ = 0
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "parent": self.parent,
+            "wall_s": self.wall_s,
+            "cpu_s": self.cpu_s,
+            "files": self.files,
+            "rows": self.rows,
+            "rss_peak_mib": self.rss_peak_mib,
+            "traced_peak_mib": self.traced_peak_mib,
+            "profile": self.profile,
+        }
+
+
+class RunReport:
+    """Collects the stage records of a pipeline run.
+
+    Parameters
+    ----------
+    trace_memory : bool, optional
+        trace Python allocations with ``tracemalloc`` to get the peak memory
+        of every stage (this slows the run down)
+    profile_dir : str, optional
+        if given, run each top-level stage under ``cProfile`` and dump the
+        statistics to ``<profile_dir>/<stage>.prof``
+    """
+
+    def __init__(self, trace_memory=False, profile_dir=None):
+
+        self.trace_memory_ = trace_memory
+        self.profile_dir_ = profile_dir
+        self.stages_ = []
+        self.stack_ = []
+        self.started_ = None
+        self.wall_s_ = None
+
+    def activate(self):
+        """Context manager recording stages to this report while active."""
+
+        return _Activation(self)
+
+    def to_dict(self):
+        return {
+            "started": self.started_,
+            "argv": sys.argv,
+            "wall_s": self.wall_s_,
+            "rss_peak_mib": peak_rss_mib(),
+            "stages": [record.to_dict() for record in self.stages_],
+        }
+
+    def save(self, fname):
+        """Write the report as json (atomically, via a rename)."""
+
+        tmp_fname = fname + ".tmp"
+        with open(tmp_fname, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_fname, fname)
+
+    def summary(self):
+        """Print the time, throughput and memory of each stage."""
+
+        print(
+            "%-32s %9s %9s %7s %9s %10s"
+            % ("stage", "wall s", "cpu s", "files", "rows", "peak MiB")
+        )
+        for record in self.stages_:
+            name = record.name if record.parent is None else "  " + record.name
+            peak = record.traced_peak_mib
+            if peak is None:
+                peak = record.rss_peak_mib
+            print(
+                "%-32s %9.3f %9.3f %7d %9d %10s"
+                % (
+                    name,
+                    record.wall_s,
+                    record.cpu_s,
+                    record.files,
+                    record.rows,
+                    "-" if peak is None else "%.1f" % peak,
+                )
+            )
+
+
+class _Activation:
+    """Makes a report the active one (see ``RunReport.activate``)."""
+
+    def __init__(self, report):
+
+        self.report_ = report
+        self.previous_ = None
+        self.started_tracing_ = False
+
+    def __enter__(self):
+
+        global _ACTIVE_REPORT
+
+        report = self.report_
+        self.previous_ = _ACTIVE_REPORT
+        _ACTIVE_REPORT = report
+        if report.trace_memory_ and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing_ = True
+        if report.profile_dir_ is not None:
+            os.makedirs(report.profile_dir_, exist_ok=True)
+        report.started_ = datetime.datetime.now().isoformat(timespec="seconds")
+        self.t0_ = time.perf_counter()
+        return report
+
+    def __exit__(self, *exc_info):
+
+        global _ACTIVE_REPORT
+
+        self.report_.wall_s_ = time.perf_counter() - self.t0_
+        if self.started_tracing_:
+            tracemalloc.stop()
+        _ACTIVE_REPORT = self.previous_
+        return False
+
+
+class stage:
+    """Context manager measuring a stage of the active report (if any).
+
+    Parameters
+    ----------
+    name : str
+        the name of the stage
+    """
+
+    def __init__(self, name):
+
+        self.name_ = name
+        self.report_ = None
+        self.record_ = None
+
+    def __enter__(self):
+
+        report = self.report_ = _ACTIVE_REPORT
+        if report is None:
+            return None
+
+        parent = report.stack_[-1] if report.stack_ else None
+        record = self.record_ = StageRecord(
+            self.name_, None if parent is None else parent.name
+        )
+        report.stages_.append(record)
+        report.stack_.append(record)
+
+        if tracemalloc.is_tracing():
+            # keep the parent's peak so far before measuring this stage alone
+            if parent is not None:
+                parent.traced_peak_ = max(
+                    parent.traced_peak_, tracemalloc.get_traced_memory()[1]
+                )
+            tracemalloc.reset_peak()
+
+        # cProfile can't be nested, so only top-level stages are profiled
+        self.profiler_ = None
+        if report.profile_dir_ is not None and parent is None:
+            self.profiler_ = cProfile.Profile()
+            self.profiler_.enable()
+
+        self.t0_ = time.perf_counter()
+        self.cpu0_ = time.process_time()
+        return record
+
+    def __exit__(self, *exc_info):
+
+        report = self.report_
+        if report is None:
+            return False
+
+        record = self.record_
+        record.wall_s = time.perf_counter() - self.t0_
+        record.cpu_s = time.process_time() - self.cpu0_
+
+        if self.profiler_ is not None:
+            self.profiler_.disable()
+            record.profile = os.path.join(report.profile_dir_, record.name + ".prof")
+            self.profiler_.dump_stats(record.profile)
+
+        if tracemalloc.is_tracing():
+            record.traced_peak_ = max(
+                record.traced_peak_, tracemalloc.get_traced_memory()[1]
+            )
+            record.traced_peak_mib = record.traced_peak_ / 2**20
+        record.rss_peak_mib = peak_rss_mib()
+
+        report.stack_.pop()
+        if report.stack_:
+            parent = report.stack_[-1]
+            parent.traced_peak_ = max(parent.traced_peak_, record.traced_peak_)
+        return False
+
+
+def instrumented(name=None):
+    """Decorator measuring every call of a function as a stage.
+
+    Parameters
+    ----------
+    name : str, optional
+        the name of the stage (default the function's qualified name)
+    """
+
+    def decorator(func):
+        stage_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _ACTIVE_REPORT is None:
+                return func(*args, **kwargs)
+            with stage(stage_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record(files=0, rows=0):
+    """Add to the files and rows processed by the current stage (if any)."""
+
+    if _ACTIVE_REPORT is not None and _ACTIVE_REPORT.stack_:
+        current = _ACTIVE_REPORT.stack_[-1]
+        current.files += files
+        current.rows += rows
@@ -3,13 +3,78 @@
 # # -*- coding: utf-8 -*-
 from pathlib import Path
 
-import requests
-import sys
+import argparse
+import os
 from bs4 import BeautifulSoup
 import pandas as pd
 import glob
-from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date as dtdate
+import numpy as np
+
+from src.data.archive import MatchArchive
+from src.data.builders import FrameBuilder
+from src.data.download import CACHE_FILE as DOWNLOAD_CACHE_FILE
+from src.data.download import (
+    SOURCES,
+    URLS,
+    Downloader,
+    extract_matches,
+    raw_downloads,
+)
+from src.data.instrument import RunReport, instrumented, record
+from src.data.manifest import Manifest
+from src.data.match_info import match_id_from_filename, parse_match_info
+from src.data.venues import VenueRegistry, UnresolvedVenueError
+
+MONTHS = [
+    "JANUARY",
+    "FEBRUARY",
+    "MARCH",
+    "APRIL",
+    "MAY",
+    "JUNE",
+    "JULY",
+    "AUGUST",
+    "SEPTEMBER",
+    "OCTOBER",
+    "NOVEMBER",
+    "DECEMBER",
+]
+
+# use the faster lxml tree builder for html if it is available
+try:
+    import lxml  # noqa: F401
+
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# column dtypes of the rankings data and the parsed match headers
+RANKINGS_SCHEMA = {
+    "year": "int64",
+    "month": object,
+    "team": object,
+    "ranking": "int64",
+    "rating": "float64",
+}
+MATCH_SCHEMA = {
+    "match_id": "int64",
+    "date": object,
+    "home_team": object,
+    "away_team": object,
+    "result": object,
+    "toss": object,
+}
+
+# the manifest of input files, kept in the processed data path
+MANIFEST_FILE = "input_manifest.json"
+RUN_REPORT_FILE = "run_report.json"
+
+# multiplier separating the team code from the year-month in rankings keys
+YM_STRIDE = 100000
 
 
 class RawData:
@@ -23,37 +88,47 @@ class RawData:
         the starting year of the download
     end_year : int
         the ending year of the download
+    n_jobs : int, optional
+        the maximum number of concurrent downloads
+    urls : dict, optional
+        the url templates of the sources (see ``src.data.download.URLS``)
     """
 
-    def __init__(self, datapath, year_start, year_end):
+    def __init__(self, datapath, year_start, year_end, n_jobs=4, urls=URLS):
 
         self._datapath = datapath
         self._year_start = year_start
         self._year_end = year_end
+        self._urls = urls
+        self.downloader_ = Downloader(datapath + DOWNLOAD_CACHE_FILE, n_jobs=n_jobs)
 
-    def download_rankings_data(self):
-        """Download the rankings data from html source."""
+    def download(self, kinds=SOURCES):
+        """Download the raw data files which changed at the source.
+
+        Parameters
+        ----------
+        kinds : tuple of str, optional
+            the sources to download: any of "rankings", "series", "matches"
 
-        # main url for rankings data
-        baseurl = (
-            "https://web.archive.org/web/20130320093711/"
-            + "http://www.icc-cricket.com/match_zone/test_ranking.php?year="
+        Returns
+        -------
+        statuses : dict
+            "downloaded" or "not modified" for each filename
+        """
+
+        statuses = self.downloader_.fetch_all(
+            raw_downloads(
+                self._datapath, self._year_start, self._year_end, self._urls, kinds
+            )
         )
+        if "matches" in kinds:
+            extract_matches(self._datapath, self._urls)
+        return statuses
 
-        # loop over the years in the range
-        for year in range(self._year_start, self._year_end + 1):
-            print("downloading rankings data for year ", year)
-            url = baseurl + str(year)
-            data_page = requests.get(url)  # fetch the data
-            # use beautiful soup to parse the data
-            soup = BeautifulSoup(data_page.content, "html.parser")
-            soup.prettify()
-            # write the prettified html to file
-            fname = "".join([self.outdir, "rankings_data_", str(year), ".html"])
-            with open(fname, "w") as f:
-                f.write(str(soup))
+    def download_rankings_data(self):
+        """Download the rankings data from html source (if changed)."""
 
-        return
+        return self.download(kinds=("rankings",))
 
 
 class ProcessData:
@@ -73,6 +148,20 @@ class ProcessData:
         the filename (and location) of the rankings csv file
     aggregate_file : str
         the filename (and location) of the aggregate csv file
+    n_workers : int, optional
+        the number of worker processes used to parse the match info files
+    incremental : bool, optional
+        if True, keep a manifest of the input files in the processed data path
+        and only re-parse files which are new or have changed
+    match_archive : str, optional
+        read the match info files from this cricsheet zip archive instead of
+        the ``match_data`` directory of the raw data path
+    exclude_matches : iterable of int, optional
+        the ids of matches to leave out, e.g. those quarantined by
+        ``src.data.validate``
+    manifest_key : str, optional
+        the key of the input manifest (see ``Manifest``), e.g. a hash of the
+        parsing code, so that rows parsed by other code are not reused
     """
 
     def __init__(
@@ -83,6 +172,11 @@ class ProcessData:
         year_end,
         rankings_file,
         aggregate_file,
+        n_workers=1,
+        incremental=False,
+        match_archive=None,
+        exclude_matches=None,
+        manifest_key=None,
     ):
 
         self.raw_datapath_ = raw_datapath
@@ -91,40 +185,191 @@ class ProcessData:
         self.year_end_ = year_end
         self.rankings_file_ = rankings_file
         self.aggregate_file_ = aggregate_file
+        self.n_workers_ = n_workers
+        self.incremental_ = incremental
+        self.match_archive_file_ = match_archive
+        self.match_archive_ = None
+        self.exclude_matches_ = set(exclude_matches or [])
+        self.manifest_key_ = manifest_key
+        self.manifest_ = None
+        self.venues_ = None
+        self.unresolved_venues_ = []
+        self.missing_rankings_months_ = []
+
+    @property
+    def venues(self):
+        """VenueRegistry: the venue - country index, loaded on first use."""
+        if self.venues_ is None:
+            self.venues_ = VenueRegistry(self.raw_datapath_ + "venue_info.csv")
+        return self.venues_
+
+    @property
+    def manifest(self):
+        """Manifest: the input file manifest (None if not incremental)."""
+        if self.incremental_ and self.manifest_ is None:
+            self.manifest_ = Manifest(
+                self.processed_datapath_ + MANIFEST_FILE, key=self.manifest_key_
+            )
+        return self.manifest_
+
+    @property
+    def match_archive(self):
+        """MatchArchive: the match archive (None if reading the directory)."""
+        if self.match_archive_file_ is not None and self.match_archive_ is None:
+            self.match_archive_ = MatchArchive(self.match_archive_file_)
+        return self.match_archive_
+
+    def match_info_files(self):
+        """The match info files: archive members or files of match_data."""
+        if self.match_archive is not None:
+            info_files = self.match_archive.info_members()
+        else:
+            info_files = glob.glob(self.raw_datapath_ + "match_data/*_info.csv")
+        if self.exclude_matches_:
+            info_files = [
+                info_file
+                for info_file in info_files
+                if match_id_from_filename(info_file) not in self.exclude_matches_
+            ]
+        return info_files
+
+    def _open_match_file(self, filename):
+        """Open a match file for reading, from the archive if there is one."""
+        if self.match_archive is not None:
+            return self.match_archive.open(filename)
+        return open(filename, "r")
+
+    def _fingerprint(self, filename):
+        """The manifest fingerprint of an archive member (None for files)."""
+        if self.match_archive is not None:
+            return self.match_archive.fingerprint(filename)
+        return None
+
+    def _rankings_fname(self, year):
+        """The rankings html file for a given year."""
+        return "".join(
+            [self.raw_datapath_, "rankings_data/rankings_data_", str(year), ".html"]
+        )
 
+    @instrumented()
     def rankings_to_csv(self):
         r"""Make a csv file of the rankings / ratings data."""
 
-        month_list = [
-            "JANUARY",
-            "FEBRUARY",
-            "MARCH",
-            "APRIL",
-            "MAY",
-            "JUNE",
-            "JULY",
-            "AUGUST",
-            "SEPTEMBER",
-            "OCTOBER",
-            "NOVEMBER",
-            "DECEMBER",
-        ]
-
-        data_agg = pd.DataFrame()  # initialize dataframe
-
-        # loop over months and years
-        for year in range(self.year_start_, self.year_end_ + 1):
-            for month in month_list:
-                try:
-                    YM_data = self.get_rankings_data(month, year)
-                    data_agg = pd.concat([data_agg, YM_data], ignore_index=True)
-                except AttributeError:
-                    pass
-
+        data_agg = FrameBuilder(RANKINGS_SCHEMA)  # initialize row accumulator
+        self.missing_rankings_months_ = []
+
+        # each year's html file is parsed once, optionally in parallel
+        # in incremental mode only new or changed files are parsed
+        years = list(range(self.year_start_, self.year_end_ + 1))
+        manifest = self.manifest
+        if manifest is not None:
+            manifest.prune("rankings", [self._rankings_fname(year) for year in years])
+            parse_years = [
+                year
+                for year in years
+                if not manifest.is_current("rankings", self._rankings_fname(year))
+            ]
+        else:
+            parse_years = years
+
+        if self.n_workers_ > 1 and len(parse_years) > 1:
+            with ProcessPoolExecutor(max_workers=self.n_workers_) as executor:
+                results = executor.map(self.get_year_rankings_data, parse_years)
+                parsed = dict(zip(parse_years, results))
+        else:
+            parsed = {year: self.get_year_rankings_data(year) for year in parse_years}
+
+        for year in years:
+            fname = self._rankings_fname(year)
+            if year in parsed:
+                year_data, missing_months = parsed[year]
+                if manifest is not None:
+                    manifest.update(
+                        "rankings",
+                        fname,
+                        {"rows": year_data.values.tolist(), "missing": missing_months},
+                    )
+                data_agg.extend_columns(year_data)
+            else:
+                cached = manifest.rows("rankings", fname)
+                data_agg.extend(cached["rows"])
+                missing_months = cached["missing"]
+            self.missing_rankings_months_.extend(
+                (year, month) for month in missing_months
+            )
+
+        if manifest is not None:
+            print(
+                "parsed",
+                len(parse_years),
+                "of",
+                len(years),
+                "rankings files (others unchanged)",
+            )
+            manifest.save()
+
+        if len(self.missing_rankings_months_) > 0:
+            print("no rankings table found for:")
+            for year, months in groupby(self.missing_rankings_months_, itemgetter(0)):
+                print("   ", year, ", ".join(month for _, month in months))
+
+        data_agg = data_agg.to_frame()
+        record(files=len(parse_years), rows=len(data_agg))
         data_agg.to_csv(self.processed_datapath_ + self.rankings_file_)
 
         return
 
+    def get_year_rankings_data(self, year):
+        """Strip the rankings data for every month from the html file of a year.
+
+        The html file is parsed only once, with the ``lxml`` tree builder if it
+        is installed and the standard library ``html.parser`` otherwise.
+
+        Parameters
+        ----------
+        year : int
+            the given year
+
+        Returns
+        -------
+        rankings_df : pandas dataframe
+            a dataframe of the rankings data (date, team, ranking and rating)
+            for all the months of the year which have a rankings table
+        missing_months : list of str
+            the months (all upper case chars) without a rankings table
+        """
+
+        # load and parse the html file for the given year
+        with open(self._rankings_fname(year), "r") as f:
+            soup = BeautifulSoup(f.read(), HTML_PARSER)
+
+        # collect the table following each month anchor in a single pass
+        tables = {}
+        for anchor in soup.find_all("a", attrs={"name": MONTHS}):
+            tables[anchor.get("name")] = _next_table(anchor)
+
+        rankings = FrameBuilder(RANKINGS_SCHEMA)
+        missing_months = []
+        for month in MONTHS:
+            table = tables.get(month)
+            if table is None:
+                missing_months.append(month)
+                continue
+            # loop over each row in the table, where each row is a team
+            for row in table.find_all("tr"):
+                cells = [cell.text.strip() for cell in row.find_all("td")]
+                try:
+                    rank = int(cells[0])
+                    rating = float(cells[2])
+                except (ValueError, IndexError):
+                    # header rows have no rank
+                    continue
+                rankings.append((year, month, cells[1], rank, rating))
+
+        rankings_df = rankings.to_frame()
+
+        return rankings_df, missing_months
+
     def get_rankings_data(self, month, year):
         """Strip the rankings data from the html file for a given M/Y.
 
@@ -139,54 +384,11 @@ class ProcessData:
         -------
         rankings_df : pandas dataframe
             a dataframe of the rankings data (date, team, ranking and rating)
+            which is empty if there is no table for the given month
         """
 
-        # load the html file for the given year
-        fname = "".join(
-            [self.raw_datapath_, "rankings_data/rankings_data_", str(year), ".html"]
-        )
-
-        # parse the html file and loop until the given month table is found
-        with open(fname, "r") as f:
-            soup = BeautifulSoup(f.read(), "html.parser")
-        for x in soup.find_all("a"):
-            if x.get("name") == month:
-                break
-        # extract the table content
-        table_description = x.next_sibling
-        table_content = table_description.next_sibling
-
-        team_list = []
-        rankings_list = []
-        ratings_list = []
-        # loop over each row in the table, where each row is a team with rank info
-        for row in table_content.contents:
-            rowtext = row.text
-            # find the ranking and rating by their position in the text
-            team = rowtext.strip("0123456789")
-            ranklen = len(rowtext.rstrip("0123456789")) - len(team)
-            try:
-                rank = int(rowtext[:ranklen])
-                rating = float(rowtext[len(rowtext.rstrip("0123456789")) :])
-                team_list.append(team)
-                rankings_list.append(rank)
-                ratings_list.append(rating)
-            except ValueError:
-                pass
-
-        # convert month and year to list with same length as team count
-        month_list = len(team_list) * [month]
-        year_list = len(team_list) * [year]
-
-        # create a dictionary of the data and then convert it to a pandas df
-        output_dict = {
-            "year": year_list,
-            "month": month_list,
-            "team": team_list,
-            "ranking": rankings_list,
-            "rating": ratings_list,
-        }
-        rankings_df = pd.DataFrame(data=output_dict)
+        year_data, _ = self.get_year_rankings_data(year)
+        rankings_df = year_data[year_data["month"] == month].reset_index(drop=True)
 
         return rankings_df
 
@@ -197,71 +399,281 @@ class ProcessData:
         Parameters
         ----------
         filename : str
-            the csv to extract from
+            the csv to extract from (an archive member if reading an archive)
 
         Returns
         -------
         match_data : list
-            the desired match data (date, teams, result, toss result)
+            the desired match data (first date, teams, result, toss result)
+
+        Raises
+        ------
+        UnresolvedVenueError
+            if the match venue is not listed in the venue file
         """
 
-        # the file containing the venue - country info
-        venue_file = self.raw_datapath_ + "venue_info.csv"
-        # read the match data file
-        with open(filename, "r") as f:
-            lines = f.readlines()
-
-        # dummy list of teams
-        team_count = 0
-        teams = ["a", "b"]
-        # loop over all the lines to get the desired info
-        for line in lines:
-
-            if "info,team," in line:
-                team = line.split(",")[2]
-                teams[team_count] = team.strip()
-                team_count += 1
-
-            elif "info,date" in line:
-                dateraw = line.split(",")[2].strip()
-
-            elif "info,winner," in line:
-                result = line.split(",")[2].strip()
-            elif "info,outcome," in line:
-                result = line.split(",")[2].strip()
-
-            elif "info,toss_winner," in line:
-                toss_winner = line.split(",")[2].strip()
-
-            elif "info,venue," in line:
-                venue = ",".join(line.split(",")[2:]).strip()
-                # remove speech marks from the venue for comparison with venue file
-                venue1 = venue.replace('"', "")
-                df_venues = pd.read_csv(venue_file, header=0)
-                # look for the venue in the venue file to get country
-                home_team = (
-                    df_venues.loc[df_venues["venue"] == venue1]
-                    .country.to_string(index=False, header=False)
-                    .strip()
-                )
+        with self._open_match_file(filename) as f:
+            info = parse_match_info(f.read(), match_id_from_filename(filename))
+        if info.venue is None or info.start_date is None:
+            raise ValueError("incomplete match info file " + str(filename))
+
+        # look for the venue in the venue registry to get country
+        home_team = self.venues.country(info.venue, filename)
 
         # assign home and away teams
+        teams = list(info.teams)
         teams.remove(home_team)
         away_team = teams[0]
 
+        result = info.result
         if result == home_team:
             result = "home"
         elif result == away_team:
             result = "away"
+        toss_winner = info.toss_winner
         if toss_winner == home_team:
             toss_winner = "home"
         elif toss_winner == away_team:
             toss_winner = "away"
 
+        # the match is dated by its first day
+        dateraw = info.start_date.strftime("%Y/%m/%d")
         match_data = [dateraw, home_team, away_team, result, toss_winner]
 
         return match_data
 
+    def rankings_index(self):
+        """Build a sorted (team, year-month) index of the rankings data.
+
+        Returns
+        -------
+        index : dict
+            a dictionary of numpy arrays sorted by (team, year-month):
+            ``key`` (the combined sort key), ``ym`` (year * 12 + month - 1),
+            ``ranking`` and ``rating``, plus ``teams`` mapping team name to code
+        """
+
+        # load the rankings data file once
+        df_rankings = pd.read_csv(self.processed_datapath_ + self.rankings_file_)
+
+        month_num = df_rankings["month"].map(MONTHS.index).to_numpy()
+        ym = df_rankings["year"].to_numpy() * 12 + month_num
+        teams = {team: code for code, team in enumerate(df_rankings["team"].unique())}
+        team_code = df_rankings["team"].map(teams).to_numpy()
+
+        # the combined key sorts by team first and then by year-month
+        key = team_code * YM_STRIDE + ym
+        order = np.argsort(key, kind="stable")
+
+        index = {
+            "teams": teams,
+            "key": key[order],
+            "ym": ym[order],
+            "ranking": df_rankings["ranking"].to_numpy()[order],
+            "rating": df_rankings["rating"].to_numpy()[order],
+        }
+
+        return index
+
+    @instrumented()
+    def match_headers_frame(self, info_files, n_workers=None):
+        """Parse the header (date, teams, result, toss) of many match files.
+
+        Parameters
+        ----------
+        info_files : list of str
+            the _info.csv files (or archive members) to parse
+        n_workers : int, optional
+            the number of worker processes (defaults to ``n_workers`` of the
+            class); with more than one worker the files are parsed in chunks
+            by a process pool
+
+        Returns
+        -------
+        matches : pd.DataFrame
+            one row per successfully parsed match, sorted by date and match id
+        """
+
+        if n_workers is None:
+            n_workers = self.n_workers_
+
+        info_files = sorted(info_files)
+        matches = FrameBuilder(MATCH_SCHEMA)
+
+        # in incremental mode only new or changed files are parsed
+        manifest = self.manifest
+        if manifest is not None:
+            manifest.prune("info", info_files)
+            parse_files = [
+                f
+                for f in info_files
+                if not manifest.is_current("info", f, self._fingerprint(f))
+            ]
+        else:
+            parse_files = info_files
+        parsed = self._parse_info_files(parse_files, n_workers)
+
+        for info_file in info_files:
+            if info_file in parsed:
+                row, err = parsed[info_file]
+            else:
+                cached = manifest.rows("info", info_file)
+                row = cached["row"]
+                err = None
+                if cached["venue"] is not None:
+                    err = UnresolvedVenueError(cached["venue"], info_file)
+            if row is not None:
+                matches.append(row)
+            if err is not None:
+                self.unresolved_venues_.append(err)
+
+        if manifest is not None:
+            print(
+                "parsed",
+                len(parse_files),
+                "of",
+                len(info_files),
+                "match info files (others unchanged)",
+            )
+            manifest.save()
+
+        # sort so the output does not depend on glob or completion order
+        matches = matches.to_frame()
+        matches.sort_values(by=["date", "match_id"], inplace=True, ignore_index=True)
+        record(files=len(parse_files), rows=len(matches))
+
+        return matches
+
+    def _parse_info_files(self, info_files, n_workers):
+        """Parse match info files, in chunks by a process pool if n_workers > 1.
+
+        Returns
+        -------
+        parsed : dict
+            the (row, error) of each file (see ``_parse_info_chunk``), which
+            are also recorded in the manifest in incremental mode
+        """
+
+        if n_workers > 1 and len(info_files) > 1:
+            # load the venues before the object is sent to the workers
+            self.venues
+            # a few chunks per worker keeps the pool busy if chunks are uneven
+            n_chunks = min(len(info_files), 4 * n_workers)
+            chunks = [info_files[i::n_chunks] for i in range(n_chunks)]
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                results = list(executor.map(self._parse_info_chunk, chunks))
+        else:
+            results = [self._parse_info_chunk(info_files)]
+
+        manifest = self.manifest
+        parsed = {}
+        for chunk_results in results:
+            for info_file, row, err in chunk_results:
+                parsed[info_file] = (row, err)
+                if manifest is not None:
+                    venue = None if err is None else err.venue
+                    manifest.update(
+                        "info",
+                        info_file,
+                        {"row": row, "venue": venue},
+                        self._fingerprint(info_file),
+                    )
+
+        return parsed
+
+    def _parse_info_chunk(self, info_files):
+        """Parse a chunk of info files.
+
+        Returns
+        -------
+        results : list of tuple
+            (filename, row, error) for each file, where row is the match
+            header (None if the match could not be parsed) and error is the
+            UnresolvedVenueError raised by the file, if any
+        """
+
+        results = []
+        for info_file in info_files:
+            row = None
+            err = None
+            try:
+                row = [match_id_from_filename(info_file)] + self.get_match_data(
+                    info_file
+                )
+            except UnresolvedVenueError as venue_err:
+                err = venue_err
+            except ValueError:
+                pass
+            results.append((info_file, row, err))
+
+        return results
+
+    @instrumented()
+    def join_rankings(self, matches, date_min, date_max, index=None):
+        """Attach home and away rank / rating to every match with an as-of join.
+
+        For each match the rankings are taken from the latest month, at or
+        before the match date and within the same year, in which both teams
+        have a rankings entry.
+
+        Parameters
+        ----------
+        matches : pd.DataFrame
+            the match headers, as returned by ``match_headers_frame``
+        date_min : datetime object
+            the earliest date for which to merge data
+        date_max : datetime object
+            the latest date for which to merge data
+        index : dict, optional
+            a pre-built rankings index (see ``rankings_index``)
+
+        Returns
+        -------
+        df_out : pd.DataFrame
+            the merged data; matches outside the date range or without
+            rankings data in the same year are dropped
+        """
+
+        if index is None:
+            index = self.rankings_index()
+
+        # filter the matches by the allowed date range
+        dates = pd.to_datetime(matches["date"], format="%Y/%m/%d")
+        in_range = (dates.dt.date >= date_min) & (dates.dt.date <= date_max)
+        matches = matches[in_range.to_numpy()].reset_index(drop=True)
+        dates = dates[in_range].reset_index(drop=True)
+
+        ym_match = (dates.dt.year * 12 + dates.dt.month - 1).to_numpy()
+        home_code = (
+            matches["home_team"].map(index["teams"]).fillna(-1).astype(int).to_numpy()
+        )
+        away_code = (
+            matches["away_team"].map(index["teams"]).fillna(-1).astype(int).to_numpy()
+        )
+
+        # walk back until both teams are found in the same month: each pass is
+        # an as-of lookup, and the key only ever decreases so this terminates
+        ym_key = ym_match.copy()
+        while True:
+            home_pos, home_ym = _asof_lookup(index, home_code, ym_key)
+            away_pos, away_ym = _asof_lookup(index, away_code, ym_key)
+            ym_common = np.minimum(home_ym, away_ym)
+            if np.array_equal(ym_common, ym_key):
+                break
+            ym_key = ym_common
+
+        # keep only matches with rankings from the same year
+        found = (home_ym == away_ym) & (ym_key // 12 == ym_match // 12)
+
+        df_out = matches[found].reset_index(drop=True)
+        df_out["home_rank"] = index["ranking"][home_pos[found]]
+        df_out["home_rating"] = index["rating"][home_pos[found]]
+        df_out["away_rank"] = index["ranking"][away_pos[found]]
+        df_out["away_rating"] = index["rating"][away_pos[found]]
+        record(rows=len(df_out))
+
+        return df_out
+
     def merge_match_ranking_data(
         self,
         filename,
@@ -287,103 +699,153 @@ class ProcessData:
             the df is empty if the match date isn't in the accepted range
         """
 
-        # extract date and teams from the match data
-        match_data = self.get_match_data(filename)
-        dateraw = match_data[0]
-        home_team = match_data[1]
-        away_team = match_data[2]
-        # convert date to datetime object
-        date = datetime.strptime(dateraw, "%Y/%m/%d")
-
-        # return empty df if date outside allowed range
-        if date.date() < date_min or date.date() > date_max:
+        matches = FrameBuilder(MATCH_SCHEMA)
+        matches.append(
+            [match_id_from_filename(filename)] + self.get_match_data(filename)
+        )
+        df_out = self.join_rankings(matches.to_frame(), date_min, date_max)
+        if len(df_out) == 0:
             return pd.DataFrame()
 
-        month_num = date.month
-        month_str = date.strftime("%B").upper()
-        year = date.year
-
-        # load the rankings data file
-        df_rankings = pd.read_csv(self.processed_datapath_ + self.rankings_file_)
-
-        # try to extract the data for the given month
-        # if that month has no rankings data, loop backwards through the months
-        # until a month with rankings data is found
-        while month_num > 0:
-            month_str = date.strftime("%B").upper()
-            try:
-                home_info = df_rankings.loc[
-                    (df_rankings["month"] == month_str)
-                    & (df_rankings["year"] == year)
-                    & (df_rankings["team"] == home_team)
-                ]
-
-                away_info = df_rankings.loc[
-                    (df_rankings["month"] == month_str)
-                    & (df_rankings["year"] == year)
-                    & (df_rankings["team"] == away_team)
-                ]
-
-                home_rank = int(home_info.ranking)
-                home_rating = float(home_info.rating)
-                away_rank = int(away_info.ranking)
-                away_rating = float(away_info.rating)
-            except TypeError:
-                # go to the previous month
-                month_num -= 1
-                # in case the month num reaches 0 - return empty df
-                try:
-                    date = date.replace(month=month_num)
-                except ValueError:
-                    return pd.DataFrame()
-                continue
-            break
-
-        data_dict = {
-            "date": dateraw,
-            "home_team": home_team,
-            "away_team": away_team,
-            "result": match_data[3],
-            "toss": match_data[4],
-            "home_rank": home_rank,
-            "home_rating": home_rating,
-            "away_rank": away_rank,
-            "away_rating": away_rating,
-        }
-        df_out = pd.DataFrame(data=data_dict, index=[0])
-
         return df_out
 
+    @instrumented()
     def agg_data_to_csv(self):
-        """Dump all the processed data into a single csv file."""
+        """Dump all the processed data into a single csv file.
+
+        In incremental mode, the match headers of unchanged info files are
+        taken from the manifest; all of them are re-parsed if the venue file
+        has changed. The rankings are always joined afresh (which is cheap),
+        so a change in the rankings table is reflected in every match.
+        """
 
         # define the min and max dates
         # TODO : these should be set in the class initialization
         date_min = dtdate(2004, 3, 1)
         date_max = dtdate(2013, 3, 31)
-        data_agg = pd.DataFrame()
 
         # list of all info files
-        info_files = glob.glob(self.raw_datapath_ + "match_data/*_info.csv")
+        info_files = self.match_info_files()
+        self.unresolved_venues_ = []
 
-        # loop through the info files and append everything into a single df
-        for info_file in info_files:
-            try:
-                match_rank_data = self.merge_match_ranking_data(
-                    info_file, date_min, date_max
-                )
-                data_agg = pd.concat([match_rank_data, data_agg], ignore_index=True)
-            except ValueError:
-                pass
+        # the home team of every match depends on the venue file
+        manifest = self.manifest
+        venue_file = self.raw_datapath_ + "venue_info.csv"
+        if manifest is not None and manifest.dependency_changed(venue_file):
+            manifest.clear("info")
+
+        # parse all the match headers, then join the rankings in one pass
+        matches = self.match_headers_frame(info_files)
+        self.report_unresolved_venues()
+        data_agg = self.join_rankings(matches, date_min, date_max)
+        record(files=len(info_files), rows=len(data_agg))
 
         data_agg.to_csv(self.processed_datapath_ + self.aggregate_file_)
 
         return
 
+    def report_unresolved_venues(self):
+        """Print the venues which could not be matched to a country.
+
+        Returns
+        -------
+        unresolved : pd.DataFrame
+            one row per skipped match file, with the unresolved venue name
+        """
+
+        unresolved = pd.DataFrame(
+            {
+                "filename": [err.filename for err in self.unresolved_venues_],
+                "venue": [err.venue for err in self.unresolved_venues_],
+            }
+        )
+        if len(unresolved) > 0:
+            print(
+                "skipped",
+                len(unresolved),
+                "matches with venues missing from venue_info.csv:",
+            )
+            for venue, count in unresolved.venue.value_counts().items():
+                print("   ", venue, "(" + str(count) + " matches)")
+
+        return unresolved
 
-def main(input_filepath, output_filepath):
+
+def _next_table(anchor):
+    """Find the table belonging to a month anchor in the rankings html.
+
+    Only the siblings up to the next anchor are searched, so a month without
+    a table does not pick up the following month's table.
+    """
+
+    for sibling in anchor.next_siblings:
+        if getattr(sibling, "name", None) == "a":
+            break
+        if getattr(sibling, "name", None) == "table":
+            return sibling
+    return None
+
+
+def _asof_lookup(index, team_code, ym):
+    """Find the latest rankings row for each team at or before a year-month.
+
+    Parameters
+    ----------
+    index : dict
+        the rankings index (see ``ProcessData.rankings_index``)
+    team_code : np.ndarray
+        the team code for each query (-1 for unknown teams)
+    ym : np.ndarray
+        the year-month key for each query
+
+    Returns
+    -------
+    pos : np.ndarray
+        the position of the matching row in the index (0 if not found)
+    found_ym : np.ndarray
+        the year-month of the matching row (-1 if not found)
+    """
+
+    pos = np.searchsorted(index["key"], team_code * YM_STRIDE + ym, side="right") - 1
+    pos_safe = np.clip(pos, 0, None)
+    found = (pos >= 0) & (index["key"][pos_safe] // YM_STRIDE == team_code)
+    found_ym = np.where(found, index["ym"][pos_safe], -1)
+
+    return pos_safe, found_ym
+
+
+def main(
+    input_filepath,
+    output_filepath,
+    n_workers=1,
+    incremental=True,
+    profile=False,
+    trace_memory=False,
+    match_archive=None,
+):
     """Runs data processing scripts to turn raw data from (../raw) into
     cleaned data ready to be analyzed (saved in ../processed).
+
+    The time, files and rows processed and peak memory of every stage are
+    written to ``RUN_REPORT_FILE`` in the processed data path.
+
+    Parameters
+    ----------
+    input_filepath : str
+        the raw data path
+    output_filepath : str
+        the processed data path
+    n_workers : int, optional
+        the number of worker processes used to parse the match info files
+    incremental : bool, optional
+        only re-parse the raw files which are new or changed since the last run
+    profile : bool, optional
+        dump cProfile statistics of each stage to the ``profiles`` directory of
+        the processed data path
+    trace_memory : bool, optional
+        record the peak Python memory of each stage with tracemalloc (slower)
+    match_archive : str, optional
+        read the match info files from this cricsheet zip archive
     """
 
     # create the processed data object
@@ -394,13 +856,23 @@ def main(input_filepath, output_filepath):
         2013,
         "rankings_data.csv",
         "aggregate_data.csv",
+        n_workers=n_workers,
+        incremental=incremental,
+        match_archive=match_archive,
     )
 
-    # transform html rankings data to csv file
-    processed_data.rankings_to_csv()
+    profile_dir = os.path.join(output_filepath, "profiles") if profile else None
+    report = RunReport(trace_memory=trace_memory, profile_dir=profile_dir)
+    with report.activate():
+
+        # transform html rankings data to csv file
+        processed_data.rankings_to_csv()
 
-    # aggregate match and rankings data
-    processed_data.agg_data_to_csv()
+        # aggregate match and rankings data
+        processed_data.agg_data_to_csv()
+
+    report.summary()
+    report.save(os.path.join(output_filepath, RUN_REPORT_FILE))
 
 
 if __name__ == "__main__":
@@ -408,4 +880,42 @@ if __name__ == "__main__":
     # not used in this stub but often useful for finding various files
     project_dir = Path(__file__).resolve().parents[2]
 
-    main(sys.argv[1], sys.argv[2])
+    parser = argparse.ArgumentParser(description="Make the processed dataset.")
+    parser.add_argument("input_filepath", help="the raw data path")
+    parser.add_argument("output_filepath", help="the processed data path")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes used to parse the match info files",
+    )
+    parser.add_argument(
+        "--full-rebuild",
+        action="store_true",
+        help="re-parse every raw file, ignoring the input manifest",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="dump cProfile statistics of each stage to <output_filepath>/profiles/",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="record the peak Python memory of each stage (slower)",
+    )
+    parser.add_argument(
+        "--match-archive",
+        help="read the match info files from this cricsheet zip archive",
+    )
+    args = parser.parse_args()
+
+    main(
+        args.input_filepath,
+        args.output_filepath,
+        n_workers=args.workers,
+        incremental=not args.full_rebuild,
+        profile=args.profile,
+        trace_memory=args.trace_memory,
+        match_archive=args.match_archive,
+    )
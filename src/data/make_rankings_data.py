@@ -4,13 +4,52 @@ years (2013 - present), based on initial data about rankings and total
 number of matches played.
 """
 
-import os
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from concurrent.futures import ProcessPoolExecutor
+import re
+import numpy as np
 import pandas as pd
 import datetime
 
-
-def series_data_to_csv(raw_path, interim_path, proc_path):
+from src.data.builders import FrameBuilder
+from src.data.instrument import instrumented, record
+from src.data.make_dataset import HTML_PARSER
+from src.data.match_index import MatchIndex
+from src.data.ratings import (
+    MatchCounter,
+    PointsTable,
+    RatingsEngine,
+    calc_points_batch,
+    monthly_rankings,
+)
+
+# column dtypes of the series results and series points tables
+SERIES_SCHEMA = {
+    "date": object,
+    "home_team": object,
+    "away_team": object,
+    "num_matches": "int64",
+    "home_team_pts": "int64",
+    "away_team_pts": "int64",
+}
+SERIES_POINTS_SCHEMA = {
+    "date": object,
+    "month": "int64",
+    "year": "int64",
+    "home_team": object,
+    "away_team": object,
+    "num_matches": "int64",
+    "home_score": "int64",
+    "away_score": "int64",
+    "home_tot_points": "float64",
+    "away_tot_points": "float64",
+    "rolling_home_matches": "int64",
+    "rolling_away_matches": "int64",
+}
+
+
+@instrumented()
+def series_data_to_csv(raw_path, interim_path, proc_path, n_workers=1, dump=False):
     """
     Convert series data in html formats to single csv file.
 
@@ -22,89 +61,161 @@ def series_data_to_csv(raw_path, interim_path, proc_path):
         interim data path
     proc_path : str
         processed data path
+    n_workers : int, optional
+        the number of worker processes; with more than one worker the decade
+        files are parsed concurrently
+    dump : bool, optional
+        also save a prettified version of each html file in the interim data
+        path (the html is then parsed in full rather than just its series table)
 
     Returns
     -------
-    None
+    unparsed : pandas dataframe
+        the series whose result could not be parsed (these are skipped)
     """
 
     # each html file references a different decade
     year_ranges = ["2000_09", "2010_19", "2020_29"]
+    fnames = [
+        "".join([raw_path, "series_data_", yrange, ".html"]) for yrange in year_ranges
+    ]
+    if dump:
+        dump_fnames = [
+            "".join([interim_path, "series_data_", yrange, ".html"])
+            for yrange in year_ranges
+        ]
+    else:
+        dump_fnames = [None] * len(year_ranges)
 
-    df = pd.DataFrame()
-
-    # loop over the html files
-    for yrange in year_ranges:
-
-        # read html file
-        fname = "".join([raw_path, "series_data_", yrange, ".html"])
-        with open(fname, "r") as f:
-            soup = BeautifulSoup(f.read(), "html.parser")
-
-        # save a prettified version of the html file in interim data dir
-        fname = "".join([interim_path, "series_data_", yrange, ".html"])
-        soup.prettify()
-        with open(fname, "w") as f:
-            f.write(str(soup))
-
-        # find the rows of the table with series information
-        for x in soup.find_all("a"):
-            classname = x.get("class")
-
-            if classname == ["LinkTable"]:
-
-                # names of teams from text
-                teams = x.text.strip()
-
-                # date from text
-                date = x.find_next("td")
-                date_text = date.text.strip()
-
-                # match number from text
-                N_matches = date.find_next("td")
-                N_matches_text = int(N_matches.text.strip())
-
-                # match result from text
-                result = N_matches.find_next("td").text.strip()
-
-                # split the teams
-                team_list = teams.split("v.")
-                team_A = " ".join(team_list[0].split()[1:])
-                team_B = team_list[1].lstrip()
-
-                # get the number of points for each team from the series result
-                if "Drawn" in result:
-                    [team_A_pts, team_B_pts] = list(
-                        map(int, result.lstrip("Drawn").split("-"))
-                    )
-                elif team_A in result:
-                    [team_A_pts, team_B_pts] = list(
-                        map(int, result.lstrip(team_A).split("-"))
-                    )
-                elif team_B in result:
-                    [team_B_pts, team_A_pts] = list(
-                        map(int, result.lstrip(team_B).split("-"))
-                    )
-                else:
-                    pass
-
-                # make dictionary and convert to dataframe
-                output_dict = {
-                    "date": date_text,
-                    "home_team": team_A,
-                    "away_team": team_B,
-                    "num_matches": N_matches_text,
-                    "home_team_pts": team_A_pts,
-                    "away_team_pts": team_B_pts,
-                }
-
-                df_tmp = pd.DataFrame(data=output_dict, index=[0])
-                df = pd.concat([df, df_tmp], ignore_index=True)
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(parse_series_html, fnames, dump_fnames))
+    else:
+        results = list(map(parse_series_html, fnames, dump_fnames))
+
+    df = FrameBuilder(SERIES_SCHEMA)
+    unparsed = FrameBuilder(
+        {"date": object, "home_team": object, "away_team": object, "result": object}
+    )
+    for rows, unparsed_rows in results:
+        df.extend(rows)
+        unparsed.extend(unparsed_rows)
+
+    unparsed = unparsed.to_frame()
+    if len(unparsed) > 0:
+        print("skipped", len(unparsed), "series whose result could not be parsed:")
+        for row in unparsed.itertuples():
+            print(
+                "   ",
+                row.home_team,
+                "v",
+                row.away_team,
+                "from",
+                row.date + ":",
+                row.result,
+            )
 
     # save the dataframe as csv
+    df = df.to_frame()
+    record(files=len(fnames), rows=len(df))
     df.to_csv(proc_path + "series_data.csv")
 
-    return
+    return unparsed
+
+
+def parse_series_html(fname, dump_fname=None):
+    """
+    Parse the series table of a howstat series html file.
+
+    Parameters
+    ----------
+    fname : str
+        the html file
+    dump_fname : str, optional
+        if given, save a prettified version of the html to this file
+
+    Returns
+    -------
+    rows : list of tuple
+        the parsed series, in the column order of ``SERIES_SCHEMA``
+    unparsed : list of tuple
+        the (date, home team, away team, result) of series whose result
+        could not be parsed
+    """
+
+    with open(fname, "r") as f:
+        html = f.read()
+
+    if dump_fname is None:
+        # only build the tree of the series table
+        soup = BeautifulSoup(
+            html,
+            HTML_PARSER,
+            parse_only=SoupStrainer("table", attrs={"class": "TableLined"}),
+        )
+    else:
+        soup = BeautifulSoup(html, HTML_PARSER)
+        with open(dump_fname, "w") as f:
+            f.write(soup.prettify())
+
+    rows = []
+    unparsed = []
+    for table in soup.find_all("table", attrs={"class": "TableLined"}):
+        # each series row has the series link, start date, matches and result
+        for tr in table.find_all("tr"):
+            cells = tr.find_all("td", recursive=False)
+            if len(cells) != 4:
+                continue
+            link = cells[0].find("a", attrs={"class": "LinkTable"})
+            if link is None:
+                continue
+            teams, date_text, N_matches_text, result = (
+                cell.get_text().strip() for cell in [link] + cells[1:]
+            )
+
+            # split the teams (the text starts with the season)
+            team_list = teams.split("v.")
+            team_A = " ".join(team_list[0].split()[1:])
+            team_B = team_list[1].strip()
+
+            pts = parse_series_result(result, team_A, team_B)
+            if pts is None:
+                unparsed.append((date_text, team_A, team_B, result))
+                continue
+
+            rows.append((date_text, team_A, team_B, int(N_matches_text)) + pts)
+
+    return rows, unparsed
+
+
+def parse_series_result(result, team_A, team_B):
+    """
+    Get the number of matches won by each team from a series result.
+
+    Parameters
+    ----------
+    result : str
+        the result, e.g. "India 2-0" or "Drawn 1-1"
+    team_A, team_B : str
+        the home and away teams
+
+    Returns
+    -------
+    pts : tuple of int or None
+        the matches won by the home and away teams, or None if the result
+        can't be parsed (e.g. a series in progress)
+    """
+
+    score = re.fullmatch(r"(.*?)\s*(\d+)-(\d+)", result)
+    if score is None:
+        return None
+
+    winner, pts_1, pts_2 = score.group(1), int(score.group(2)), int(score.group(3))
+    if winner in ("Drawn", team_A):
+        return (pts_1, pts_2)
+    if winner == team_B:
+        return (pts_2, pts_1)
+    return None
 
 
 def init_ratings_data(proc_path):
@@ -133,80 +244,74 @@ def init_ratings_data(proc_path):
     # read in the main data file
     rank_df = pd.read_csv(proc_path + "rankings_data.csv")
     # extract the information as of March 2013
-    rankings_init = rank_df[-9:]
+    rankings_init = rank_df[(rank_df.year == 2013) & (rank_df.month == "MARCH")]
 
     date_end = "2013/03/01"
     N_team_matches = count_matches_from(date_end, proc_path)
 
     # create the dataframe with rating, ranking and total points data
-    df_main = pd.DataFrame()
+    df_main = FrameBuilder(
+        {
+            "date": object,
+            "team": object,
+            "ranking": "int64",
+            "rating": "float64",
+            "matches": "int64",
+            "tot_pts": "float64",
+        }
+    )
     for team in N_team_matches:
 
+        # teams without a rating (e.g. unranked at the time) are not seeded
+        if not (rankings_init.team == team).any():
+            continue
+
         rating = rankings_init.rating[rankings_init.team == team].values[0]
         ranking = rankings_init.ranking[rankings_init.team == team].values[0]
 
-        data = {
-            "date": date_end,
-            "team": team,
-            "ranking": ranking,
-            "rating": rating,
-            "matches": N_team_matches[team],
-            "tot_pts": rating * N_team_matches[team],
-        }
-
-        # convert to df and concatenate
-        df_tmp = pd.DataFrame(data, index=[0])
-        df_main = pd.concat([df_main, df_tmp], ignore_index=True)
-
-    return df_main
-
-
-def count_matches_from(date, proc_path):
-
-    r"""Count the number of matches contributing to rankings points at a given date."""
-
-    # get the number of matches played between May 2010 and March 2013
-    main_df = pd.read_csv(proc_path + "series_data.csv")
-    main_df.date = pd.to_datetime(main_df.date, format="%d/%m/%Y")
-
-    # convert date to a datetime object
-    date_end = pd.to_datetime(date)
+        df_main.append(
+            date=date_end,
+            team=team,
+            ranking=ranking,
+            rating=rating,
+            matches=N_team_matches[team],
+            tot_pts=rating * N_team_matches[team],
+        )
 
-    # get a list of the test teams
-    test_teams = list(set(main_df.home_team))
+    return df_main.to_frame()
 
-    # retrieve the starting date
-    if date_end.month >= 5:
-        date_mid_year = date_end.year - 1
-    else:
-        date_mid_year = date_end.year - 2
 
-    date_start_year = date_mid_year - 2
+def count_matches_from(date, proc_path, counter=None):
+    r"""Count the number of matches contributing to rankings points at a given date.
 
-    date_start = datetime.date(date_start_year, 5, 1)
+    Parameters
+    ----------
+    date : str
+        the date at which to count the matches
+    proc_path : str
+        the data path for processed data
+    counter : MatchCounter, optional
+        a pre-built match counter; if not given it is built from the series
+        data csv file (pass one in when counting at many dates)
 
-    # initialize match count and ratings
-    N_team_matches = {team: 0 for team in test_teams}
+    Returns
+    -------
+    N_team_matches : dict
+        the number of matches counted for each team which played in the period
+    """
 
-    for date in main_df.date:
-        if date > date_start and date < date_end:
-            N_row = main_df.loc[main_df.date == date]
-            home_team = N_row.home_team.values[0]
-            away_team = N_row.away_team.values[0]
-            num_games = N_row.num_matches.values[0]
+    if counter is None:
+        counter = MatchCounter.from_csv(proc_path + "series_data.csv")
 
-            # assign an extra number to the total count for series > 1 game
-            if num_games > 1:
-                N_team_matches[home_team] += num_games + 1
-                N_team_matches[away_team] += num_games + 1
+    counts = counter.counts_at(date)
 
     # remove teams who played no matches in that period
-    N_team_matches = {k: v for k, v in N_team_matches.items() if v != 0}
+    N_team_matches = {k: int(v) for k, v in counts.items() if v != 0}
 
     return N_team_matches
 
 
-def get_end_series_date(start_date, num_matches, team_list):
+def get_end_series_date(start_date, num_matches, team_list, match_index):
     """
     Calculate the end date of a test series from the start date and match number.
 
@@ -218,342 +323,336 @@ def get_end_series_date(start_date, num_matches, team_list):
         number of matches in the test series
     team_list : list
         the teams contesting the series
+    match_index : MatchIndex
+        the index of all matches (see ``src.data.match_index``)
 
     Returns
     -------
-    end_date : str
-       end date in format yyyy/mm/dd
+    end_date : str or None
+       end date in format yyyy/mm/dd, or None if the series can't be found
     """
 
-    # reformat the date string
-    day, month, year = start_date.split("/")
-    start_date = "/".join([year, month, day])
-
-    # get the names of all files with the given start date
-    cwd = os.getcwd()
-    os.chdir("/home/callow46/test_cricket_stats/data/raw/match_data/")
-    os_cmd = "grep " + start_date + " *_info.csv"
-    fname_tmp = os.popen(os_cmd).read().split("\n")
-
-    if fname_tmp == [""]:
-        return
-
-    # if more than one file has the given start date:
-    # loop over them all until the one with correct teams is found
-    if len(fname_tmp) > 2:
-        for file_ in fname_tmp:
-            fname = file_.split("_")[0] + "_info.csv"
-            with open(fname, "r") as f:
-                lines = f.readlines()
-                for line in lines:
-
-                    if "info,team," in line:
-                        team = line.split(",")[2].strip()
-            if team in team_list:
-                fname_final = fname.split("_")[0]
-                break
-    else:
-        fname_final = fname_tmp[0].split("_")[0]
-
-    # add the number of matches to the last character of the filename
-    # usually the matches in a serious monototically increase by one in the filenames
-    # if they don't, keep increasing until the true last file is found
-    match_code = int(fname_final) + num_matches - 1
-    while True:
-        try:
-            new_fname = str(match_code) + "_info.csv"
-            open(new_fname)
-            break
-        except FileNotFoundError:
-            match_code += 1
-
-    # get the date of the final match
-    with open(new_fname, "r") as f:
-        lines = f.readlines()
-        for line in lines:
-            if "info,date" in line:
-                end_date = line.split(",")[2].strip()
-    os.chdir(cwd)
-    return end_date
+    # the series ends on the last day of its final match
+    start_date = datetime.datetime.strptime(start_date, "%d/%m/%Y").date()
+    final_match = match_index.series_end(start_date, num_matches, team_list)
+    if final_match is None:
+        return None
 
+    return final_match.end_date.strftime("%Y/%m/%d")
 
-def calc_points(num_matches, home_score, away_score, home_rating, away_rating):
 
-    # add half a point for each drawn game
-    num_draws = num_matches - (home_score + away_score)
-    home_score += 0.5 * num_draws
-    away_score += 0.5 * num_draws
-
-    # add bonus points for series result
-    if home_score > away_score:
-        home_score += 1
-    elif home_score == away_score:
-        home_score += 0.5
-        away_score += 0.5
-    else:
-        away_score += 1
+def calc_points(num_matches, home_score, away_score, home_rating, away_rating):
+    """
+    Compute the ratings points won by each team in a series.
 
-    # if the home and away ratings are within 40 points
-    if abs(home_score - away_score) < 40:
-        home_points = home_score * (away_rating + 50) + away_score * (away_rating - 50)
-        away_points = away_score * (home_rating + 50) + home_score * (home_rating - 50)
+    See ``calc_points_batch``, of which this is the single series version.
 
-    # else they are more than 40 points different
-    else:
-        if home_score > away_score:
-            home_points = home_score * (away_rating + 10) + away_score * (
-                away_rating - 90
-            )
-            away_points = home_score * (away_rating + 90) + away_score * (
-                away_rating - 10
-            )
-        else:
-            home_points = home_score * (away_rating + 90) + away_score * (
-                away_rating - 10
-            )
-            away_points = home_score * (away_rating + 10) + away_score * (
-                away_rating - 90
-            )
+    Returns
+    -------
+    points_won : list of float
+        the points won by the home and away teams
+    """
 
-    points_won = [home_points, away_points]
+    home_points, away_points = calc_points_batch(
+        num_matches, home_score, away_score, home_rating, away_rating
+    )
+    points_won = [float(home_points), float(away_points)]
 
     return points_won
 
 
-def calc_points_per_series(date_start, date_end, proc_path):
+@instrumented()
+def resolve_series_ends(series_df, match_index, n_workers=1):
+    """
+    Find the end date of every series in a table.
 
-    # loop through the series data
-    series_df = pd.read_csv(proc_path + "series_data.csv")
-    ratings_df = pd.read_csv(proc_path + "rankings_data.csv")
+    Parameters
+    ----------
+    series_df : pandas dataframe
+        the series data, with date (dd/mm/yyyy), num_matches, home_team and
+        away_team columns
+    match_index : MatchIndex
+        the index of all matches
+    n_workers : int, optional
+        the number of worker processes; with more than one worker the series
+        are resolved in chunks in parallel
 
-    # filter series df by date range
-    date_i = pd.to_datetime(date_start, format="%d/%m/%Y")
-    date_f = pd.to_datetime(date_end, format="%d/%m/%Y")
+    Returns
+    -------
+    end_dates : pandas series
+        the end date (yyyy/mm/dd) of each series, or None if it can't be found,
+        with the index of ``series_df``
+    """
 
-    series_df = series_df[
-        (pd.to_datetime(series_df["date"], format="%d/%m/%Y") >= date_i)
-        & (pd.to_datetime(series_df["date"], format="%d/%m/%Y") <= date_f)
-    ]
+    rows = list(
+        zip(
+            series_df["date"],
+            series_df["num_matches"],
+            series_df["home_team"],
+            series_df["away_team"],
+        )
+    )
+
+    if n_workers > 1 and len(rows) > 1:
+        # a few contiguous chunks per worker keeps the pool busy
+        n_chunks = min(len(rows), 4 * n_workers)
+        bounds = [len(rows) * i // n_chunks for i in range(n_chunks + 1)]
+        chunks = [rows[i:j] for i, j in zip(bounds[:-1], bounds[1:])]
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = executor.map(
+                _resolve_series_chunk, chunks, [match_index] * n_chunks
+            )
+            end_dates = [date for chunk in results for date in chunk]
+    else:
+        end_dates = _resolve_series_chunk(rows, match_index)
 
-    try:
-        df = pd.read_csv(proc_path + "series_points_data.csv")
-    except FileNotFoundError:
-        df = pd.DataFrame()
+    record(rows=len(end_dates))
+    return pd.Series(end_dates, index=series_df.index, dtype=object)
 
-    for index, row in series_df.iterrows():
 
-        date_end = get_end_series_date(
-            row.date, row.num_matches, [row.home_team, row.away_team]
-        )
+def _resolve_series_chunk(rows, match_index):
+    """Resolve the end dates of a chunk of (date, num_matches, home, away) rows."""
 
-        try:
-            date = datetime.datetime.strptime(date_end, "%Y/%m/%d")
-        except TypeError:
-            break
-
-        month_num = date.month
-        month_str = date.strftime("%B").upper()
-        year = date.year
-
-        try:
-            start_home_rating = float(
-                ratings_df[
-                    (ratings_df["year"] == year)
-                    & (ratings_df["month"] == month_str)
-                    & (ratings_df["team"] == row.home_team)
-                ].rating
-            )
-        except TypeError:
-            start_home_rating = 0.0
-
-        try:
-            start_away_rating = float(
-                ratings_df[
-                    (ratings_df["year"] == year)
-                    & (ratings_df["month"] == month_str)
-                    & (ratings_df["team"] == row.away_team)
-                ].rating
-            )
-        except TypeError:
-            start_away_rating = 0.0
-
-        [home_pts, away_pts] = calc_points(
-            row.num_matches,
-            row.home_team_pts,
-            row.away_team_pts,
-            start_home_rating,
-            start_away_rating,
-        )
+    return [
+        get_end_series_date(date, num_matches, [home_team, away_team], match_index)
+        for date, num_matches, home_team, away_team in rows
+    ]
 
-        rolling_matches = count_matches_from(date_end, proc_path)
-        try:
-            rolling_home_matches = rolling_matches[row.home_team]
-        except KeyError:
-            rolling_home_matches = 1
-        try:
-            rolling_away_matches = rolling_matches[row.away_team]
-        except KeyError:
-            rolling_away_matches = 1
-
-        data_dict = {
-            "date": datetime.date(year, month_num, 1),
-            "month": month_num,
-            "year": year,
-            "home_team": row.home_team,
-            "away_team": row.away_team,
-            "num_matches": row.num_matches,
-            "home_score": row.home_team_pts,
-            "away_score": row.away_team_pts,
-            "home_tot_points": home_pts,
-            "away_tot_points": away_pts,
-            "rolling_home_matches": rolling_home_matches,
-            "rolling_away_matches": rolling_away_matches,
-        }
 
-        df_tmp = pd.DataFrame(data=data_dict, index=[0])
-        df = pd.concat([df, df_tmp], ignore_index=True)
+def report_unresolved_series(unresolved):
+    """Print the series whose end date could not be found.
 
-    # sort df by date
-    df.sort_values(by=["date"], inplace=True)
-    df.to_csv(proc_path + "series_points_data.csv")
+    Parameters
+    ----------
+    unresolved : pandas dataframe
+        the unresolved series (rows of the series data)
+    """
 
-    return df
+    if len(unresolved) > 0:
+        print("skipped", len(unresolved), "series whose end date was not found:")
+        for row in unresolved.itertuples():
+            print("   ", row.home_team, "v", row.away_team, "from", row.date)
 
 
-def propagate_rankings_data(start_year, start_month, end_year, end_month, proc_path):
+@instrumented()
+def calc_points_per_series(date_start, date_end, proc_path, match_index, n_workers=1):
+    """
+    Compute the ratings points won in each series within a date range.
 
-    series_df = pd.read_csv(proc_path + "series_points_data.csv")
+    The series end dates are resolved first (in parallel with several
+    workers), then the starting ratings, rolling match counts and points
+    of all the series are computed in one batch.
 
-    rankings_df = pd.read_csv(proc_path + "rankings_data.csv")
+    Parameters
+    ----------
+    date_start, date_end : str
+        the range (dd/mm/yyyy, inclusive) of series start dates
+    proc_path : str
+        the data path for processed data
+    match_index : MatchIndex
+        the index of all matches
+    n_workers : int, optional
+        the number of worker processes used to resolve the series end dates
 
-    for year in range(start_year, end_year + 1):
-        if year == start_year:
-            month_i = start_month
-        else:
-            month_i = 1
-        if year == end_year:
-            month_f = end_month
-        else:
-            month_f = 12
+    Returns
+    -------
+    df : pandas dataframe
+        the series points data (including any previously computed points),
+        also written to series_points_data.csv
+    unresolved : pandas dataframe
+        the series in the range whose end date could not be found (these are
+        skipped)
+    """
 
-        for month in range(month_i, month_f + 1):
-            if month > 1:
-                date = datetime.date(year, month - 1, 1)
-            else:
-                date = datetime.date(year - 1, 12, 1)
+    series_df = pd.read_csv(proc_path + "series_data.csv", index_col=0)
+    counter = MatchCounter(series_df)
+    ratings_df = pd.read_csv(proc_path + "rankings_data.csv", index_col=0)
 
-            sum_rating_pts(date, series_df)
+    # filter series df by date range
+    date_i = pd.to_datetime(date_start, format="%d/%m/%Y")
+    date_f = pd.to_datetime(date_end, format="%d/%m/%Y")
+    series_dates = pd.to_datetime(series_df["date"], format="%d/%m/%Y")
+    series_df = series_df[(series_dates >= date_i) & (series_dates <= date_f)]
 
-    return
+    try:
+        df_prev = pd.read_csv(proc_path + "series_points_data.csv", index_col=0)
+    except FileNotFoundError:
+        df_prev = pd.DataFrame()
+
+    end_dates = resolve_series_ends(series_df, match_index, n_workers)
+    unresolved = series_df[end_dates.isna()]
+    report_unresolved_series(unresolved)
+    series_df = series_df[end_dates.notna()]
+    end_dates = pd.to_datetime(end_dates[end_dates.notna()], format="%Y/%m/%d")
+
+    # the ratings of both teams in the month the series finished (0 if unrated)
+    ratings = ratings_df.set_index(["year", "month", "team"])["rating"]
+    month_strs = end_dates.dt.month_name().str.upper()
+    start_ratings = {}
+    for side in ("home_team", "away_team"):
+        keys = pd.MultiIndex.from_arrays(
+            [end_dates.dt.year, month_strs, series_df[side]]
+        )
+        start_ratings[side] = ratings.reindex(keys).fillna(0.0).to_numpy()
+
+    home_pts, away_pts = calc_points_batch(
+        series_df["num_matches"],
+        series_df["home_team_pts"],
+        series_df["away_team_pts"],
+        start_ratings["home_team"],
+        start_ratings["away_team"],
+    )
+
+    # rolling match counts at the series end (1 for teams without any)
+    counts = counter.counts_at(end_dates).to_numpy()
+    team_codes = {team: code for code, team in enumerate(counter.teams_)}
+    rolling_matches = {}
+    for side in ("home_team", "away_team"):
+        codes = series_df[side].map(team_codes).fillna(-1).to_numpy(dtype="int64")
+        rows = np.arange(len(codes))
+        side_counts = np.where(codes >= 0, counts[rows, np.maximum(codes, 0)], 0)
+        rolling_matches[side] = np.where(side_counts > 0, side_counts, 1)
+
+    df = FrameBuilder(SERIES_POINTS_SCHEMA)
+    df.extend_columns(
+        {
+            "date": end_dates.dt.strftime("%Y-%m-01").tolist(),
+            "month": end_dates.dt.month.tolist(),
+            "year": end_dates.dt.year.tolist(),
+            "home_team": series_df["home_team"].tolist(),
+            "away_team": series_df["away_team"].tolist(),
+            "num_matches": series_df["num_matches"].tolist(),
+            "home_score": series_df["home_team_pts"].tolist(),
+            "away_score": series_df["away_team_pts"].tolist(),
+            "home_tot_points": home_pts.tolist(),
+            "away_tot_points": away_pts.tolist(),
+            "rolling_home_matches": rolling_matches["home_team"].tolist(),
+            "rolling_away_matches": rolling_matches["away_team"].tolist(),
+        }
+    )
 
+    # combine with any previously computed points and sort df by date
+    record(rows=len(df))
+    df = pd.concat([df_prev, df.to_frame()], ignore_index=True)
+    df.sort_values(by=["date"], inplace=True)
+    df.to_csv(proc_path + "series_points_data.csv")
 
-def sum_rating_pts(date_end, series_df):
+    return df, unresolved
 
-    series_df["date"] = pd.to_datetime(series_df.date, format="%Y-%m-%d").dt.date
 
-    # get a list of the test teams
-    test_teams = list(set(series_df.home_team))
+@instrumented()
+def propagate_rankings_data(start_year, start_month, end_year, end_month, proc_path):
+    """
+    Compute the monthly rankings from the series points data.
 
-    # retrieve the starting date
-    if date_end.month >= 5:
-        date_mid_year = date_end.year - 1
-    else:
-        date_mid_year = date_end.year - 2
+    Parameters
+    ----------
+    start_year, start_month, end_year, end_month : int
+        the first and last months (inclusive) of the rankings
+    proc_path : str
+        the data path for processed data
 
-    date_start_year = date_mid_year - 2
+    Returns
+    -------
+    df : pandas dataframe
+        the rankings (year, month, team, ranking, rating, points and matches)
+        for every month and team, computed in a single vectorized pass
+    """
 
-    date_start = datetime.date(date_start_year, 5, 1)
-    date_mid = datetime.date(date_mid_year, 5, 1)
+    series_df = pd.read_csv(proc_path + "series_points_data.csv", index_col=0)
 
-    half_weighting = series_df[
-        (series_df["date"] >= date_start) & (series_df["date"] < date_mid)
-    ]
+    df = monthly_rankings(series_df, start_year, start_month, end_year, end_month)
+    record(rows=len(df))
 
-    full_weighting = series_df[
-        (series_df["date"] >= date_mid) & (series_df["date"] <= date_end)
-    ]
+    return df
 
-    for team in test_teams:
 
-        team_home_pts = (
-            0.5
-            * half_weighting.loc[
-                half_weighting["home_team"] == team, "home_tot_points"
-            ].sum()
-            + full_weighting.loc[
-                full_weighting["home_team"] == team, "home_tot_points"
-            ].sum()
-        )
+def sum_rating_pts(date_end, series_df):
+    """
+    Sum the weighted rating points of each team at a given date.
 
-        team_away_pts = (
-            0.5
-            * half_weighting.loc[
-                half_weighting["away_team"] == team, "away_tot_points"
-            ].sum()
-            + full_weighting.loc[
-                full_weighting["away_team"] == team, "away_tot_points"
-            ].sum()
-        )
+    Parameters
+    ----------
+    date_end : datetime.date
+        the last date (inclusive) counted
+    series_df : pandas dataframe
+        the series points data
 
-        team_total_points = team_home_pts + team_away_pts
+    Returns
+    -------
+    team_points : dict
+        the weighted total points of each team
+    """
 
-        print(team, team_total_points)
+    table = PointsTable(series_df)
+    points, _ = table.totals_at(date_end)
+    team_points = dict(zip(table.teams_, points[0]))
 
-    return
+    return team_points
 
 
-def aggregate_rankings_data():
-    """WIP: compute rankings data for missing years, using initial data
-    and match data."""
+@instrumented()
+def aggregate_rankings_data(proc_path, match_index, date_end=None, n_workers=1):
+    """
+    Reconstruct the monthly rankings after March 2013 from the series results.
 
-    # get the initial data
-    df = init_ratings_data("../../data/processed/")
+    Parameters
+    ----------
+    proc_path : str
+        the data path for processed data
+    match_index : MatchIndex
+        the index of all matches, used to find when each series finished
+    date_end : str, optional
+        the date (yyyy/mm/dd) to produce rankings up to (default: the end of
+        the last series)
+    n_workers : int, optional
+        the number of worker processes used to resolve the series end dates
 
-    # loop through the series data
-    series_df = pd.read_csv("../../data/interim/series_data.csv")
-    ratings_df = pd.read_csv("../../data/processed/rankings_data.csv")
+    Returns
+    -------
+    df : pandas dataframe
+        the monthly rankings (year, month, team, ranking, rating, points and
+        matches) from April 2013
+    """
 
-    for index, row in series_df.iterrows():
+    # seed the ratings engine with the last known rankings data
+    date_start = "2013/03/01"
+    series_df = pd.read_csv(proc_path + "series_data.csv", index_col=0)
+    counter = MatchCounter(series_df)
+    engine = RatingsEngine.from_snapshot(
+        init_ratings_data(proc_path), counter, date_start
+    )
+
+    # the series finishing after the snapshot are the engine's events (and
+    # such a series starts less than a year before it)
+    first_start = pd.Timestamp(date_start) - pd.DateOffset(years=1)
+    series_df = series_df[
+        pd.to_datetime(series_df["date"], format="%d/%m/%Y") >= first_start
+    ]
+    end_dates = resolve_series_ends(series_df, match_index, n_workers)
+    report_unresolved_series(series_df[end_dates.isna()])
+    finished = end_dates.notna() & (end_dates >= date_start)
+    events = pd.DataFrame(
+        {
+            "date": end_dates[finished],
+            "home_team": series_df["home_team"][finished],
+            "away_team": series_df["away_team"][finished],
+            "num_matches": series_df["num_matches"][finished],
+            "home_score": series_df["home_team_pts"][finished],
+            "away_score": series_df["away_team_pts"][finished],
+        }
+    )
 
-        date_end = get_end_series_date(
-            row.date, row.num_matches, [row.home_team, row.away_team]
-        )
+    df = engine.run(events, date_end)
+    record(rows=len(df))
 
-        try:
-            date = datetime.datetime.strptime(date_end, "%Y/%m/%d")
-        except TypeError:
-            break
-
-        month_num = date.month
-        month_str = date.strftime("%B").upper()
-        year = date.year
-
-        try:
-            start_home_rating = float(
-                ratings_df[
-                    (ratings_df["year"] == year)
-                    & (ratings_df["month"] == month_str)
-                    & (ratings_df["team"] == row.home_team)
-                ].rating
-            )
-        except TypeError:
-            start_home_rating = 0.0
-
-        try:
-            start_away_rating = float(
-                ratings_df[
-                    (ratings_df["year"] == year)
-                    & (ratings_df["month"] == month_str)
-                    & (ratings_df["team"] == row.away_team)
-                ].rating
-            )
-        except TypeError:
-            start_away_rating = 0.0
-        print(start_home_rating, start_away_rating)
+    return df
 
 
 if __name__ == "__main__":
 
-    # print(init_ratings_data("../../data/processed/"))
-    calc_points_per_series("01/05/2009", "01/03/2013", "../../data/processed/")
-    propagate_rankings_data(2010, 5, 2013, 3, "../../data/processed/")
+    match_index = MatchIndex.from_directory(
+        "../../data/raw/match_data/", "../../data/interim/match_index.json"
+    )
+    df = aggregate_rankings_data("../../data/processed/", match_index)
+    df.to_csv("../../data/processed/rankings_data_reconstructed.csv")
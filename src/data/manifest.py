@@ -0,0 +1,190 @@
+"""Manifest of processed input files, used for incremental rebuilds."""
+
+import hashlib
+import json
+import os
+
+# bump this whenever the rows stored in the manifest change meaning, so that
+# manifests written by older code trigger a full rebuild
+MANIFEST_VERSION = 2
+
+
+def file_hash(fname):
+    """Compute the sha256 hash of a file's contents.
+
+    Parameters
+    ----------
+    fname : str
+        the file to hash
+
+    Returns
+    -------
+    digest : str
+        the hex digest of the file contents
+    """
+
+    sha = hashlib.sha256()
+    with open(fname, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class Manifest:
+    """Record of input files (size, mtime, hash) and the rows they produced.
+
+    The manifest is split into named sections (e.g. one for the match info
+    files and one for the rankings html files). A file is considered
+    unchanged if its size and mtime match the manifest, or failing that if
+    its content hash does.
+
+    Parameters
+    ----------
+    fname : str
+        the filename (and location) of the manifest json file
+    key : str, optional
+        an identifier of the code which produced the rows (e.g. a hash of
+        its source files); a manifest recorded under another key is
+        discarded, so every file is processed again after a code change
+    """
+
+    def __init__(self, fname, key=None):
+
+        self.fname_ = fname
+        try:
+            with open(fname, "r") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = {}
+        if data.get("version") != MANIFEST_VERSION or data.get("key") != key:
+            data = {"version": MANIFEST_VERSION, "key": key, "sections": {}}
+        self.data_ = data
+
+    def section(self, name):
+        """Get (creating if necessary) the entries of a manifest section."""
+
+        return self.data_["sections"].setdefault(name, {})
+
+    def clear(self, name):
+        """Remove all the entries of a section, forcing those files to rebuild."""
+
+        self.data_["sections"][name] = {}
+
+    def is_current(self, name, fname, fingerprint=None):
+        """Check whether a file is unchanged since it was recorded.
+
+        Parameters
+        ----------
+        name : str
+            the manifest section
+        fname : str
+            the input file
+        fingerprint : list, optional
+            an identifier of the file's contents to compare instead of its
+            size, mtime and hash (e.g. the size and CRC of an archive member)
+
+        Returns
+        -------
+        current : bool
+            True if the file is in the manifest and its contents are unchanged
+        """
+
+        entry = self.section(name).get(_key(fname))
+        if entry is None:
+            return False
+        if fingerprint is not None:
+            return entry.get("fingerprint") == fingerprint
+        stat = os.stat(fname)
+        if entry.get("size") == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return True
+        # the file has been touched: only the content hash is conclusive
+        if entry.get("size") == stat.st_size and entry["sha256"] == file_hash(fname):
+            entry["mtime"] = stat.st_mtime
+            return True
+        return False
+
+    def rows(self, name, fname):
+        """Get the rows recorded for a file."""
+
+        return self.section(name)[_key(fname)]["rows"]
+
+    def update(self, name, fname, rows, fingerprint=None):
+        """Record a file's current fingerprint and the rows it produced.
+
+        Parameters
+        ----------
+        name : str
+            the manifest section
+        fname : str
+            the input file
+        rows : json-serializable object
+            the rows (or any other output) produced from the file
+        fingerprint : list, optional
+            an identifier of the file's contents, recorded instead of its
+            size, mtime and hash (see ``is_current``)
+        """
+
+        if fingerprint is not None:
+            self.section(name)[_key(fname)] = {
+                "fingerprint": fingerprint,
+                "rows": rows,
+            }
+            return
+
+        stat = os.stat(fname)
+        self.section(name)[_key(fname)] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": file_hash(fname),
+            "rows": rows,
+        }
+
+    def prune(self, name, fnames):
+        """Drop the entries of files which are no longer inputs.
+
+        Parameters
+        ----------
+        name : str
+            the manifest section
+        fnames : list of str
+            the current input files of the section
+        """
+
+        keep = {_key(fname) for fname in fnames}
+        section = self.section(name)
+        for key in list(section):
+            if key not in keep:
+                del section[key]
+
+    def dependency_changed(self, fname):
+        """Check (and record) whether a file other stages depend on changed.
+
+        Parameters
+        ----------
+        fname : str
+            the dependency file, e.g. the venue info csv
+
+        Returns
+        -------
+        changed : bool
+            True if the file is new or its contents changed since last recorded
+        """
+
+        if self.is_current("dependencies", fname):
+            return False
+        self.update("dependencies", fname, None)
+        return True
+
+    def save(self):
+        """Write the manifest atomically (via a temporary file and rename)."""
+
+        tmp_fname = self.fname_ + "." + str(os.getpid()) + ".tmp"
+        with open(tmp_fname, "w") as f:
+            json.dump(self.data_, f)
+        os.replace(tmp_fname, self.fname_)
+
+
+def _key(fname):
+    """Manifest key of a file: its normalised path."""
+
+    return os.path.normpath(fname)
@@ -0,0 +1,271 @@
+"""In-memory index of the cricsheet matches, sorted by start date."""
+
+import bisect
+import datetime
+import glob
+import json
+import os
+
+from src.data.match_info import match_id_from_filename, read_match_info
+
+# a test match lasts at most this many days (timeless tests aside)
+MAX_MATCH_DAYS = 6
+# consecutive matches of a series start at most this many days apart
+MAX_SERIES_GAP_DAYS = 60
+
+
+class MatchRecord:
+    """The header information of a single match.
+
+    Parameters
+    ----------
+    match_id : int
+        the cricsheet match id
+    dates : list of datetime.date
+        all the dates on which the match was played
+    teams : tuple of str
+        the two teams
+    event : str or None
+        the name of the event (e.g. the series name)
+    match_number : int or None
+        the number of the match within the event
+    """
+
+    __slots__ = ("match_id", "dates", "teams", "event", "match_number")
+
+    def __init__(self, match_id, dates, teams, event=None, match_number=None):
+
+        self.match_id = match_id
+        self.dates = sorted(dates)
+        self.teams = tuple(teams)
+        self.event = event
+        self.match_number = match_number
+
+    @property
+    def start_date(self):
+        """datetime.date: the first day of the match."""
+        return self.dates[0]
+
+    @property
+    def end_date(self):
+        """datetime.date: the last day of the match."""
+        return self.dates[-1]
+
+    def to_dict(self):
+        return {
+            "match_id": self.match_id,
+            "dates": [date.isoformat() for date in self.dates],
+            "teams": list(self.teams),
+            "event": self.event,
+            "match_number": self.match_number,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["match_id"],
+            [datetime.date.fromisoformat(date) for date in data["dates"]],
+            data["teams"],
+            data["event"],
+            data["match_number"],
+        )
+
+
+def read_match_record(fname, archive=None):
+    """Read the header information of a match from its _info.csv file.
+
+    Parameters
+    ----------
+    fname : str
+        the info file (or member of the archive)
+    archive : MatchArchive, optional
+        the cricsheet archive to read the file from
+
+    Returns
+    -------
+    record : MatchRecord
+        the match record
+    """
+
+    info = read_match_info(fname, archive)
+    return MatchRecord(
+        info.match_id, info.dates, info.teams, info.event, info.match_number
+    )
+
+
+class MatchIndex:
+    """Index of matches sorted by start date, for date and team lookups.
+
+    The index is immutable once built, so it can safely be shared by (or
+    loaded independently in) parallel workers.
+
+    Parameters
+    ----------
+    records : list of MatchRecord
+        the matches to index
+    """
+
+    def __init__(self, records):
+
+        self.records_ = sorted(records, key=lambda r: (r.start_date, r.match_id))
+        self.start_dates_ = [record.start_date for record in self.records_]
+
+    def __len__(self):
+        return len(self.records_)
+
+    @classmethod
+    def from_directory(cls, match_datapath, cache_file=None, exclude_matches=None):
+        """Build the index from the info files in a directory.
+
+        Parameters
+        ----------
+        match_datapath : str
+            the directory containing the cricsheet _info.csv files
+        cache_file : str, optional
+            a json cache of the index; it is used if it is newer than every
+            info file, and (re)written otherwise
+        exclude_matches : iterable of int, optional
+            the ids of matches to leave out of the index
+
+        Returns
+        -------
+        index : MatchIndex
+            the match index
+        """
+
+        fnames = glob.glob(os.path.join(match_datapath, "*_info.csv"))
+        if exclude_matches:
+            exclude_matches = set(exclude_matches)
+            fnames = [
+                fname
+                for fname in fnames
+                if match_id_from_filename(fname) not in exclude_matches
+            ]
+        if cache_file is not None and os.path.exists(cache_file):
+            cache_mtime = os.path.getmtime(cache_file)
+            if all(os.path.getmtime(fname) <= cache_mtime for fname in fnames):
+                index = cls.load(cache_file)
+                if len(index) == len(fnames):
+                    return index
+
+        index = cls([read_match_record(fname) for fname in fnames])
+        if cache_file is not None:
+            index.save(cache_file)
+
+        return index
+
+    @classmethod
+    def from_archive(cls, archive):
+        """Build the index from the info files of a cricsheet archive.
+
+        Parameters
+        ----------
+        archive : MatchArchive
+            the match archive
+
+        Returns
+        -------
+        index : MatchIndex
+            the match index
+        """
+
+        return cls(
+            [read_match_record(member, archive) for member in archive.info_members()]
+        )
+
+    def save(self, fname):
+        """Write the index to a json file (atomically, via a rename)."""
+
+        tmp_fname = fname + "." + str(os.getpid()) + ".tmp"
+        with open(tmp_fname, "w") as f:
+            json.dump([record.to_dict() for record in self.records_], f)
+        os.replace(tmp_fname, fname)
+
+    @classmethod
+    def load(cls, fname):
+        """Load an index written by ``save``."""
+
+        with open(fname, "r") as f:
+            return cls([MatchRecord.from_dict(data) for data in json.load(f)])
+
+    def between(self, date_start, date_end):
+        """Get the matches starting between two dates (inclusive).
+
+        Parameters
+        ----------
+        date_start : datetime.date
+            the earliest start date
+        date_end : datetime.date
+            the latest start date
+
+        Returns
+        -------
+        records : list of MatchRecord
+            the matches, in order of start date
+        """
+
+        i = bisect.bisect_left(self.start_dates_, date_start)
+        j = bisect.bisect_right(self.start_dates_, date_end)
+        return self.records_[i:j]
+
+    def match_on(self, date, teams):
+        """Find the match between given teams which was in play on a date.
+
+        Parameters
+        ----------
+        date : datetime.date
+            any day of the match
+        teams : list of str
+            the teams contesting the match
+
+        Returns
+        -------
+        record : MatchRecord or None
+            the match, or None if there is no such match
+        """
+
+        window_start = date - datetime.timedelta(days=MAX_MATCH_DAYS)
+        for record in self.between(window_start, date):
+            if record.end_date >= date and set(teams) <= set(record.teams):
+                return record
+        return None
+
+    def series_end(self, start_date, num_matches, teams):
+        """Find the last match of a series from its start date.
+
+        Parameters
+        ----------
+        start_date : datetime.date
+            the start date of the series (any day of its first match)
+        num_matches : int
+            the number of matches in the series
+        teams : list of str
+            the teams contesting the series
+
+        Returns
+        -------
+        record : MatchRecord or None
+            the final match of the series, or None if the first match or
+            enough subsequent matches between the teams cannot be found
+            (matches more than ``MAX_SERIES_GAP_DAYS`` apart are not
+            considered part of the same series)
+        """
+
+        first = self.match_on(start_date, teams)
+        if first is None:
+            return None
+
+        # the series is the next num_matches matches between the two teams
+        i = bisect.bisect_left(self.start_dates_, first.start_date)
+        max_gap = datetime.timedelta(days=MAX_SERIES_GAP_DAYS)
+        previous = first
+        count = 0
+        for record in self.records_[i:]:
+            if record.start_date - previous.start_date > max_gap:
+                break
+            if set(record.teams) == set(first.teams):
+                previous = record
+                count += 1
+                if count == num_matches:
+                    return record
+        return None
@@ -0,0 +1,259 @@
+"""Parser of the cricsheet match info (``_info.csv``) files.
+
+Each line of an info file is ``info,<key>,<value>``; every line is split
+once and dispatched on its key into a compact ``MatchInfo`` record, which
+is shared by the dataset and the rankings code.
+"""
+
+import datetime
+import os
+
+
+class MatchInfo:
+    """The information of a single match from its info file.
+
+    All the dates of the match are kept in order, so ``start_date`` is the
+    first day of the match (not the last date line of the file). A match
+    has either a ``winner`` (with the margin in ``win_by_runs``,
+    ``win_by_wickets`` and ``win_by_innings``) or an ``outcome`` such as
+    "draw"; ``result`` gives whichever is set.
+
+    Parameters
+    ----------
+    match_id : int
+        the cricsheet match id
+    """
+
+    __slots__ = (
+        "match_id",
+        "dates",
+        "teams",
+        "season",
+        "gender",
+        "event",
+        "match_number",
+        "venue",
+        "city",
+        "toss_winner",
+        "toss_decision",
+        "winner",
+        "outcome",
+        "method",
+        "win_by_runs",
+        "win_by_wickets",
+        "win_by_innings",
+        "player_of_match",
+        "player_lines_",
+        "players_",
+    )
+
+    def __init__(self, match_id):
+
+        self.match_id = match_id
+        self.dates = []
+        self.teams = []
+        self.season = None
+        self.gender = None
+        self.event = None
+        self.match_number = None
+        self.venue = None
+        self.city = None
+        self.toss_winner = None
+        self.toss_decision = None
+        self.winner = None
+        self.outcome = None
+        self.method = None
+        self.win_by_runs = None
+        self.win_by_wickets = None
+        self.win_by_innings = False
+        self.player_of_match = []
+        self.player_lines_ = ""
+        self.players_ = None
+
+    def __repr__(self):
+        return "MatchInfo(%d, %s, %s)" % (
+            self.match_id,
+            " v ".join(self.teams),
+            self.start_date,
+        )
+
+    @property
+    def start_date(self):
+        """datetime.date: the first day of the match (None if undated)."""
+        return self.dates[0] if self.dates else None
+
+    @property
+    def end_date(self):
+        """datetime.date: the last day of the match (None if undated)."""
+        return self.dates[-1] if self.dates else None
+
+    @property
+    def players(self):
+        """dict: the players of each team, split from the file on first use."""
+        if self.players_ is None:
+            self.players_ = _parse_players(self.player_lines_)
+            self.player_lines_ = ""
+        return self.players_
+
+    @property
+    def result(self):
+        """str: the winning team, or the outcome (e.g. "draw") if no winner."""
+        return self.winner if self.winner is not None else self.outcome
+
+
+def _unquote(value):
+    """Remove the csv quotes around a value (e.g. a venue with a comma)."""
+
+    if len(value) > 1 and value[0] == '"' and value[-1] == '"':
+        return value[1:-1].replace('""', '"')
+    return value
+
+
+# the MatchInfo attribute of each single-valued info key; other keys
+# (umpires, ...) are ignored
+_ATTRIBUTES = {
+    "season": "season",
+    "gender": "gender",
+    "event": "event",
+    "match_number": "match_number",
+    "venue": "venue",
+    "city": "city",
+    "toss_winner": "toss_winner",
+    "toss_decision": "toss_decision",
+    "winner": "winner",
+    "outcome": "outcome",
+    "method": "method",
+    "winner_runs": "win_by_runs",
+    "winner_wickets": "win_by_wickets",
+    "winner_innings": "win_by_innings",
+}
+
+# the conversion of the attributes which are not strings
+_CONVERSIONS = {
+    "match_number": int,
+    "win_by_runs": int,
+    "win_by_wickets": int,
+    "win_by_innings": lambda value: value == "1",
+}
+
+
+def parse_match_info(text, match_id):
+    """Parse the contents of an info file into a MatchInfo record.
+
+    Cricsheet writes the match details first, then the players and lastly
+    the people registry. The registry is not needed, and the player lines
+    are kept as they are until the players are first used.
+
+    Parameters
+    ----------
+    text : str
+        the contents of the info file
+    match_id : int
+        the cricsheet match id
+
+    Returns
+    -------
+    info : MatchInfo
+        the match information
+
+    Raises
+    ------
+    ValueError
+        if a date or number in the file can't be parsed
+    """
+
+    end = text.find("\ninfo,registry,")
+    if end >= 0:
+        text = text[: end + 1]
+    start = _find_players(text)
+
+    info = MatchInfo(match_id)
+    info.player_lines_ = text[start:]
+    attributes = _ATTRIBUTES
+    dates = info.dates
+    for key, value in _header_fields(text[:start]):
+        if key == "date":
+            year, month, day = value.split("/")
+            dates.append(datetime.date(int(year), int(month), int(day)))
+        elif key == "team":
+            info.teams.append(value)
+        elif key == "player_of_match":
+            info.player_of_match.append(value)
+        elif key in attributes:
+            setattr(info, attributes[key], value)
+    dates.sort()
+    for attribute, convert in _CONVERSIONS.items():
+        value = getattr(info, attribute)
+        if isinstance(value, str):
+            setattr(info, attribute, convert(value))
+
+    return info
+
+
+def _header_fields(header):
+    """Yield the (key, value) of every ``info`` line of the match details."""
+
+    for line in header.splitlines():
+        fields = line.split(",", 2)
+        if len(fields) < 3 or fields[0] != "info":
+            continue
+        value = fields[2].strip()
+        if value[:1] == '"':
+            value = _unquote(value)
+        yield fields[1], value
+
+
+def _find_players(text):
+    """The position of the first player line (the end of the text if none)."""
+
+    positions = [
+        text.find(prefix) + 1 for prefix in ("\ninfo,player,", "\ninfo,players,")
+    ]
+    positions = [position for position in positions if position > 0]
+    return min(positions) if positions else len(text)
+
+
+def _parse_players(player_lines):
+    """Split up the player lines of an info file by team."""
+
+    players = {}
+    for line in player_lines.splitlines():
+        fields = line.split(",", 3)
+        if len(fields) < 4 or not fields[1].startswith("player"):
+            continue
+        team_players = players.get(fields[2])
+        if team_players is None:
+            team_players = players[fields[2]] = []
+        team_players.append(fields[3].strip())
+    return players
+
+
+def match_id_from_filename(filename):
+    """Get the (integer) cricsheet match id from a match data filename.
+
+    This is the number before the ``_info.csv`` or ``.csv`` suffix, e.g. 64012
+    for ``data/raw/match_data/64012_info.csv`` (or an archive member).
+    """
+
+    return int(os.path.basename(filename).split("_")[0].split(".")[0])
+
+
+def read_match_info(fname, archive=None):
+    """Read an info file (or a member of a cricsheet archive).
+
+    Parameters
+    ----------
+    fname : str
+        the info file, e.g. ``data/raw/match_data/64012_info.csv``
+    archive : MatchArchive, optional
+        the archive to read the file from
+
+    Returns
+    -------
+    info : MatchInfo
+        the match information
+    """
+
+    match_id = match_id_from_filename(fname)
+    with open(fname, "r") if archive is None else archive.open(fname) as f:
+        return parse_match_info(f.read(), match_id)
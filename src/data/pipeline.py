@@ -0,0 +1,621 @@
+"""Content-addressed runner for the stages of the data pipeline.
+
+Each ``Stage`` declares the files it reads (``inputs``, which may be glob
+patterns), the files it writes (``outputs``) and the source files of its
+code. A stage is skipped if the hashes of all of these are unchanged since
+it last ran successfully, so after a change only the affected stages (and
+those downstream whose inputs actually changed) run again. The
+dependencies between stages follow from their inputs and outputs, and
+stages which do not depend on each other run concurrently.
+
+The pipeline of this project is built by ``data_pipeline``; run it with
+``make data`` or::
+
+    python -m src.data.pipeline data/raw/ data/interim/ data/processed/ --jobs 4
+"""
+
+import argparse
+import datetime
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from src.data.instrument import RunReport, stage as instrument_stage
+from src.data.make_dataset import ProcessData
+from src.data.make_rankings_data import (
+    aggregate_rankings_data,
+    calc_points_per_series,
+    series_data_to_csv,
+)
+from src.data.manifest import file_hash
+from src.data.match_index import MatchIndex
+from src.data.validate import (
+    INFO_QUARANTINE_FILE,
+    QUARANTINE_FILE,
+    quarantined_files,
+    quarantined_matches,
+    validate_info_files,
+    validate_match_data,
+)
+
+STATE_FILE = "pipeline_state.json"
+RUN_REPORT_FILE = "run_report.json"
+
+# bump this whenever the stage keys change meaning, to re-run every stage
+STATE_VERSION = 1
+
+
+class Stage:
+    """A step of the pipeline with declared inputs and outputs.
+
+    Parameters
+    ----------
+    name : str
+        the (unique) name of the stage
+    func : callable
+        a module-level function (so it can be run in a worker process)
+    inputs : list of str
+        the files read by the stage; glob patterns are expanded
+    outputs : list of str
+        the files written by the stage
+    code : list of str, optional
+        the source files of the stage's code (default the module of ``func``)
+    kwargs : dict, optional
+        the keyword arguments of ``func``, which are also part of the key
+    incremental : bool, optional
+        if True, ``func`` keeps caches of its own and takes an ``incremental``
+        argument, which is False when the stage is forced (so the caches are
+        not used)
+    """
+
+    def __init__(
+        self, name, func, inputs, outputs, code=None, kwargs=None, incremental=False
+    ):
+
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        if code is None:
+            code = [os.path.abspath(func.__globals__["__file__"])]
+        self.code = list(code)
+        self.kwargs = dict(kwargs or {})
+        self.incremental = incremental
+
+    def input_files(self):
+        """The input files, with glob patterns expanded (sorted)."""
+
+        fnames = []
+        for pattern in self.inputs:
+            if glob.has_magic(pattern):
+                fnames.extend(glob.glob(pattern))
+            else:
+                fnames.append(pattern)
+        return sorted(set(os.path.normpath(fname) for fname in fnames))
+
+
+class Pipeline:
+    """A set of stages, run in dependency order with skipping of fresh stages.
+
+    Parameters
+    ----------
+    stages : list of Stage
+        the stages (in any order)
+    state_file : str
+        the json file recording the key of each stage's last successful run
+    """
+
+    def __init__(self, stages, state_file):
+
+        self.stages_ = {stage.name: stage for stage in stages}
+        self.state_file_ = state_file
+
+        # a stage depends on the stages which write any of its inputs
+        producers = {}
+        for stage in stages:
+            for output in stage.outputs:
+                producers[os.path.normpath(output)] = stage.name
+        self.deps_ = {}
+        for stage in stages:
+            deps = set()
+            for pattern in stage.inputs:
+                for output, producer in producers.items():
+                    matches = fnmatch.fnmatch(output, os.path.normpath(pattern))
+                    if producer != stage.name and matches:
+                        deps.add(producer)
+            self.deps_[stage.name] = deps
+        self._check_acyclic()
+
+        try:
+            with open(state_file, "r") as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            state = {}
+        if state.get("version") != STATE_VERSION:
+            state = {"version": STATE_VERSION, "stages": {}, "hashes": {}}
+        self.state_ = state
+        self.done_ = set()
+        self.ran_ = []
+        self.records_ = []
+
+    def _check_acyclic(self):
+        """Raise a ValueError if the stage dependencies have a cycle."""
+
+        done = set()
+        remaining = dict(self.deps_)
+        while remaining:
+            ready = [name for name, deps in remaining.items() if deps <= done]
+            if not ready:
+                raise ValueError(
+                    "pipeline stages have cyclic dependencies: "
+                    + ", ".join(sorted(remaining))
+                )
+            for name in ready:
+                done.add(name)
+                del remaining[name]
+
+    def _hash(self, fname):
+        """Hash a file, reusing the stored hash if its size and mtime match."""
+
+        stat = os.stat(fname)
+        entry = self.state_["hashes"].get(fname)
+        if entry is not None and entry[:2] == [stat.st_size, stat.st_mtime]:
+            return entry[2]
+        digest = file_hash(fname)
+        self.state_["hashes"][fname] = [stat.st_size, stat.st_mtime, digest]
+        return digest
+
+    def stage_key(self, name):
+        """The content hash of a stage's code, arguments and input files."""
+
+        stage = self.stages_[name]
+        sha = hashlib.sha256()
+        sha.update(name.encode())
+        sha.update(json.dumps(stage.kwargs, sort_keys=True, default=str).encode())
+        for fname in stage.code + stage.input_files():
+            sha.update(fname.encode())
+            if os.path.exists(fname):
+                sha.update(self._hash(fname).encode())
+        return sha.hexdigest()
+
+    def is_fresh(self, name, key):
+        """Check if a stage last ran with this key and its outputs are intact."""
+
+        entry = self.state_["stages"].get(name)
+        if entry is None or entry["key"] != key:
+            return False
+        for output, digest in entry["outputs"].items():
+            if not os.path.exists(output) or self._hash(output) != digest:
+                return False
+        return True
+
+    def downstream(self, names):
+        """The given stages and every stage which depends on them."""
+
+        selected = set(names)
+        changed = True
+        while changed:
+            changed = False
+            for name, deps in self.deps_.items():
+                if name not in selected and deps & selected:
+                    selected.add(name)
+                    changed = True
+        return selected
+
+    def run(self, n_jobs=1, force=(), report_file=None):
+        """Run every stage which is not up to date.
+
+        Parameters
+        ----------
+        n_jobs : int, optional
+            the number of stages run concurrently (in worker processes)
+        force : list of str, optional
+            stages to run even if they are up to date (with those downstream)
+        report_file : str, optional
+            write the run report of the stages which ran to this json file
+
+        Returns
+        -------
+        ran : list of str
+            the stages which ran, in order of completion
+        """
+
+        started = datetime.datetime.now().isoformat(timespec="seconds")
+        t0 = time.perf_counter()
+        forced = self.downstream(force)
+        pending = set(self.stages_)
+        self.done_ = set()
+        self.ran_ = []
+        self.records_ = []
+
+        executor = ProcessPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else None
+        running = {}
+        try:
+            while pending or running:
+                ready = [name for name in pending if self.deps_[name] <= self.done_]
+                for name in sorted(ready):
+                    pending.discard(name)
+                    key = self.stage_key(name)
+                    if name not in forced and self.is_fresh(name, key):
+                        print("pipeline: skipping", name, "(up to date)")
+                        self.done_.add(name)
+                        continue
+                    print("pipeline: running", name)
+                    args = (self.stages_[name], name not in forced)
+                    if executor is None:
+                        self._finish(name, key, _run_stage(*args))
+                    else:
+                        running[executor.submit(_run_stage, *args)] = (name, key)
+                if running:
+                    completed, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                    for future in completed:
+                        self._finish(*running.pop(future), future.result())
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        if report_file is not None:
+            wall_s = time.perf_counter() - t0
+            _write_report(report_file, started, wall_s, self.ran_, self.records_)
+
+        return self.ran_
+
+    def _finish(self, name, key, stage_records):
+        """Record a successful run of a stage: its key and output hashes."""
+
+        self.state_["stages"][name] = {
+            "key": key,
+            "outputs": {
+                output: self._hash(output)
+                for output in self.stages_[name].outputs
+                if os.path.exists(output)
+            },
+        }
+        self.save()
+        self.records_.extend(stage_records)
+        self.ran_.append(name)
+        self.done_.add(name)
+
+    def save(self):
+        """Write the pipeline state atomically (via a rename)."""
+
+        os.makedirs(os.path.dirname(self.state_file_) or ".", exist_ok=True)
+        tmp_fname = self.state_file_ + ".tmp"
+        with open(tmp_fname, "w") as f:
+            json.dump(self.state_, f)
+        os.replace(tmp_fname, self.state_file_)
+
+
+def _write_report(fname, started, wall_s, ran, records):
+    """Write the run report of a pipeline run as json."""
+
+    report = {
+        "started": started,
+        "wall_s": wall_s,
+        "stages_run": ran,
+        "stages": records,
+    }
+    with open(fname, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def _run_stage(stage, incremental=True):
+    """Run a stage (possibly in a worker) and return its instrumentation."""
+
+    for output in stage.outputs:
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+
+    kwargs = dict(stage.kwargs)
+    if stage.incremental:
+        kwargs["incremental"] = incremental
+
+    t0 = time.perf_counter()
+    report = RunReport()
+    with report.activate():
+        with instrument_stage(stage.name):
+            stage.func(**kwargs)
+    print("pipeline: finished", stage.name, "in %.2f s" % (time.perf_counter() - t0))
+
+    return [record.to_dict() for record in report.stages_]
+
+
+# the stages of the project's data pipeline
+
+
+def validate_info_stage(raw_path, interim_path):
+    """Check the match info files and write the info quarantine report."""
+
+    report = validate_info_files(raw_path + "match_data/")
+    report.to_csv(interim_path + INFO_QUARANTINE_FILE, index=False)
+    files = quarantined_files(report)
+    if files:
+        print(
+            "validate_info:",
+            len(files),
+            "info files quarantined, see",
+            interim_path + INFO_QUARANTINE_FILE,
+        )
+
+
+def validate_stage(raw_path, interim_path, n_workers=1):
+    """Check the raw match files and write the quarantine report.
+
+    None of the stages here read the deliveries, so none depend on this
+    report; it is used by ``make deliveries``.
+    """
+
+    report = validate_match_data(raw_path + "match_data/", n_workers=n_workers)
+    report.to_csv(interim_path + QUARANTINE_FILE, index=False)
+    files = quarantined_files(report)
+    if files:
+        print(
+            "validate:",
+            len(files),
+            "files quarantined, see",
+            interim_path + QUARANTINE_FILE,
+        )
+
+
+def code_hash(fnames):
+    """The combined content hash of a list of source files."""
+
+    sha = hashlib.sha256()
+    for fname in fnames:
+        sha.update(file_hash(fname).encode())
+    return sha.hexdigest()
+
+
+def rankings_stage(
+    raw_path, proc_path, n_workers=1, incremental=True, manifest_key=None
+):
+    """Parse the rankings html files to rankings_data.csv.
+
+    In incremental mode only the files which are new or changed since they
+    were parsed by the same code (``manifest_key``) are parsed.
+    """
+
+    ProcessData(
+        raw_path,
+        proc_path,
+        2003,
+        2013,
+        "rankings_data.csv",
+        "aggregate_data.csv",
+        n_workers=n_workers,
+        incremental=incremental,
+        manifest_key=manifest_key,
+    ).rankings_to_csv()
+
+
+def aggregate_stage(
+    raw_path,
+    interim_path,
+    proc_path,
+    n_workers=1,
+    incremental=True,
+    manifest_key=None,
+):
+    """Join the match info files with the rankings to aggregate_data.csv.
+
+    The matches quarantined by the validate_info stage are left out, and the
+    info files are parsed incrementally as in ``rankings_stage``.
+    """
+
+    ProcessData(
+        raw_path,
+        proc_path,
+        2003,
+        2013,
+        "rankings_data.csv",
+        "aggregate_data.csv",
+        n_workers=n_workers,
+        incremental=incremental,
+        manifest_key=manifest_key,
+        exclude_matches=quarantined_matches(interim_path + INFO_QUARANTINE_FILE),
+    ).agg_data_to_csv()
+
+
+def series_stage(raw_path, interim_path, proc_path):
+    """Parse the howstat series pages to series_data.csv."""
+
+    series_data_to_csv(raw_path + "series_data/", interim_path, proc_path)
+
+
+def match_index_stage(raw_path, interim_path):
+    """Index the matches (but those quarantined by validate_info) by date."""
+
+    MatchIndex.from_directory(
+        raw_path + "match_data/",
+        exclude_matches=quarantined_matches(interim_path + INFO_QUARANTINE_FILE),
+    ).save(interim_path + "match_index.json")
+
+
+def series_points_stage(interim_path, proc_path):
+    """Compute the points won in every series to series_points_data.csv."""
+
+    # the points are appended to any existing file, so start afresh
+    fname = proc_path + "series_points_data.csv"
+    if os.path.exists(fname):
+        os.remove(fname)
+    match_index = MatchIndex.load(interim_path + "match_index.json")
+    calc_points_per_series("01/01/2000", "31/12/2029", proc_path, match_index)
+
+
+def reconstructed_rankings_stage(interim_path, proc_path):
+    """Reconstruct the rankings after March 2013 with the ratings engine."""
+
+    match_index = MatchIndex.load(interim_path + "match_index.json")
+    df = aggregate_rankings_data(proc_path, match_index)
+    df.to_csv(proc_path + "rankings_data_reconstructed.csv")
+
+
+def data_pipeline(raw_path, interim_path, proc_path, n_workers=1):
+    """Build the project's data pipeline.
+
+    Parameters
+    ----------
+    raw_path, interim_path, proc_path : str
+        the raw, interim and processed data paths (with trailing slashes)
+    n_workers : int, optional
+        the number of worker processes used within the parsing stages
+
+    Returns
+    -------
+    pipeline : Pipeline
+        the pipeline, with its state kept in the interim data path
+    """
+
+    src_path = os.path.dirname(os.path.abspath(__file__))
+
+    def code(*modules):
+        return [os.path.join(src_path, module + ".py") for module in modules]
+
+    dataset_code = code(
+        "make_dataset", "builders", "manifest", "venues", "match_info", "archive"
+    )
+    # the rows in the input manifest are only reused by the same parsing code
+    dataset_key = code_hash(dataset_code)
+    rankings_code = code(
+        "make_rankings_data", "ratings", "builders", "match_index", "match_info"
+    )
+
+    stages = [
+        Stage(
+            "validate_info",
+            validate_info_stage,
+            [raw_path + "match_data/*_info.csv"],
+            [interim_path + INFO_QUARANTINE_FILE],
+            code=code("validate", "match_info"),
+            kwargs={"raw_path": raw_path, "interim_path": interim_path},
+        ),
+        Stage(
+            "validate",
+            validate_stage,
+            [raw_path + "match_data/*.csv"],
+            [interim_path + QUARANTINE_FILE],
+            code=code("validate", "deliveries", "match_info"),
+            kwargs={
+                "raw_path": raw_path,
+                "interim_path": interim_path,
+                "n_workers": n_workers,
+            },
+        ),
+        Stage(
+            "rankings",
+            rankings_stage,
+            [raw_path + "rankings_data/rankings_data_*.html"],
+            [proc_path + "rankings_data.csv"],
+            code=dataset_code,
+            kwargs={
+                "raw_path": raw_path,
+                "proc_path": proc_path,
+                "n_workers": n_workers,
+                "manifest_key": dataset_key,
+            },
+            incremental=True,
+        ),
+        Stage(
+            "aggregate",
+            aggregate_stage,
+            [
+                raw_path + "match_data/*_info.csv",
+                raw_path + "venue_info.csv",
+                proc_path + "rankings_data.csv",
+                interim_path + INFO_QUARANTINE_FILE,
+            ],
+            [proc_path + "aggregate_data.csv"],
+            code=dataset_code,
+            kwargs={
+                "raw_path": raw_path,
+                "interim_path": interim_path,
+                "proc_path": proc_path,
+                "n_workers": n_workers,
+                "manifest_key": dataset_key,
+            },
+            incremental=True,
+        ),
+        Stage(
+            "series",
+            series_stage,
+            [raw_path + "series_data/series_data_*.html"],
+            [proc_path + "series_data.csv"],
+            code=rankings_code,
+            kwargs={
+                "raw_path": raw_path,
+                "interim_path": interim_path,
+                "proc_path": proc_path,
+            },
+        ),
+        Stage(
+            "match_index",
+            match_index_stage,
+            [raw_path + "match_data/*_info.csv", interim_path + INFO_QUARANTINE_FILE],
+            [interim_path + "match_index.json"],
+            code=code("match_index", "match_info"),
+            kwargs={"raw_path": raw_path, "interim_path": interim_path},
+        ),
+        Stage(
+            "series_points",
+            series_points_stage,
+            [
+                proc_path + "series_data.csv",
+                proc_path + "rankings_data.csv",
+                interim_path + "match_index.json",
+            ],
+            [proc_path + "series_points_data.csv"],
+            code=rankings_code,
+            kwargs={"interim_path": interim_path, "proc_path": proc_path},
+        ),
+        Stage(
+            "reconstructed_rankings",
+            reconstructed_rankings_stage,
+            [
+                proc_path + "series_data.csv",
+                proc_path + "rankings_data.csv",
+                interim_path + "match_index.json",
+            ],
+            [proc_path + "rankings_data_reconstructed.csv"],
+            code=rankings_code,
+            kwargs={"interim_path": interim_path, "proc_path": proc_path},
+        ),
+    ]
+
+    return Pipeline(stages, interim_path + STATE_FILE)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run the data pipeline.")
+    parser.add_argument("raw_path", help="the raw data path")
+    parser.add_argument("interim_path", help="the interim data path")
+    parser.add_argument("proc_path", help="the processed data path")
+    parser.add_argument(
+        "--jobs", type=int, default=1, help="number of stages run concurrently"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes used to parse files within a stage",
+    )
+    parser.add_argument(
+        "--force",
+        nargs="*",
+        metavar="STAGE",
+        help="re-run these stages (and those downstream); all if none are given",
+    )
+    args = parser.parse_args()
+
+    pipeline = data_pipeline(
+        args.raw_path, args.interim_path, args.proc_path, n_workers=args.workers
+    )
+    force = args.force or []
+    if args.force == []:
+        force = list(pipeline.stages_)
+    pipeline.run(
+        n_jobs=args.jobs, force=force, report_file=args.proc_path + RUN_REPORT_FILE
+    )
@@ -0,0 +1,674 @@
+"""Engines for reconstructing the ICC test ratings.
+
+The ratings at a given date count the series played since the May of
+three or four years earlier (see ``rating_window``): series from the older
+two years are weighted at 50% and those from the latest year or two at 100%.
+"""
+
+import numpy as np
+import pandas as pd
+
+from src.data.builders import FrameBuilder
+
+# column dtypes of the rankings tables produced by the engines
+RATINGS_SCHEMA = {
+    "year": "int64",
+    "month": object,
+    "team": object,
+    "ranking": "int64",
+    "rating": "float64",
+    "points": "float64",
+    "matches": "float64",
+}
+
+
+def rating_year(date):
+    """The rating year (starting on the 1st of May) a date falls in."""
+
+    return date.year if date.month >= 5 else date.year - 1
+
+
+def rating_window(dates):
+    """Get the rating window boundaries for one or more dates.
+
+    Parameters
+    ----------
+    dates : date-like or array-like of dates
+        the date(s) at which the ratings are computed
+
+    Returns
+    -------
+    date_start, date_mid : pd.Timestamp or pd.DatetimeIndex
+        the start of the counting window and of the fully weighted period
+        (both the 1st of May)
+    """
+
+    dates = pd.to_datetime(dates)
+    scalar = np.ndim(dates) == 0
+    dates = pd.DatetimeIndex(np.atleast_1d(dates))
+
+    # the fully weighted period starts in the May one or two years earlier
+    mid_year = np.where(dates.month >= 5, dates.year - 1, dates.year - 2)
+    date_mid = pd.to_datetime(pd.DataFrame({"year": mid_year, "month": 5, "day": 1}))
+    date_start = pd.to_datetime(
+        pd.DataFrame({"year": mid_year - 2, "month": 5, "day": 1})
+    )
+    date_mid = pd.DatetimeIndex(date_mid)
+    date_start = pd.DatetimeIndex(date_start)
+
+    if scalar:
+        return date_start[0], date_mid[0]
+    return date_start, date_mid
+
+
+def counted_matches(num_matches, min_series_matches=2, series_bonus=1):
+    """Number of matches each series counts for in the ratings.
+
+    Parameters
+    ----------
+    num_matches : array-like of int
+        the number of matches in each series
+    min_series_matches : int, optional
+        series with fewer matches than this are not counted
+    series_bonus : int, optional
+        the extra match counted for each series, since an extra point is
+        available to the series winner
+
+    Returns
+    -------
+    counted : np.ndarray
+        the matches counted for each series
+    """
+
+    num_matches = np.asarray(num_matches, dtype=np.int64)
+    return np.where(num_matches >= min_series_matches, num_matches + series_bonus, 0)
+
+
+def _cumulative_by_team(teams, home, away, home_values, away_values):
+    """Cumulative per-team sums of per-series values, of shape (teams, n+1)."""
+
+    team_codes = {team: code for code, team in enumerate(teams)}
+    n_series = len(home)
+    values = np.zeros((len(teams), n_series), dtype=np.result_type(home_values))
+    columns = np.arange(n_series)
+    values[[team_codes[t] for t in home], columns] += home_values
+    values[[team_codes[t] for t in away], columns] += away_values
+
+    cum_values = np.zeros((len(teams), n_series + 1), dtype=values.dtype)
+    np.cumsum(values, axis=1, out=cum_values[:, 1:])
+    return cum_values
+
+
+def calc_points_batch(num_matches, home_score, away_score, home_rating, away_rating):
+    """Compute the ratings points won by each team for arrays of series.
+
+    Each drawn match is worth half a win to both teams, and the series
+    winner gets one extra win (half each if the series is drawn). If the
+    ratings of the two teams are less than 40 points apart, a team gets the
+    opponent's rating plus 50 for each win and minus 50 for each loss.
+    Otherwise each team's points are relative to its own rating: the
+    stronger team gets its rating plus 10 per win and minus 90 per loss,
+    and the weaker team its rating plus 90 per win and minus 10 per loss.
+
+    Parameters
+    ----------
+    num_matches : array-like of int
+        the number of matches in each series
+    home_score, away_score : array-like of int
+        the matches won by the home and away teams
+    home_rating, away_rating : array-like of float
+        the ratings of the home and away teams before the series
+
+    Returns
+    -------
+    home_points, away_points : np.ndarray
+        the points won by the home and away teams
+    """
+
+    num_matches, home_score, away_score, home_rating, away_rating = (
+        np.asarray(values, dtype="float64")
+        for values in (num_matches, home_score, away_score, home_rating, away_rating)
+    )
+
+    # add half a point for each drawn game
+    half_draws = 0.5 * (num_matches - (home_score + away_score))
+    home_wins = home_score + half_draws
+    away_wins = away_score + half_draws
+
+    # add bonus points for series result
+    home_bonus = np.select([home_wins > away_wins, home_wins == away_wins], [1, 0.5])
+    away_bonus = 1 - home_bonus
+    home_wins = home_wins + home_bonus
+    away_wins = away_wins + away_bonus
+
+    # the rating each team's points are relative to: the opponent's within
+    # 40 points, else its own
+    within_40 = np.abs(home_rating - away_rating) < 40
+    home_base = np.where(within_40, away_rating, home_rating)
+    away_base = np.where(within_40, home_rating, away_rating)
+
+    # the bonus per win and per loss relative to that rating
+    home_stronger = home_rating > away_rating
+    home_win_bonus = np.where(within_40, 50, np.where(home_stronger, 10, 90))
+    home_loss_bonus = np.where(within_40, -50, np.where(home_stronger, -90, -10))
+    away_win_bonus = np.where(within_40, 50, np.where(home_stronger, 90, 10))
+    away_loss_bonus = np.where(within_40, -50, np.where(home_stronger, -10, -90))
+
+    home_points = home_wins * (home_base + home_win_bonus) + away_wins * (
+        home_base + home_loss_bonus
+    )
+    away_points = away_wins * (away_base + away_win_bonus) + home_wins * (
+        away_base + away_loss_bonus
+    )
+
+    return home_points, away_points
+
+
+class MatchCounter:
+    """Rolling count of the matches contributing to each team's rating.
+
+    The series table is sorted once and cumulative per-team match counts are
+    stored, so the counts in any window are a difference of two rows found
+    with ``searchsorted``.
+
+    Parameters
+    ----------
+    series_df : pd.DataFrame
+        the series data, with date (datetime-like or dd/mm/yyyy strings),
+        home_team, away_team and num_matches columns
+    min_series_matches, series_bonus : int, optional
+        see ``counted_matches`` (by default single-match series are skipped)
+    """
+
+    def __init__(self, series_df, min_series_matches=2, series_bonus=1):
+
+        self.min_series_matches_ = min_series_matches
+        self.series_bonus_ = series_bonus
+
+        dates = series_df["date"]
+        if not pd.api.types.is_datetime64_any_dtype(dates):
+            dates = pd.to_datetime(dates, format="%d/%m/%Y")
+        order = np.argsort(dates.to_numpy(), kind="stable")
+        self.dates_ = dates.to_numpy()[order]
+
+        home = series_df["home_team"].to_numpy()[order]
+        away = series_df["away_team"].to_numpy()[order]
+        self.teams_ = sorted(set(home) | set(away))
+
+        counted = counted_matches(
+            series_df["num_matches"].to_numpy()[order],
+            min_series_matches,
+            series_bonus,
+        )
+
+        # cum_matches_[t, i] = matches counted for team t in the first i series
+        self.cum_matches_ = _cumulative_by_team(
+            self.teams_, home, away, counted, counted
+        )
+
+    @classmethod
+    def from_csv(cls, fname, **kwargs):
+        """Build the counter from a series data csv file."""
+
+        return cls(pd.read_csv(fname), **kwargs)
+
+    def counts_between(self, date_start, date_end):
+        """Matches counted per team for series strictly between two dates.
+
+        Parameters
+        ----------
+        date_start, date_end : date-like or array-like of dates
+            the (exclusive) window boundaries
+
+        Returns
+        -------
+        counts : np.ndarray
+            the counts, of shape (teams,) or (dates, teams)
+        """
+
+        date_start = np.asarray(pd.to_datetime(date_start), dtype="datetime64[ns]")
+        date_end = np.asarray(pd.to_datetime(date_end), dtype="datetime64[ns]")
+        i_start = np.searchsorted(self.dates_, date_start, side="right")
+        i_end = np.searchsorted(self.dates_, date_end, side="left")
+        i_end = np.maximum(i_start, i_end)
+
+        return (self.cum_matches_[:, i_end] - self.cum_matches_[:, i_start]).T
+
+    def counts_at(self, dates):
+        """Matches counted for every team in the rating window of each date.
+
+        Parameters
+        ----------
+        dates : date-like or array-like of dates
+            the date(s) at which to count
+
+        Returns
+        -------
+        counts : pd.Series or pd.DataFrame
+            the counts indexed by team (for a single date), or a frame with
+            one row per date and one column per team
+        """
+
+        date_start, _ = rating_window(dates)
+        counts = self.counts_between(date_start, pd.to_datetime(dates))
+        if counts.ndim == 1:
+            return pd.Series(counts, index=self.teams_)
+
+        return pd.DataFrame(
+            counts, index=pd.to_datetime(pd.Index(dates)), columns=self.teams_
+        )
+
+
+class PointsTable:
+    """Rolling, weighted ratings points and matches of every team.
+
+    The series points table is sorted once and cumulative per-team points
+    and matches are stored, so the weighted totals at any number of dates
+    are differences of rows found with ``searchsorted``. Series are dated
+    by (the month of) their final match; those dated in the first two years
+    of the rating window are weighted at 50%.
+
+    Parameters
+    ----------
+    points_df : pd.DataFrame
+        the series points data (see ``calc_points_per_series``), with date,
+        home_team, away_team, num_matches, home_tot_points and
+        away_tot_points columns
+    min_series_matches, series_bonus : int, optional
+        see ``counted_matches``
+    """
+
+    def __init__(self, points_df, min_series_matches=2, series_bonus=1):
+
+        dates = pd.to_datetime(points_df["date"])
+        order = np.argsort(dates.to_numpy(), kind="stable")
+        self.dates_ = dates.to_numpy()[order]
+
+        home = points_df["home_team"].to_numpy()[order]
+        away = points_df["away_team"].to_numpy()[order]
+        self.teams_ = sorted(set(home) | set(away))
+
+        counted = counted_matches(
+            points_df["num_matches"].to_numpy()[order],
+            min_series_matches,
+            series_bonus,
+        )
+        self.cum_matches_ = _cumulative_by_team(
+            self.teams_, home, away, counted, counted
+        )
+        # the points of series which count for no matches are not counted
+        # either (as in ``RatingsEngine.apply_series``)
+        home_points = points_df["home_tot_points"].to_numpy(dtype="float64")[order]
+        away_points = points_df["away_tot_points"].to_numpy(dtype="float64")[order]
+        self.cum_points_ = _cumulative_by_team(
+            self.teams_,
+            home,
+            away,
+            np.where(counted > 0, home_points, 0.0),
+            np.where(counted > 0, away_points, 0.0),
+        )
+
+    @classmethod
+    def from_csv(cls, fname, **kwargs):
+        """Build the table from a series points csv file."""
+
+        return cls(pd.read_csv(fname, index_col=0), **kwargs)
+
+    def _weighted(self, cum_values, i_start, i_mid, i_end):
+        """Weighted window sums, of shape (dates, teams)."""
+
+        half = cum_values[:, i_mid] - cum_values[:, i_start]
+        full = cum_values[:, i_end] - cum_values[:, i_mid]
+        return (0.5 * half + full).T
+
+    def totals_at(self, dates):
+        """Weighted points and matches of every team at one or more dates.
+
+        Parameters
+        ----------
+        dates : date-like or array-like of dates
+            the last date (inclusive) of the rating window of each date
+
+        Returns
+        -------
+        points, matches : np.ndarray
+            the weighted totals, of shape (dates, teams)
+        """
+
+        dates = pd.DatetimeIndex(np.atleast_1d(pd.to_datetime(dates)))
+        date_start, date_mid = rating_window(dates)
+        i_start = np.searchsorted(self.dates_, date_start.to_numpy(), side="left")
+        i_mid = np.searchsorted(self.dates_, date_mid.to_numpy(), side="left")
+        i_end = np.searchsorted(self.dates_, dates.to_numpy(), side="right")
+        i_mid = np.minimum(i_mid, i_end)
+
+        points = self._weighted(self.cum_points_, i_start, i_mid, i_end)
+        matches = self._weighted(self.cum_matches_, i_start, i_mid, i_end)
+        return points, matches
+
+    def rankings(self, dates, labels=None):
+        """The ratings and rankings of every team at one or more dates.
+
+        Parameters
+        ----------
+        dates : date-like or array-like of dates
+            the last date (inclusive) of the rating window of each date
+        labels : array-like of dates, optional
+            the dates the rankings are published under (default ``dates``)
+
+        Returns
+        -------
+        df : pd.DataFrame
+            one row per date and team with any weighted matches, with year,
+            month, team, ranking, rating, points and matches columns (the
+            columns of ``rankings_data.csv``, plus the weighted totals)
+        """
+
+        dates = pd.DatetimeIndex(np.atleast_1d(pd.to_datetime(dates)))
+        labels = dates if labels is None else pd.DatetimeIndex(labels)
+        points, matches = self.totals_at(dates)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratings = np.where(matches > 0, points / matches, np.nan)
+        rankings = (
+            pd.DataFrame(ratings).rank(axis=1, ascending=False, method="min").to_numpy()
+        )
+
+        n_teams = len(self.teams_)
+        rated = matches.ravel() > 0
+        df = pd.DataFrame(
+            {
+                "year": np.repeat(labels.year, n_teams),
+                "month": np.repeat(labels.month_name().str.upper(), n_teams),
+                "team": np.tile(np.array(self.teams_, dtype=object), len(labels)),
+                "ranking": rankings.ravel(),
+                "rating": ratings.ravel(),
+                "points": points.ravel(),
+                "matches": matches.ravel(),
+                "_order": np.repeat(np.arange(len(labels)), n_teams),
+            }
+        )[rated]
+        df["ranking"] = df["ranking"].astype("int64")
+        df = df.sort_values(["_order", "ranking", "team"], kind="stable")
+
+        return df.drop(columns="_order").reset_index(drop=True)
+
+
+def monthly_rankings(points_df, start_year, start_month, end_year, end_month, **kwargs):
+    """Compute the monthly rankings over a range of months in one pass.
+
+    The rankings published in a month count the series up to (and dated)
+    the start of the previous month.
+
+    Parameters
+    ----------
+    points_df : pd.DataFrame
+        the series points data
+    start_year, start_month, end_year, end_month : int
+        the first and last months (inclusive) of the rankings
+    **kwargs
+        passed to ``PointsTable``
+
+    Returns
+    -------
+    df : pd.DataFrame
+        the rankings, in the shape of ``rankings_data.csv`` (see
+        ``PointsTable.rankings``)
+    """
+
+    months = pd.date_range(
+        pd.Timestamp(start_year, start_month, 1),
+        pd.Timestamp(end_year, end_month, 1),
+        freq="MS",
+    )
+    table = PointsTable(points_df, **kwargs)
+
+    return table.rankings(months - pd.DateOffset(months=1), labels=months)
+
+
+class RatingsEngine:
+    """Incrementally updated ratings, driven by completed series.
+
+    The engine keeps each team's points and counted matches per rating year
+    (May to April) together with their weighted totals. Applying a series
+    only touches the two teams involved; when the clock passes the 1st of
+    May the totals are re-weighted (the oldest year drops out and the
+    previous year goes to half weight). A snapshot of the rankings is
+    recorded at the start of every month the clock passes, before any
+    re-weighting, so the snapshots agree with ``monthly_rankings`` of the
+    points the engine awards.
+
+    Parameters
+    ----------
+    date : date-like
+        the date the engine starts from (any seeded ratings are as of then)
+    min_series_matches, series_bonus : int, optional
+        see ``counted_matches``
+    """
+
+    def __init__(self, date, min_series_matches=2, series_bonus=1):
+
+        self.date_ = pd.Timestamp(date)
+        self.year_ = rating_year(self.date_)
+        self.min_series_matches_ = min_series_matches
+        self.series_bonus_ = series_bonus
+
+        # team -> {rating year: [points, matches]}
+        self.years_ = {}
+        # team -> [weighted points, weighted matches]
+        self.totals_ = {}
+        self.snapshots_ = FrameBuilder(RATINGS_SCHEMA)
+
+    @classmethod
+    def from_snapshot(cls, snapshot_df, counter, date, **kwargs):
+        """Seed an engine from a published ratings table.
+
+        The published table only gives each team's rating, so its points
+        are spread over the rating years in proportion to the matches the
+        team played in each (the rating is unchanged by this).
+
+        Parameters
+        ----------
+        snapshot_df : pd.DataFrame
+            the ratings at ``date``, with team and rating columns (e.g. as
+            returned by ``init_ratings_data``)
+        counter : MatchCounter
+            the match counter used to split the matches by rating year
+        date : date-like
+            the date of the snapshot
+        **kwargs
+            passed to the engine
+
+        Returns
+        -------
+        engine : RatingsEngine
+            the seeded engine
+        """
+
+        engine = cls(date, **kwargs)
+        year = engine.year_
+        for year_i in range(year - 3, year + 1):
+            year_start = pd.Timestamp(year_i, 5, 1) - pd.Timedelta(days=1)
+            year_end = min(pd.Timestamp(year_i + 1, 5, 1), engine.date_)
+            counts = dict(
+                zip(counter.teams_, counter.counts_between(year_start, year_end))
+            )
+            for row in snapshot_df.itertuples():
+                matches = counts.get(row.team, 0)
+                engine._add(row.team, year_i, row.rating * matches, matches)
+
+        return engine
+
+    def _weight(self, year):
+        """The weight of a rating year at the current date."""
+
+        if self.year_ - 1 <= year <= self.year_:
+            return 1.0
+        if self.year_ - 3 <= year <= self.year_ - 2:
+            return 0.5
+        return 0.0
+
+    def _add(self, team, year, points, matches):
+        """Add points and matches to a team's rating year and its totals."""
+
+        entry = self.years_.setdefault(team, {}).setdefault(year, [0.0, 0.0])
+        entry[0] += points
+        entry[1] += matches
+        totals = self.totals_.setdefault(team, [0.0, 0.0])
+        weight = self._weight(year)
+        totals[0] += weight * points
+        totals[1] += weight * matches
+
+    def rating(self, team):
+        """The current rating of a team (0 if it has no counted matches)."""
+
+        points, matches = self.totals_.get(team, (0.0, 0.0))
+        return points / matches if matches > 0 else 0.0
+
+    def apply_series(
+        self, date, home_team, away_team, num_matches, home_score, away_score
+    ):
+        """Apply a completed series.
+
+        Parameters
+        ----------
+        date : date-like
+            the date the series finished (not earlier than the engine date)
+        home_team, away_team : str
+            the teams
+        num_matches : int
+            the number of matches in the series
+        home_score, away_score : int
+            the matches won by each team
+
+        Returns
+        -------
+        home_points, away_points : float
+            the points won by each team
+        """
+
+        self.advance(date)
+        home_points, away_points = calc_points_batch(
+            num_matches,
+            home_score,
+            away_score,
+            self.rating(home_team),
+            self.rating(away_team),
+        )
+        matches = counted_matches(
+            num_matches, self.min_series_matches_, self.series_bonus_
+        )
+        if matches > 0:
+            self._add(home_team, self.year_, float(home_points), int(matches))
+            self._add(away_team, self.year_, float(away_points), int(matches))
+
+        return float(home_points), float(away_points)
+
+    def advance(self, date):
+        """Move the clock forward, taking snapshots and re-weighting.
+
+        Parameters
+        ----------
+        date : date-like
+            the new date (dates before the engine date are an error)
+        """
+
+        date = pd.Timestamp(date)
+        if date < self.date_:
+            raise ValueError(
+                "cannot move the ratings engine back from "
+                + str(self.date_.date())
+                + " to "
+                + str(date.date())
+            )
+
+        month_start = self.date_.replace(day=1) + pd.DateOffset(months=1)
+        while month_start <= date:
+            self.snapshot(month_start)
+            if month_start.month == 5:
+                self._reweight(month_start.year)
+            month_start += pd.DateOffset(months=1)
+        self.date_ = date
+
+    def _reweight(self, year):
+        """Start a new rating year, recomputing the weighted totals."""
+
+        self.year_ = year
+        for team, years in self.years_.items():
+            for year_i in [year_i for year_i in years if year_i < year - 3]:
+                del years[year_i]
+            totals = self.totals_[team] = [0.0, 0.0]
+            for year_i, (points, matches) in years.items():
+                weight = self._weight(year_i)
+                totals[0] += weight * points
+                totals[1] += weight * matches
+
+    def rankings(self):
+        """The current rankings, as (team, rating, points, matches) tuples."""
+
+        table = [
+            (team, points / matches, points, matches)
+            for team, (points, matches) in self.totals_.items()
+            if matches > 0
+        ]
+        table.sort(key=lambda entry: (-entry[1], entry[0]))
+        return table
+
+    def snapshot(self, date):
+        """Record the current rankings under a given (publication) date."""
+
+        date = pd.Timestamp(date)
+        month = date.month_name().upper()
+        ranking = 0
+        previous = None
+        for i, (team, rating, points, matches) in enumerate(self.rankings()):
+            if rating != previous:
+                ranking = i + 1
+                previous = rating
+            self.snapshots_.append(
+                year=date.year,
+                month=month,
+                team=team,
+                ranking=ranking,
+                rating=rating,
+                points=points,
+                matches=matches,
+            )
+
+    def run(self, series_df, date_end=None):
+        """Apply a table of completed series in date order.
+
+        Parameters
+        ----------
+        series_df : pd.DataFrame
+            the series, with date (the date each finished), home_team,
+            away_team, num_matches, home_score and away_score columns
+        date_end : date-like, optional
+            advance the clock to this date once all the series are applied
+
+        Returns
+        -------
+        snapshots : pd.DataFrame
+            all the monthly snapshots recorded so far (see ``snapshots``)
+        """
+
+        series_df = series_df.assign(date=pd.to_datetime(series_df["date"]))
+        series_df = series_df.sort_values("date", kind="stable")
+        for row in series_df.itertuples():
+            self.apply_series(
+                row.date,
+                row.home_team,
+                row.away_team,
+                row.num_matches,
+                row.home_score,
+                row.away_score,
+            )
+        if date_end is not None:
+            self.advance(date_end)
+
+        return self.snapshots()
+
+    def snapshots(self):
+        """The monthly snapshots, in the shape of ``PointsTable.rankings``."""
+
+        return self.snapshots_.to_frame()
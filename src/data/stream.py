@@ -0,0 +1,461 @@
+"""Streaming, bounded-memory readers over the ball-by-ball delivery files.
+
+The readers never hold more than one delivery, innings or batch of
+deliveries in memory at a time, so arbitrarily large collections of
+delivery files can be processed with a flat memory footprint. Running
+aggregators (e.g. ``InningsTotals``) can be fed from any of the readers.
+"""
+
+import csv
+import glob
+import os
+
+import numpy as np
+
+from src.data.archive import MatchArchive
+from src.data.deliveries import ball_numbers, split_ball
+
+# dismissals which do not count as the fall of a wicket
+NOT_OUT_DISMISSALS = {"retired hurt", "retired not out"}
+
+# the typed columns of a delivery batch and their dtypes
+BATCH_SCHEMA = {
+    "match_id": "int64",
+    "innings": "int8",
+    "over": "int16",
+    "ball": "int8",
+    "batting_team": object,
+    "bowling_team": object,
+    "striker": object,
+    "non_striker": object,
+    "bowler": object,
+    "runs_off_bat": "int16",
+    "extras": "int16",
+    "wides": "int16",
+    "noballs": "int16",
+    "byes": "int16",
+    "legbyes": "int16",
+    "penalty": "int16",
+    "wicket_type": object,
+    "player_dismissed": object,
+    "other_wicket_type": object,
+    "other_player_dismissed": object,
+}
+
+
+class Delivery:
+    """A single typed delivery record.
+
+    Empty extras are stored as 0 and missing wicket fields as None. The csv
+    ``ball`` value (e.g. ``12.3``) is split into ``over`` and ``ball``; the
+    previous delivery is needed to read cricsheet's ``12.1`` after ``12.9``
+    as the tenth ball (see ``ball_numbers``).
+
+    Parameters
+    ----------
+    row : list of str
+        the csv row of the delivery
+    previous : Delivery, optional
+        the delivery before it in the file
+    """
+
+    __slots__ = (
+        "match_id",
+        "season",
+        "start_date",
+        "venue",
+        "innings",
+        "over",
+        "ball",
+        "batting_team",
+        "bowling_team",
+        "striker",
+        "non_striker",
+        "bowler",
+        "runs_off_bat",
+        "extras",
+        "wides",
+        "noballs",
+        "byes",
+        "legbyes",
+        "penalty",
+        "wicket_type",
+        "player_dismissed",
+        "other_wicket_type",
+        "other_player_dismissed",
+    )
+
+    def __init__(self, row, previous=None):
+
+        (
+            match_id,
+            self.season,
+            self.start_date,
+            self.venue,
+            innings,
+            ball,
+            self.batting_team,
+            self.bowling_team,
+            self.striker,
+            self.non_striker,
+            self.bowler,
+            runs_off_bat,
+            extras,
+            wides,
+            noballs,
+            byes,
+            legbyes,
+            penalty,
+            wicket_type,
+            player_dismissed,
+            other_wicket_type,
+            other_player_dismissed,
+        ) = row
+
+        self.match_id = int(match_id)
+        self.innings = int(innings)
+        over, _, ball = ball.partition(".")
+        self.over = int(over)
+        if (
+            previous is not None
+            and previous.match_id == self.match_id
+            and previous.innings == self.innings
+        ):
+            self.ball = ball_numbers(self.over, int(ball), previous.over, previous.ball)
+        else:
+            self.ball = int(ball)
+        self.runs_off_bat = int(runs_off_bat)
+        self.extras = int(extras)
+        self.wides = int(wides) if wides else 0
+        self.noballs = int(noballs) if noballs else 0
+        self.byes = int(byes) if byes else 0
+        self.legbyes = int(legbyes) if legbyes else 0
+        self.penalty = int(penalty) if penalty else 0
+        self.wicket_type = wicket_type or None
+        self.player_dismissed = player_dismissed or None
+        self.other_wicket_type = other_wicket_type or None
+        self.other_player_dismissed = other_player_dismissed or None
+
+    def __repr__(self):
+        return (
+            "Delivery(match_id="
+            + str(self.match_id)
+            + ", innings="
+            + str(self.innings)
+            + ", ball="
+            + str(self.over)
+            + "."
+            + str(self.ball)
+            + ")"
+        )
+
+    @property
+    def wickets(self):
+        """int: the number of wickets which fell on this delivery."""
+        n_wickets = 0
+        if self.player_dismissed and self.wicket_type not in NOT_OUT_DISMISSALS:
+            n_wickets += 1
+        if (
+            self.other_player_dismissed
+            and self.other_wicket_type not in NOT_OUT_DISMISSALS
+        ):
+            n_wickets += 1
+        return n_wickets
+
+
+def delivery_files(path):
+    """List the delivery csv files of a directory (excluding _info files).
+
+    Parameters
+    ----------
+    path : str or list of str
+        a directory of cricsheet csv files, or an explicit list of files
+
+    Returns
+    -------
+    fnames : list of str
+        the sorted delivery files
+    """
+
+    if isinstance(path, (list, tuple)):
+        return list(path)
+
+    return [
+        fname
+        for fname in sorted(glob.glob(os.path.join(path, "*.csv")))
+        if not fname.endswith("_info.csv")
+    ]
+
+
+def iter_rows(path):
+    """Yield the raw csv rows (lists of str) of the delivery files one by one."""
+
+    if isinstance(path, MatchArchive):
+        yield from path.iter_rows()
+        return
+
+    for fname in delivery_files(path):
+        with open(fname, "r", newline="") as f:
+            reader = csv.reader(f)
+            next(reader)  # skip the header
+            yield from reader
+
+
+def iter_deliveries(path):
+    """Yield the deliveries of the delivery files as typed records.
+
+    Parameters
+    ----------
+    path : str, list of str or MatchArchive
+        a directory of cricsheet csv files, an explicit list of files or a
+        cricsheet zip archive
+
+    Yields
+    ------
+    delivery : Delivery
+        the next delivery
+    """
+
+    delivery = None
+    for row in iter_rows(path):
+        delivery = Delivery(row, delivery)
+        yield delivery
+
+
+def iter_innings(path):
+    """Yield the deliveries grouped into innings.
+
+    Only the deliveries of the current innings are held in memory.
+
+    Parameters
+    ----------
+    path : str, list of str or MatchArchive
+        a directory of cricsheet csv files, an explicit list of files or a
+        cricsheet zip archive
+
+    Yields
+    ------
+    match_id, innings, deliveries : int, int, list of Delivery
+        the deliveries of the next innings
+    """
+
+    key = None
+    deliveries = []
+    for delivery in iter_deliveries(path):
+        new_key = (delivery.match_id, delivery.innings)
+        if new_key != key:
+            if deliveries:
+                yield key[0], key[1], deliveries
+            key = new_key
+            deliveries = []
+        deliveries.append(delivery)
+    if deliveries:
+        yield key[0], key[1], deliveries
+
+
+def iter_batches(path, batch_size=65536):
+    """Yield the deliveries as fixed-size batches of typed column arrays.
+
+    Parameters
+    ----------
+    path : str, list of str or MatchArchive
+        a directory of cricsheet csv files, an explicit list of files or a
+        cricsheet zip archive
+    batch_size : int, optional
+        the number of deliveries per batch (the last batch may be smaller)
+
+    Yields
+    ------
+    batch : dict of np.ndarray
+        the columns of ``BATCH_SCHEMA`` for the next batch of deliveries
+    """
+
+    rows = []
+    previous = None
+    for row in iter_rows(path):
+        rows.append(row)
+        if len(rows) == batch_size:
+            yield _to_columns(rows, previous)
+            previous = rows[-1]
+            rows = []
+    if rows:
+        yield _to_columns(rows, previous)
+
+
+# the position of each batch column in the csv rows
+_CSV_POSITIONS = {
+    "match_id": 0,
+    "innings": 4,
+    "batting_team": 6,
+    "bowling_team": 7,
+    "striker": 8,
+    "non_striker": 9,
+    "bowler": 10,
+    "runs_off_bat": 11,
+    "extras": 12,
+    "wides": 13,
+    "noballs": 14,
+    "byes": 15,
+    "legbyes": 16,
+    "penalty": 17,
+    "wicket_type": 18,
+    "player_dismissed": 19,
+    "other_wicket_type": 20,
+    "other_player_dismissed": 21,
+}
+
+
+def _to_columns(rows, previous=None):
+    """Convert a list of raw csv rows to a dictionary of typed column arrays.
+
+    ``previous`` is the raw row before the first of ``rows`` (if any), so
+    the ball numbers continue across batches.
+    """
+
+    if previous is not None:
+        rows = [previous] + rows
+    fields = list(zip(*rows))
+    innings = (
+        np.array(fields[0], dtype=object) + "_" + np.array(fields[4], dtype=object)
+    )
+    overs, balls = split_ball(fields[5], innings)
+    if previous is not None:
+        fields = [values[1:] for values in fields]
+        overs = overs[1:]
+        balls = balls[1:]
+
+    batch = {}
+    for col, dtype in BATCH_SCHEMA.items():
+        if col == "over":
+            values = overs
+        elif col == "ball":
+            values = balls
+        else:
+            values = fields[_CSV_POSITIONS[col]]
+        if dtype is object:
+            # missing text fields are None, as in the Delivery records
+            values = np.array(values, dtype=object)
+            values[values == ""] = None
+        elif col not in ("over", "ball"):
+            # missing integers (e.g. extras which did not occur) are 0
+            values = np.array(
+                [int(value) if value else 0 for value in values], dtype=dtype
+            )
+        batch[col] = values
+
+    return batch
+
+
+class InningsTotals:
+    """Running per-innings totals of runs, wickets, extras and balls.
+
+    Feed it deliveries with ``update`` or column batches with
+    ``update_batch``; the totals are held per (match id, innings) only.
+    """
+
+    def __init__(self):
+
+        self.totals_ = {}
+
+    def _entry(self, match_id, innings, batting_team):
+        key = (match_id, innings)
+        entry = self.totals_.get(key)
+        if entry is None:
+            entry = self.totals_[key] = [batting_team, 0, 0, 0, 0]
+        return entry
+
+    def update(self, delivery):
+        """Add a single delivery to the totals."""
+
+        entry = self._entry(delivery.match_id, delivery.innings, delivery.batting_team)
+        entry[1] += delivery.runs_off_bat + delivery.extras
+        entry[2] += delivery.wickets
+        entry[3] += delivery.extras
+        # wides and no balls are not legal deliveries
+        if delivery.wides == 0 and delivery.noballs == 0:
+            entry[4] += 1
+
+    def update_batch(self, batch):
+        """Add a batch of deliveries (see ``iter_batches``) to the totals."""
+
+        runs = batch["runs_off_bat"] + batch["extras"]
+        wickets = _wicket_mask(batch["wicket_type"], batch["player_dismissed"]).astype(
+            int
+        ) + _wicket_mask(
+            batch["other_wicket_type"], batch["other_player_dismissed"]
+        ).astype(
+            int
+        )
+        legal = ((batch["wides"] == 0) & (batch["noballs"] == 0)).astype(int)
+
+        # group the batch by innings, in order of appearance
+        keys = batch["match_id"] * 10 + batch["innings"]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        for col, values in (
+            (1, runs),
+            (2, wickets),
+            (3, batch["extras"]),
+            (4, legal),
+        ):
+            sums = np.add.reduceat(values, starts) if len(starts) else []
+            for start, total in zip(starts, sums):
+                entry = self._entry(
+                    int(batch["match_id"][start]),
+                    int(batch["innings"][start]),
+                    batch["batting_team"][start],
+                )
+                entry[col] += int(total)
+
+    def to_dict(self):
+        """The totals as a dictionary keyed by (match id, innings)."""
+
+        return {
+            key: {
+                "batting_team": entry[0],
+                "runs": entry[1],
+                "wickets": entry[2],
+                "extras": entry[3],
+                "balls": entry[4],
+            }
+            for key, entry in self.totals_.items()
+        }
+
+
+def _wicket_mask(wicket_type, player_dismissed):
+    """Boolean mask of the deliveries on which a wicket fell."""
+
+    return np.array(
+        [
+            player is not None and wicket not in NOT_OUT_DISMISSALS
+            for wicket, player in zip(wicket_type, player_dismissed)
+        ],
+        dtype=bool,
+    )
+
+
+def run_aggregators(stream, *aggregators):
+    """Feed every item of a stream to one or more running aggregators.
+
+    Parameters
+    ----------
+    stream : iterable
+        deliveries (from ``iter_deliveries``) or column batches (from
+        ``iter_batches``)
+    *aggregators
+        objects with ``update`` (for deliveries) or ``update_batch`` (for
+        batches) methods
+
+    Returns
+    -------
+    aggregators : tuple
+        the same aggregators, for convenience
+    """
+
+    for item in stream:
+        for aggregator in aggregators:
+            if isinstance(item, dict):
+                aggregator.update_batch(item)
+            else:
+                aggregator.update(item)
+
+    return aggregators
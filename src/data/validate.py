@@ -0,0 +1,527 @@
+"""Validation of the raw cricsheet delivery and info files.
+
+The delivery files are read in batches: the files of a batch are joined
+into one csv text and parsed in a single ``pd.read_csv`` call, and every
+check is then a vectorized operation over the columns of the whole batch
+(rows are traced back to their file by position). The checks are
+
+* header: the file's columns are not the cricsheet csv2 columns
+* parse: the file is not valid csv (e.g. a quote is never closed)
+* missing: a value which every delivery has is missing
+* dtype: an integer column is not an integer, or a ball is not
+  ``<over>.<ball>``
+* match_id: the match id is not the one in the file name
+* innings: the innings do not start at 1 and increase one at a time
+* ball_order: the balls do not increase within an innings (reading
+  cricsheet's ``x.1`` after ``x.9`` as the tenth ball of the over)
+* extras: the extras are not the sum of the wides, no-balls, byes,
+  leg-byes and penalty runs
+* teams: a batting or bowling team is not one of the ``info,team`` lines
+  (or a team bowls to itself)
+* info: the info file is missing or can't be parsed, or lacks the dates,
+  venue or two teams needed by the dataset
+
+Every failed check of a file is a row of the quarantine report, with the
+number of offending rows, the first of them (counting the data rows of
+the file from 1) and its value.
+
+The info check alone (``validate_info_files``) only reads the info files,
+so the stages which do not read the deliveries are gated on its much
+cheaper report (``INFO_QUARANTINE_FILE``) instead.
+
+Usage: python -m src.data.validate match_datapath report_file [--workers N]
+    [--info-only]
+"""
+
+import argparse
+import glob
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.data.deliveries import CSV_COLUMNS, ball_numbers
+from src.data.instrument import instrumented, record
+from src.data.match_info import match_id_from_filename, read_match_info
+
+QUARANTINE_FILE = "quarantine.csv"
+INFO_QUARANTINE_FILE = "info_quarantine.csv"
+
+REPORT_COLUMNS = ["file", "match_id", "check", "rows", "first_row", "value"]
+
+# the number of delivery files parsed together
+BATCH_SIZE = 50
+
+# the columns which have a value on every delivery
+REQUIRED_COLUMNS = [
+    "match_id",
+    "innings",
+    "ball",
+    "batting_team",
+    "bowling_team",
+    "striker",
+    "non_striker",
+    "bowler",
+    "runs_off_bat",
+    "extras",
+]
+
+# the components of the extras column
+EXTRAS_COLUMNS = ["wides", "noballs", "byes", "legbyes", "penalty"]
+
+INTEGER_COLUMNS = ["match_id", "innings", "runs_off_bat", "extras"] + EXTRAS_COLUMNS
+
+HEADER = ",".join(CSV_COLUMNS)
+
+
+# the dtypes the C parser reads the checked columns as: numbers as floats
+# (so missing values are NaN) and text as categoricals, which are cheap to
+# compare since each distinct value is only handled once
+READ_DTYPES = {
+    **{col: "float64" for col in INTEGER_COLUMNS},
+    **{col: "category" for col in REQUIRED_COLUMNS if col not in INTEGER_COLUMNS},
+}
+
+
+def _read_text(text, dtypes):
+    """Parse delivery rows (without their header) into the checked columns."""
+
+    return pd.read_csv(
+        io.StringIO(HEADER + "\n" + text),
+        usecols=list(READ_DTYPES),
+        dtype=dtypes,
+        skip_blank_lines=False,
+    )
+
+
+def _parses(text):
+    """Whether the delivery rows of a file can be parsed."""
+
+    try:
+        _read_text(text, str)
+    except pd.errors.ParserError:
+        return False
+    return True
+
+
+def _read_files(fnames):
+    """The text of the delivery files (without the header line).
+
+    Returns
+    -------
+    texts : list of str
+        the rows of each file with the cricsheet header, ending in a newline
+    positions : list of int
+        the position in ``fnames`` of each of these files
+    bad_files : dict
+        "header" for the position of each file with another header
+    """
+
+    texts = []
+    positions = []
+    bad_files = {}
+    for i, fname in enumerate(fnames):
+        with open(fname, "r") as f:
+            header = f.readline().strip()
+            text = f.read()
+        if header != HEADER:
+            bad_files[i] = "header"
+            continue
+        if text and not text.endswith("\n"):
+            text += "\n"
+        texts.append(text)
+        positions.append(i)
+
+    return texts, positions, bad_files
+
+
+def _read_batch(fnames):
+    """Read a batch of delivery files as a single frame.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        the checked columns of the files which could be read, in order
+    not_numeric : dict of pd.Series
+        the text of each integer column where it is not a number (only
+        looked for if the batch fails to parse as numbers)
+    file_index : np.ndarray
+        the position in ``fnames`` of the file of each row
+    bad_files : dict
+        the failed check ("header" or "parse") of each file (by position)
+        which could not be read with the others
+    """
+
+    texts, positions, bad_files = _read_files(fnames)
+
+    not_numeric = {}
+    try:
+        df = _read_text("".join(texts), READ_DTYPES)
+    except pd.errors.ParserError:
+        # leave out the files which are not valid csv
+        parsed = [_parses(text) for text in texts]
+        for i, ok in zip(positions, parsed):
+            if not ok:
+                bad_files[i] = "parse"
+        texts = [text for text, ok in zip(texts, parsed) if ok]
+        positions = [i for i, ok in zip(positions, parsed) if ok]
+        df = None
+    except ValueError:
+        df = None
+    if df is None:
+        # a number column may have text in it: read them as text to find where
+        df = _read_text(
+            "".join(texts), {**READ_DTYPES, **dict.fromkeys(INTEGER_COLUMNS, str)}
+        )
+        for col in INTEGER_COLUMNS:
+            values = pd.to_numeric(df[col], errors="coerce")
+            not_numeric[col] = df[col].where(values.isna())
+            df[col] = values
+
+    n_rows = np.array([text.count("\n") for text in texts], dtype="int64")
+    if n_rows.sum() != len(df):
+        # a quoted field spans lines, so count the rows of each file properly
+        n_rows = np.array([len(_read_text(text, str)) for text in texts])
+    file_index = np.repeat(np.array(positions, dtype="int64"), n_rows)
+
+    return df, not_numeric, file_index, bad_files
+
+
+def _flags(check, mask, file_index, row, values):
+    """Summarise the rows failing a check by file.
+
+    ``values`` are the values of the rows shown in the report: a column of
+    the batch, or one value per row.
+    """
+
+    rows = np.flatnonzero(mask)
+    if len(rows) == 0:
+        return None
+    if isinstance(values, pd.Series):
+        values = values.iloc[rows].astype(object).to_numpy()
+    else:
+        values = np.asarray(values, dtype=object)[rows]
+    flagged = pd.DataFrame(
+        {"file_index": file_index[rows], "first_row": row[rows] + 1, "value": values}
+    )
+    flags = flagged.groupby("file_index", sort=False).agg(
+        rows=("first_row", "size"),
+        first_row=("first_row", "first"),
+        value=("value", "first"),
+    )
+    flags["check"] = check
+    return flags.reset_index()
+
+
+def _codes(values, categories):
+    """The codes of a categorical column against other categories (-1 if absent)."""
+
+    codes = categories.get_indexer(values.cat.categories)
+    return np.r_[codes, -1][values.cat.codes.to_numpy()]
+
+
+def _split_balls(balls):
+    """The over and ball numbers of a categorical ball column (NaN if invalid).
+
+    The balls only have a few distinct values, so only those are split.
+    """
+
+    values = balls.cat.categories.to_series(index=None).astype(str)
+    parts = values.str.split(".", n=1, expand=True).reindex(columns=[0, 1])
+    codes = balls.cat.codes.to_numpy()
+    over, ball = (
+        np.r_[pd.to_numeric(parts[col], errors="coerce").to_numpy(), -1][codes]
+        for col in [0, 1]
+    )
+    return over, ball
+
+
+def _ball_keys(over, ball, same_innings):
+    """Keys (over * 1000 + ball) which increase with the balls of an innings.
+
+    The ball numbers are read as in ``ball_numbers``, so cricsheet's
+    ``179.1`` after ``179.9`` is the tenth ball of the over.
+    """
+
+    previous_over = np.where(same_innings, np.r_[-1, over[:-1]], -1)
+    previous_ball = np.r_[-1, ball[:-1]]
+    return over * 1000 + ball_numbers(over, ball, previous_over, previous_ball)
+
+
+def validate_deliveries(df, file_index, teams, match_ids, not_numeric=None):
+    """Run the delivery checks over a batch of delivery rows.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        the delivery rows of the batch in file order, read with
+        ``READ_DTYPES``
+    file_index : np.ndarray
+        the file (position in the batch) of each row
+    teams : list of list of str
+        the ``info,team`` lines of each file of the batch
+    match_ids : list of int
+        the match id of each file of the batch
+    not_numeric : dict of pd.Series, optional
+        the text of each integer column where it is not a number
+
+    Returns
+    -------
+    flags : pd.DataFrame
+        file_index, check, rows, first_row and value of each failed check
+    """
+
+    n = len(df)
+    flags = []
+    if n == 0:
+        return pd.DataFrame(columns=["file_index", "check", "rows", "first_row"])
+
+    # the row number within its file
+    file_start = np.r_[True, file_index[1:] != file_index[:-1]]
+    starts = np.flatnonzero(file_start)
+    row = np.arange(n) - np.repeat(starts, np.diff(np.r_[starts, n]))
+
+    def flag(check, mask, values):
+        flags.append(_flags(check, mask, file_index, row, values))
+
+    # text which is not a number is reported by the dtype check, not here
+    not_numeric = not_numeric or {}
+    missing = df[REQUIRED_COLUMNS].isna().to_numpy()
+    for i, col in enumerate(REQUIRED_COLUMNS):
+        if col in not_numeric:
+            missing[:, i] &= not_numeric[col].isna().to_numpy()
+    flag(
+        "missing",
+        missing.any(axis=1),
+        np.array(REQUIRED_COLUMNS)[missing.argmax(axis=1)],
+    )
+
+    # the integer columns, with missing values (checked above) as 0
+    ints = {}
+    for col in INTEGER_COLUMNS:
+        values = df[col].to_numpy()
+        bad = (values % 1 != 0) & ~np.isnan(values)
+        shown = df[col]
+        if col in not_numeric:
+            bad |= not_numeric[col].notna().to_numpy()
+            shown = not_numeric[col].fillna(shown)
+        flag("dtype", bad, shown)
+        ints[col] = np.nan_to_num(values).astype("int64")
+
+    over, ball = _split_balls(df["ball"])
+    flag("dtype", np.isnan(over) | np.isnan(ball), df["ball"])
+
+    expected_id = np.asarray(match_ids, dtype="int64")[file_index]
+    flag("match_id", ints["match_id"] != expected_id, df["match_id"])
+
+    # the innings start at 1, then stay the same or go up by one
+    innings = ints["innings"]
+    previous = np.r_[0, innings[:-1]]
+    previous[file_start] = 0
+    step = innings - previous
+    flag("innings", (step != 0) & (step != 1), df["innings"])
+
+    # the (over, ball) key increases within an innings
+    same_innings = ~file_start & (step == 0)
+    key = _ball_keys(over, ball, same_innings)
+    flag("ball_order", same_innings & (key <= np.r_[np.inf, key[:-1]]), df["ball"])
+
+    components = sum(ints[col] for col in EXTRAS_COLUMNS)
+    flag("extras", ints["extras"] != components, df["extras"])
+
+    # the teams of each row are the teams of its info file: compare the team
+    # codes (against all the teams of the batch) with those of the file
+    all_teams = pd.Index(sorted({team for file_teams in teams for team in file_teams}))
+    file_teams = np.full((len(teams), 2), -2, dtype="int64")
+    for i, names in enumerate(teams):
+        codes = all_teams.get_indexer(names[:2])
+        file_teams[i, : len(codes)] = codes
+    row_teams = file_teams[file_index]
+    # files without info teams are reported by the info check
+    checked = (row_teams >= 0).any(axis=1)
+    codes = {}
+    for col in ["batting_team", "bowling_team"]:
+        codes[col] = _codes(df[col], all_teams)
+        known = (codes[col][:, None] == row_teams).any(axis=1)
+        flag("teams", checked & ~known & df[col].notna().to_numpy(), df[col])
+    same_team = (codes["batting_team"] == codes["bowling_team"]) & (
+        codes["batting_team"] >= 0
+    )
+    flag("teams", same_team, df["batting_team"])
+
+    flags = [f for f in flags if f is not None]
+    if not flags:
+        return pd.DataFrame(columns=["file_index", "check", "rows", "first_row"])
+    return pd.concat(flags, ignore_index=True)
+
+
+def validate_info(fname):
+    """Check an info file has what the dataset needs from it.
+
+    Returns
+    -------
+    info : MatchInfo or None
+        the match information (None if the file can't be read)
+    problem : str or None
+        what is wrong with the file, if anything
+    """
+
+    if not os.path.exists(fname):
+        return None, "missing info file"
+    try:
+        info = read_match_info(fname)
+    except ValueError as err:
+        return None, str(err)
+    if not info.dates:
+        return info, "no dates"
+    if info.venue is None:
+        return info, "no venue"
+    if len(info.teams) != 2:
+        return info, "%d teams" % len(info.teams)
+    return info, None
+
+
+def validate_batch(fnames):
+    """Validate a batch of delivery files and their info files.
+
+    Parameters
+    ----------
+    fnames : list of str
+        the delivery files, e.g. ``data/raw/match_data/64012.csv``
+
+    Returns
+    -------
+    report : pd.DataFrame
+        the quarantine report of the batch (see ``REPORT_COLUMNS``)
+    """
+
+    match_ids = [match_id_from_filename(fname) for fname in fnames]
+    teams = []
+    rows = []
+    for fname, match_id in zip(fnames, match_ids):
+        info, problem = validate_info(fname[: -len(".csv")] + "_info.csv")
+        teams.append(info.teams if info is not None else [])
+        if problem is not None:
+            rows.append((fname, match_id, "info", 1, None, problem))
+
+    df, not_numeric, file_index, bad_files = _read_batch(fnames)
+    for i, check in bad_files.items():
+        rows.append((fnames[i], match_ids[i], check, 1, None, None))
+    report = pd.DataFrame(rows, columns=REPORT_COLUMNS)
+
+    flags = validate_deliveries(df, file_index, teams, match_ids, not_numeric)
+    if len(flags) > 0:
+        flags["file"] = np.asarray(fnames, dtype=object)[flags["file_index"]]
+        flags["match_id"] = np.asarray(match_ids)[flags["file_index"]]
+        report = pd.concat([report, flags[REPORT_COLUMNS]], ignore_index=True)
+    record(files=len(fnames), rows=len(df))
+
+    return report
+
+
+@instrumented()
+def validate_match_data(match_datapath, n_workers=1, batch_size=BATCH_SIZE):
+    """Validate every delivery file (and its info file) of a directory.
+
+    Parameters
+    ----------
+    match_datapath : str
+        the directory containing the cricsheet match csv files
+    n_workers : int, optional
+        the number of worker processes, each validating a batch at a time
+    batch_size : int, optional
+        the number of delivery files parsed together
+
+    Returns
+    -------
+    report : pd.DataFrame
+        one row per failed check of each file, sorted by file
+    """
+
+    fnames = [
+        fname
+        for fname in sorted(glob.glob(os.path.join(match_datapath, "*.csv")))
+        if not fname.endswith("_info.csv")
+    ]
+    batches = [fnames[i : i + batch_size] for i in range(0, len(fnames), batch_size)]
+
+    if n_workers > 1 and len(batches) > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            reports = list(executor.map(validate_batch, batches))
+    else:
+        reports = [validate_batch(batch) for batch in batches]
+
+    report = pd.concat(
+        [pd.DataFrame(columns=REPORT_COLUMNS)] + reports, ignore_index=True
+    )
+    report.sort_values(["file", "check"], inplace=True, ignore_index=True)
+    return report
+
+
+@instrumented()
+def validate_info_files(match_datapath):
+    """Run the info check over every info file of a directory.
+
+    Parameters
+    ----------
+    match_datapath : str
+        the directory containing the cricsheet match csv files
+
+    Returns
+    -------
+    report : pd.DataFrame
+        one row per info file which fails the check, sorted by file
+    """
+
+    fnames = sorted(glob.glob(os.path.join(match_datapath, "*_info.csv")))
+    rows = []
+    for fname in fnames:
+        _, problem = validate_info(fname)
+        if problem is not None:
+            match_id = match_id_from_filename(fname)
+            rows.append((fname, match_id, "info", 1, None, problem))
+    record(files=len(fnames))
+
+    return pd.DataFrame(rows, columns=REPORT_COLUMNS)
+
+
+def quarantined_files(report):
+    """The files with at least one failed check in a quarantine report."""
+
+    return sorted(set(report["file"]))
+
+
+def quarantined_matches(report_file):
+    """The ids of the matches with a failed check in a quarantine report file."""
+
+    return set(pd.read_csv(report_file)["match_id"].astype(int))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Validate the raw delivery and info files."
+    )
+    parser.add_argument("match_datapath", help="the raw match data path")
+    parser.add_argument("report_file", help="the quarantine report to write")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--info-only",
+        action="store_true",
+        help="only check the info files (without reading the deliveries)",
+    )
+    args = parser.parse_args()
+
+    if args.info_only:
+        report = validate_info_files(args.match_datapath)
+    else:
+        report = validate_match_data(args.match_datapath, n_workers=args.workers)
+    report.to_csv(args.report_file, index=False)
+    files = quarantined_files(report)
+    print(len(files), "files quarantined")
+    for check, count in report.groupby("check")["file"].nunique().items():
+        print("   ", check, "(" + str(count) + " files)")
@@ -0,0 +1,109 @@
+"""Registry mapping cricket venues to the country which hosts them."""
+
+import csv
+
+
+class UnresolvedVenueError(ValueError):
+    """Raised when a venue cannot be found in the venue registry.
+
+    Parameters
+    ----------
+    venue : str
+        the (normalised) venue name which could not be resolved
+    filename : str, optional
+        the file in which the venue was found
+    """
+
+    def __init__(self, venue, filename=None):
+
+        self.venue = venue
+        self.filename = filename
+        msg = "venue '" + venue + "' not found in venue registry"
+        if filename is not None:
+            msg += " (" + str(filename) + ")"
+        super().__init__(msg)
+
+    def __reduce__(self):
+        # keep the structured fields when passed between processes
+        return (self.__class__, (self.venue, self.filename))
+
+
+def normalise_venue(venue):
+    """Normalise a venue name so it can be used as a lookup key.
+
+    Speech marks are removed and repeated or trailing whitespace is collapsed.
+
+    Parameters
+    ----------
+    venue : str
+        the raw venue name
+
+    Returns
+    -------
+    venue : str
+        the normalised venue name
+    """
+
+    return " ".join(venue.replace('"', "").split())
+
+
+class VenueRegistry:
+    """In-memory index of venue to country, loaded once from the venue file.
+
+    Parameters
+    ----------
+    venue_file : str
+        the filename (and location) of the venue - country csv file
+    """
+
+    def __init__(self, venue_file):
+
+        self.venue_file_ = venue_file
+        self.countries_ = {}
+        self.duplicates_ = []
+
+        # the venue names may contain commas so use the csv module for quoting
+        with open(venue_file, "r", newline="") as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                venue = normalise_venue(row["venue"])
+                country = row["country"].strip()
+                # keep the first entry but record any conflicting duplicates
+                if venue in self.countries_:
+                    if self.countries_[venue] != country:
+                        self.duplicates_.append((venue, country))
+                    continue
+                self.countries_[venue] = country
+
+    def __len__(self):
+        return len(self.countries_)
+
+    def __contains__(self, venue):
+        return normalise_venue(venue) in self.countries_
+
+    def country(self, venue, filename=None):
+        """Look up the country of a given venue.
+
+        Parameters
+        ----------
+        venue : str
+            the venue name (quoting and whitespace need not be normalised)
+        filename : str, optional
+            the file the venue was read from, used for error reporting
+
+        Returns
+        -------
+        country : str
+            the country in which the venue is located
+
+        Raises
+        ------
+        UnresolvedVenueError
+            if the venue is not in the registry
+        """
+
+        key = normalise_venue(venue)
+        try:
+            return self.countries_[key]
+        except KeyError:
+            raise UnresolvedVenueError(key, filename) from None
@@ -0,0 +1,318 @@
+"""Partnership, fall of wicket and over-by-over tables of every innings.
+
+The tables are derived from the columnar delivery store (see
+``src.data.deliveries``) without looping over the balls: the deliveries
+are split into segments (innings, overs or partnerships) at the boundaries
+found by comparing neighbouring rows, and each table is then a segmented
+cumulative sum or a ``np.bincount`` over the segment ids. Each season is a
+separate partition of the store, so the seasons can be processed in
+parallel.
+
+* partnerships: the runs, balls and batters of each partnership, in order
+  within the innings, and whether it was ended by a dismissal
+* fall_of_wickets: the score, over and batter out at each dismissal
+* over_progression: the legal balls, runs and wickets in each over and
+  the cumulative score at its end
+
+Usage: python -m src.features.innings_tables store_path output_path [--workers N]
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.data.deliveries import load_deliveries, load_dictionaries
+from src.data.stream import NOT_OUT_DISMISSALS
+
+# the columns of the delivery store used by the tables
+DELIVERY_COLUMNS = [
+    "match_id",
+    "innings",
+    "over",
+    "ball",
+    "batting_team",
+    "striker",
+    "non_striker",
+    "runs_off_bat",
+    "extras",
+    "wides",
+    "noballs",
+    "wicket_type",
+    "player_dismissed",
+    "other_wicket_type",
+    "other_player_dismissed",
+]
+
+TABLES = ["partnerships", "fall_of_wickets", "over_progression"]
+
+
+def _starts(*keys):
+    """Boolean mask of the rows at which any of the key columns changes."""
+
+    starts = np.zeros(len(keys[0]), dtype=bool)
+    if len(starts) > 0:
+        starts[0] = True
+    for key in keys:
+        starts[1:] |= key[1:] != key[:-1]
+    return starts
+
+
+def _segment_cumsum(values, segment_id, first_rows):
+    """Cumulative sum of values restarting at the first row of each segment."""
+
+    total = np.cumsum(values, dtype="int64")
+    before = total[first_rows] - values[first_rows]
+    return total - before[segment_id]
+
+
+def innings_tables(df, dictionaries):
+    """Build the partnership, fall of wicket and per-over tables.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        the deliveries, with the ``DELIVERY_COLUMNS`` as integer codes, in
+        the order they were bowled within each innings
+    dictionaries : dict
+        the dictionaries of the delivery store
+
+    Returns
+    -------
+    tables : dict of pd.DataFrame
+        the ``partnerships``, ``fall_of_wickets`` and ``over_progression``
+        tables
+    """
+
+    # group the innings together, keeping the order of the balls within them
+    order = np.lexsort((df["innings"].to_numpy(), df["match_id"].to_numpy()))
+    cols = {col: df[col].to_numpy()[order] for col in DELIVERY_COLUMNS}
+    cols["runs"] = cols["runs_off_bat"].astype("int64") + cols["extras"]
+
+    # a batter leaves on any dismissal (retirements included), but only real
+    # dismissals are wickets
+    not_out_codes = [
+        code
+        for code, wicket_type in enumerate(dictionaries["wicket_types"])
+        if wicket_type in NOT_OUT_DISMISSALS
+    ]
+    for prefix in ["", "other_"]:
+        wicket_type = cols[prefix + "wicket_type"]
+        cols[prefix + "wicket"] = (wicket_type >= 0) & ~np.isin(
+            wicket_type, not_out_codes
+        )
+    cols["wickets"] = cols["wicket"].astype("int64") + cols["other_wicket"]
+    cols["leaves"] = (cols["player_dismissed"] >= 0).astype("int64") + (
+        cols["other_player_dismissed"] >= 0
+    )
+
+    # the score and wickets down after every ball of each innings
+    innings_start = _starts(cols["match_id"], cols["innings"])
+    innings_id = np.cumsum(innings_start) - 1
+    innings_first = np.flatnonzero(innings_start)
+    cols["score"] = _segment_cumsum(cols["runs"], innings_id, innings_first)
+    cols["fallen"] = _segment_cumsum(cols["wickets"], innings_id, innings_first)
+
+    tables = {
+        "partnerships": _partnerships(cols, innings_start, innings_id),
+        "fall_of_wickets": _fall_of_wickets(cols),
+        "over_progression": _over_progression(cols),
+    }
+
+    names = {
+        "batting_team": dictionaries["teams"],
+        "batter_1": dictionaries["players"],
+        "batter_2": dictionaries["players"],
+        "player_out": dictionaries["players"],
+        "wicket_type": dictionaries["wicket_types"],
+    }
+    for table in tables.values():
+        for col in table.columns:
+            if col in names:
+                # code -1 (missing) picks up the None appended to the names
+                values = np.asarray(names[col] + [None], dtype=object)
+                table[col] = values[table[col].to_numpy()]
+
+    return tables
+
+
+def _partnerships(cols, innings_start, innings_id):
+    """One row per partnership: a segment of an innings between departures."""
+
+    # a partnership starts with the innings, or after a batter leaves
+    starts = innings_start.copy()
+    starts[1:] |= cols["leaves"][:-1] > 0
+    segment_id = np.cumsum(starts) - 1
+    first = np.flatnonzero(starts)
+    last = np.r_[first[1:], len(starts)] - 1
+    n_segments = len(first)
+
+    # number the partnerships from 1 within each innings
+    innings_first_segment = segment_id[np.flatnonzero(innings_start)]
+    number = np.arange(n_segments) - innings_first_segment[innings_id[first]] + 1
+
+    # the batters are the pair at the crease on the first ball
+    batter_1 = cols["striker"][first]
+    batter_2 = cols["non_striker"][first]
+    runs_off_bat = cols["runs_off_bat"].astype("int64")
+    # the balls faced by the batters (no-balls are faced, wides are not)
+    faced = (cols["wides"] == 0).astype("int64")
+
+    def segment_sum(values):
+        return np.bincount(segment_id, values, n_segments).astype("int64")
+
+    return pd.DataFrame(
+        {
+            "match_id": cols["match_id"][first],
+            "innings": cols["innings"][first],
+            "partnership": number,
+            "wicket": cols["fallen"][first] - cols["wickets"][first] + 1,
+            "batting_team": cols["batting_team"][first],
+            "batter_1": batter_1,
+            "batter_2": batter_2,
+            "runs": segment_sum(cols["runs"]),
+            "balls": segment_sum(faced),
+            "batter_1_runs": segment_sum(
+                runs_off_bat * (cols["striker"] == batter_1[segment_id])
+            ),
+            "batter_2_runs": segment_sum(
+                runs_off_bat * (cols["striker"] == batter_2[segment_id])
+            ),
+            "ended": cols["leaves"][last] > 0,
+        }
+    )
+
+
+def _fall_of_wickets(cols):
+    """One row per wicket, with the score and over when it fell."""
+
+    # the wickets down before each ball; the wicket numbers of the first and
+    # (rarely) second dismissal of a ball follow on from it
+    before = cols["fallen"] - cols["wickets"]
+    frames = []
+    for prefix, number in [
+        ("", before + 1),
+        ("other_", before + cols["wicket"] + 1),
+    ]:
+        rows = np.flatnonzero(cols[prefix + "wicket"])
+        frames.append(
+            pd.DataFrame(
+                {
+                    "match_id": cols["match_id"][rows],
+                    "innings": cols["innings"][rows],
+                    "wicket": number[rows],
+                    "batting_team": cols["batting_team"][rows],
+                    "score": cols["score"][rows],
+                    "over": cols["over"][rows],
+                    "ball": cols["ball"][rows],
+                    "player_out": cols[prefix + "player_dismissed"][rows],
+                    "wicket_type": cols[prefix + "wicket_type"][rows],
+                }
+            )
+        )
+
+    fow = pd.concat(frames, ignore_index=True)
+    fow.sort_values(["match_id", "innings", "wicket"], inplace=True, ignore_index=True)
+    return fow
+
+
+def _over_progression(cols):
+    """One row per over, with the cumulative score and wickets at its end."""
+
+    starts = _starts(cols["match_id"], cols["innings"], cols["over"])
+    over_id = np.cumsum(starts) - 1
+    first = np.flatnonzero(starts)
+    last = np.r_[first[1:], len(starts)] - 1
+    n_overs = len(first)
+
+    def over_sum(values):
+        return np.bincount(over_id, values, n_overs).astype("int64")
+
+    # wides and no-balls are not legal deliveries of the over
+    legal = (cols["wides"] == 0) & (cols["noballs"] == 0)
+
+    return pd.DataFrame(
+        {
+            "match_id": cols["match_id"][first],
+            "innings": cols["innings"][first],
+            "over": cols["over"][first],
+            "batting_team": cols["batting_team"][first],
+            "balls": over_sum(legal),
+            "runs": over_sum(cols["runs"]),
+            "wickets": over_sum(cols["wickets"]),
+            "score": cols["score"][last],
+            "wickets_down": cols["fallen"][last],
+        }
+    )
+
+
+def _season_tables(store_path, season, dictionaries):
+    """Build the tables of a single season (a partition of the store)."""
+
+    df = load_deliveries(
+        store_path, columns=DELIVERY_COLUMNS, seasons=[season], decode=False
+    )
+    return innings_tables(df, dictionaries)
+
+
+def build_innings_tables(store_path, seasons=None, n_workers=1):
+    """Build the tables for (some of) the seasons of a delivery store.
+
+    Parameters
+    ----------
+    store_path : str
+        the directory of the delivery store
+    seasons : list of str, optional
+        only use these seasons (default all)
+    n_workers : int, optional
+        the number of worker processes, each building the tables of one
+        season at a time
+
+    Returns
+    -------
+    tables : dict of pd.DataFrame
+        the ``partnerships``, ``fall_of_wickets`` and ``over_progression``
+        tables, sorted by match and innings
+    """
+
+    dictionaries = load_dictionaries(store_path)
+    if seasons is None:
+        seasons = dictionaries["seasons"]
+
+    n = len(seasons)
+    args = ([store_path] * n, seasons, [dictionaries] * n)
+    if n_workers > 1 and n > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(_season_tables, *args))
+    else:
+        results = list(map(_season_tables, *args))
+
+    tables = {}
+    for name in TABLES:
+        table = pd.concat([result[name] for result in results], ignore_index=True)
+        sort_keys = list(table.columns[:3])
+        table.sort_values(sort_keys, inplace=True, ignore_index=True)
+        tables[name] = table
+
+    return tables
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Build the partnership, fall of wicket and per-over tables."
+    )
+    parser.add_argument("store_path", help="the delivery store path")
+    parser.add_argument("output_path", help="the path to write the tables to")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="number of seasons built in parallel"
+    )
+    args = parser.parse_args()
+
+    tables = build_innings_tables(args.store_path, n_workers=args.workers)
+    os.makedirs(args.output_path, exist_ok=True)
+    for name, table in tables.items():
+        table.to_csv(os.path.join(args.output_path, name + ".csv"), index=False)
+        print("wrote", len(table), "rows to", name + ".csv")
@@ -0,0 +1,453 @@
+"""Batting and bowling statistics of every player from the delivery data.
+
+The statistics are computed from the columnar delivery store (see
+``src.data.deliveries``) with grouped, vectorized operations on the integer
+player codes. They are first aggregated per innings, which is the table
+that is cached; the per-match and career tables are sums over it:
+
+* batting: runs, balls faced (wides excluded), innings, dismissals, not
+  outs, 50s, 100s, high score, average and strike rate
+* bowling: legal balls, runs conceded (byes, leg byes and penalties
+  excluded), wickets credited to the bowler (in total and by dismissal
+  type), economy, average and strike rate
+
+Usage: python -m src.features.player_stats store_path output_path
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.data.deliveries import load_deliveries, load_dictionaries
+from src.data.stream import NOT_OUT_DISMISSALS
+
+# the dismissals credited to the bowler (run outs, for example, are not)
+BOWLER_DISMISSALS = [
+    "bowled",
+    "caught",
+    "caught and bowled",
+    "lbw",
+    "stumped",
+    "hit wicket",
+]
+
+# the columns of the delivery store used by the statistics
+DELIVERY_COLUMNS = [
+    "match_id",
+    "innings",
+    "batting_team",
+    "bowling_team",
+    "striker",
+    "non_striker",
+    "bowler",
+    "runs_off_bat",
+    "wides",
+    "noballs",
+    "wicket_type",
+    "player_dismissed",
+    "other_wicket_type",
+    "other_player_dismissed",
+]
+
+INNINGS_KEYS = ["match_id", "innings", "player"]
+
+# the cached per-innings tables
+BATTING_FILE = "batting_innings.csv"
+BOWLING_FILE = "bowling_innings.csv"
+
+
+def _wicket_column(wicket_type):
+    """The column name of the wickets of a dismissal type."""
+
+    return "wickets_" + wicket_type.replace(" ", "_")
+
+
+# the columns of the per-innings tables
+BATTING_COLUMNS = INNINGS_KEYS + ["team", "runs", "balls", "out"]
+BOWLING_COLUMNS = (
+    INNINGS_KEYS
+    + ["team", "balls", "runs", "wickets"]
+    + [_wicket_column(dismissal) for dismissal in BOWLER_DISMISSALS]
+)
+
+
+def batting_innings(df, dictionaries):
+    """Aggregate the deliveries into one row per batter per innings.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        the deliveries, with the ``DELIVERY_COLUMNS`` as integer codes
+    dictionaries : dict
+        the dictionaries of the delivery store
+
+    Returns
+    -------
+    innings : pd.DataFrame
+        match_id, innings, player, team, runs, balls and out for every batter
+        who batted (including those who never faced a ball)
+    """
+
+    players = np.asarray(dictionaries["players"], dtype=object)
+    teams = np.asarray(dictionaries["teams"], dtype=object)
+    not_out_codes = [
+        code
+        for code, wicket_type in enumerate(dictionaries["wicket_types"])
+        if wicket_type in NOT_OUT_DISMISSALS
+    ]
+
+    faced = pd.DataFrame(
+        {
+            "match_id": df["match_id"].to_numpy(),
+            "innings": df["innings"].to_numpy(),
+            "player": df["striker"].to_numpy(),
+            "team": df["batting_team"].to_numpy(),
+            "runs": df["runs_off_bat"].to_numpy().astype("int64"),
+            "balls": (df["wides"].to_numpy() == 0).astype("int64"),
+        }
+    )
+    innings = faced.groupby(INNINGS_KEYS, sort=False).agg(
+        team=("team", "first"), runs=("runs", "sum"), balls=("balls", "sum")
+    )
+
+    # non strikers who never faced a ball still batted
+    stood = pd.DataFrame(
+        {
+            "match_id": df["match_id"].to_numpy(),
+            "innings": df["innings"].to_numpy(),
+            "player": df["non_striker"].to_numpy(),
+            "team": df["batting_team"].to_numpy(),
+        }
+    ).drop_duplicates(INNINGS_KEYS)
+    stood = stood.set_index(INNINGS_KEYS)
+    stood = stood[~stood.index.isin(innings.index)]
+    innings = pd.concat([innings, stood.assign(runs=0, balls=0)])
+
+    # the batters dismissed (either batter can be out on a ball)
+    outs = []
+    for type_col, player_col in [
+        ("wicket_type", "player_dismissed"),
+        ("other_wicket_type", "other_player_dismissed"),
+    ]:
+        wicket_type = df[type_col].to_numpy()
+        mask = (wicket_type >= 0) & ~np.isin(wicket_type, not_out_codes)
+        outs.append(
+            pd.DataFrame(
+                {
+                    "match_id": df["match_id"].to_numpy()[mask],
+                    "innings": df["innings"].to_numpy()[mask],
+                    "player": df[player_col].to_numpy()[mask],
+                }
+            )
+        )
+    outs = pd.concat(outs).drop_duplicates()
+    innings["out"] = innings.index.isin(pd.MultiIndex.from_frame(outs))
+
+    innings = innings.reset_index()
+    innings["player"] = players[innings["player"].to_numpy()]
+    innings["team"] = teams[innings["team"].to_numpy()]
+    innings.sort_values(INNINGS_KEYS, inplace=True, ignore_index=True)
+
+    return innings
+
+
+def bowling_innings(df, dictionaries):
+    """Aggregate the deliveries into one row per bowler per innings.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        the deliveries, with the ``DELIVERY_COLUMNS`` as integer codes
+    dictionaries : dict
+        the dictionaries of the delivery store
+
+    Returns
+    -------
+    innings : pd.DataFrame
+        match_id, innings, player, team, balls, runs, wickets and the wickets
+        of each dismissal type in ``BOWLER_DISMISSALS`` for every bowler
+    """
+
+    players = np.asarray(dictionaries["players"], dtype=object)
+    teams = np.asarray(dictionaries["teams"], dtype=object)
+    wicket_types = dictionaries["wicket_types"]
+
+    wides = df["wides"].to_numpy().astype("int64")
+    noballs = df["noballs"].to_numpy().astype("int64")
+    # a second dismissal on the same ball is never credited to the bowler
+    wicket_type = df["wicket_type"].to_numpy()
+
+    columns = {
+        "match_id": df["match_id"].to_numpy(),
+        "innings": df["innings"].to_numpy(),
+        "player": df["bowler"].to_numpy(),
+        "team": df["bowling_team"].to_numpy(),
+        "balls": ((wides == 0) & (noballs == 0)).astype("int64"),
+        "runs": df["runs_off_bat"].to_numpy().astype("int64") + wides + noballs,
+    }
+    for dismissal in BOWLER_DISMISSALS:
+        code = wicket_types.index(dismissal) if dismissal in wicket_types else -2
+        columns[_wicket_column(dismissal)] = (wicket_type == code).astype("int64")
+    wicket_columns = [_wicket_column(dismissal) for dismissal in BOWLER_DISMISSALS]
+
+    innings = (
+        pd.DataFrame(columns)
+        .groupby(INNINGS_KEYS, sort=False)
+        .agg(
+            team=("team", "first"),
+            balls=("balls", "sum"),
+            runs=("runs", "sum"),
+            **{col: (col, "sum") for col in wicket_columns},
+        )
+    )
+    innings.insert(3, "wickets", innings[wicket_columns].sum(axis=1))
+
+    innings = innings.reset_index()
+    innings["player"] = players[innings["player"].to_numpy()]
+    innings["team"] = teams[innings["team"].to_numpy()]
+    innings.sort_values(INNINGS_KEYS, inplace=True, ignore_index=True)
+
+    return innings
+
+
+def batting_summary(innings, by=("player",)):
+    """Sum the batting innings into match or career statistics.
+
+    Parameters
+    ----------
+    innings : pd.DataFrame
+        the batting innings (see ``batting_innings``)
+    by : tuple of str, optional
+        the grouping, e.g. ``("player",)`` for careers or
+        ``("match_id", "player")`` for matches
+
+    Returns
+    -------
+    stats : pd.DataFrame
+        innings, runs, balls, dismissals, not outs, 50s, 100s, high score,
+        average and strike rate, indexed by the grouping
+    """
+
+    runs = innings["runs"]
+    stats = (
+        innings.assign(
+            fifties=((runs >= 50) & (runs < 100)).astype("int64"),
+            hundreds=(runs >= 100).astype("int64"),
+        )
+        .groupby(list(by), sort=True)
+        .agg(
+            innings=("runs", "size"),
+            runs=("runs", "sum"),
+            balls=("balls", "sum"),
+            dismissals=("out", "sum"),
+            fifties=("fifties", "sum"),
+            hundreds=("hundreds", "sum"),
+            high_score=("runs", "max"),
+        )
+    )
+    stats.insert(4, "not_outs", stats["innings"] - stats["dismissals"])
+    stats["average"] = stats["runs"] / stats["dismissals"].where(
+        stats["dismissals"] > 0
+    )
+    stats["strike_rate"] = (
+        100 * stats["runs"] / stats["balls"].where(stats["balls"] > 0)
+    )
+
+    return stats
+
+
+def bowling_summary(innings, by=("player",)):
+    """Sum the bowling innings into match or career statistics.
+
+    Parameters
+    ----------
+    innings : pd.DataFrame
+        the bowling innings (see ``bowling_innings``)
+    by : tuple of str, optional
+        the grouping (see ``batting_summary``)
+
+    Returns
+    -------
+    stats : pd.DataFrame
+        innings, balls, runs, wickets (in total and by dismissal type),
+        economy (runs per over), average and strike rate (balls per wicket),
+        indexed by the grouping
+    """
+
+    sums = ["balls", "runs", "wickets"] + [
+        _wicket_column(dismissal) for dismissal in BOWLER_DISMISSALS
+    ]
+    grouped = innings.groupby(list(by), sort=True)
+    stats = grouped[sums].sum()
+    stats.insert(0, "innings", grouped.size())
+
+    wickets = stats["wickets"].where(stats["wickets"] > 0)
+    stats["economy"] = 6 * stats["runs"] / stats["balls"].where(stats["balls"] > 0)
+    stats["average"] = stats["runs"] / wickets
+    stats["strike_rate"] = stats["balls"] / wickets
+
+    return stats
+
+
+class PlayerStats:
+    """The batting and bowling innings of every player, with their summaries.
+
+    Parameters
+    ----------
+    batting : pd.DataFrame
+        the batting innings (see ``batting_innings``)
+    bowling : pd.DataFrame
+        the bowling innings (see ``bowling_innings``)
+    """
+
+    def __init__(self, batting, bowling):
+
+        self.batting_ = batting
+        self.bowling_ = bowling
+
+    @classmethod
+    def from_store(cls, store_path, match_ids=None):
+        """Compute the statistics from a delivery store.
+
+        Parameters
+        ----------
+        store_path : str
+            the directory of the delivery store
+        match_ids : list of int, optional
+            only use these matches (default all)
+
+        Returns
+        -------
+        stats : PlayerStats
+            the statistics
+        """
+
+        dictionaries = load_dictionaries(store_path)
+        df = load_deliveries(
+            store_path, columns=DELIVERY_COLUMNS, match_ids=match_ids, decode=False
+        )
+        return cls(batting_innings(df, dictionaries), bowling_innings(df, dictionaries))
+
+    @classmethod
+    def load(cls, path):
+        """Load the statistics saved by ``save`` (None if there are none)."""
+
+        batting_file = os.path.join(path, BATTING_FILE)
+        bowling_file = os.path.join(path, BOWLING_FILE)
+        if not (os.path.exists(batting_file) and os.path.exists(bowling_file)):
+            return None
+        return cls(pd.read_csv(batting_file), pd.read_csv(bowling_file))
+
+    def save(self, path):
+        """Write the innings tables to csv files in a directory."""
+
+        os.makedirs(path, exist_ok=True)
+        self.batting_.to_csv(os.path.join(path, BATTING_FILE), index=False)
+        self.bowling_.to_csv(os.path.join(path, BOWLING_FILE), index=False)
+
+    def match_ids(self):
+        """The ids of the matches included in the statistics."""
+
+        return set(self.batting_["match_id"]) | set(self.bowling_["match_id"])
+
+    def update(self, store_path):
+        """Add the matches of a delivery store which are not yet included.
+
+        Matches which are no longer in the store are dropped. Matches already
+        included are not recomputed, so a corrected match has to be removed
+        (or the statistics rebuilt) to be picked up.
+
+        Returns
+        -------
+        new_matches : list of int
+            the ids of the matches which were added
+        """
+
+        store_ids = set(
+            load_deliveries(store_path, columns=["match_id"], decode=False)[
+                "match_id"
+            ].unique()
+        )
+        known_ids = self.match_ids()
+        new_matches = sorted(store_ids - known_ids)
+
+        tables = [self.batting_, self.bowling_]
+        if known_ids - store_ids:
+            tables = [table[table["match_id"].isin(store_ids)] for table in tables]
+        if new_matches:
+            new = PlayerStats.from_store(store_path, match_ids=new_matches)
+            tables = [
+                pd.concat([tables[0], new.batting_], ignore_index=True),
+                pd.concat([tables[1], new.bowling_], ignore_index=True),
+            ]
+        self.batting_, self.bowling_ = [
+            table.sort_values(INNINGS_KEYS, ignore_index=True) for table in tables
+        ]
+
+        return new_matches
+
+    def batting_matches(self):
+        """The batting statistics of every player in every match."""
+
+        return batting_summary(self.batting_, by=("match_id", "player"))
+
+    def bowling_matches(self):
+        """The bowling statistics of every player in every match."""
+
+        return bowling_summary(self.bowling_, by=("match_id", "player"))
+
+    def batting_careers(self):
+        """The career batting statistics of every player."""
+
+        return batting_summary(self.batting_)
+
+    def bowling_careers(self):
+        """The career bowling statistics of every player."""
+
+        return bowling_summary(self.bowling_)
+
+
+def update_player_stats(store_path, output_path):
+    """Bring the cached player statistics up to date with a delivery store.
+
+    Parameters
+    ----------
+    store_path : str
+        the directory of the delivery store
+    output_path : str
+        the directory of the cached innings tables, to which the career
+        tables are also written
+
+    Returns
+    -------
+    stats : PlayerStats
+        the up to date statistics
+    """
+
+    stats = PlayerStats.load(output_path)
+    if stats is None:
+        stats = PlayerStats.from_store(store_path)
+        print("computed statistics for", len(stats.match_ids()), "matches")
+    else:
+        new_matches = stats.update(store_path)
+        print("added statistics for", len(new_matches), "new matches")
+
+    stats.save(output_path)
+    stats.batting_careers().to_csv(os.path.join(output_path, "batting_careers.csv"))
+    stats.bowling_careers().to_csv(os.path.join(output_path, "bowling_careers.csv"))
+
+    return stats
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Compute the batting and bowling statistics of every player."
+    )
+    parser.add_argument("store_path", help="the delivery store path")
+    parser.add_argument("output_path", help="the path to write the statistics to")
+    args = parser.parse_args()
+
+    update_player_stats(args.store_path, args.output_path)
@@ -0,0 +1,379 @@
+"""Scorecards of every match, cross-checked against the match info files.
+
+The delivery files of a match directory are processed in chunks of
+matches (optionally by a pool of worker processes), so only one chunk of
+deliveries is in memory per worker, and the tables of each chunk are
+written out as soon as it is done. For each match the batting and
+bowling scorecards (see ``src.features.player_stats``) and the innings
+totals are built, and the result they imply is checked against the info
+file:
+
+* teams: the batting teams are the two teams of the info file
+* winner: the winner scored more runs over the match than the loser
+* winner_runs: the difference in the teams' aggregates is the margin
+* winner_runs_penalty: the margin differs from the aggregates by whole
+  penalty awards (see below); found is the runs the winner is short of
+* winner_wickets: the winner batted last and lost the right number of
+  wickets in that innings
+* winner_innings: the winner batted only once
+* tie: the aggregates are equal
+
+Matches whose result was decided otherwise (e.g. awarded) are not checked.
+Every failed check is a row of the report.
+
+Penalty runs on a delivery are awarded to the batting side and are part of
+its extras (the ``penalty`` column of the innings totals). Penalty runs
+awarded outside a delivery (e.g. for damage to the pitch between overs) are
+not in the csv files at all, so a margin that differs by up to one award of
+``PENALTY_RUNS`` per innings is reported as ``winner_runs_penalty`` rather
+than ``winner_runs``.
+
+Usage: python -m src.features.scorecards match_datapath output_path [--workers N]
+"""
+
+import argparse
+import collections
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.data.deliveries import CATEGORICAL_COLUMNS, Dictionary, encode_deliveries
+from src.data.match_info import read_match_info
+from src.data.stream import NOT_OUT_DISMISSALS
+from src.features.player_stats import (
+    BATTING_COLUMNS,
+    BOWLING_COLUMNS,
+    batting_innings,
+    bowling_innings,
+)
+
+# the number of matches processed at a time by each worker
+CHUNK_SIZE = 25
+
+REPORT_COLUMNS = ["match_id", "check", "expected", "found"]
+
+# the runs of a penalty award
+PENALTY_RUNS = 5
+
+# the columns of each table, which are kept when a table is empty
+SCORECARD_COLUMNS = {
+    "batting": BATTING_COLUMNS,
+    "bowling": BOWLING_COLUMNS,
+    "innings": [
+        "match_id",
+        "innings",
+        "team",
+        "runs",
+        "wickets",
+        "balls",
+        "extras",
+        "penalty",
+    ],
+    "report": REPORT_COLUMNS,
+}
+
+SCORECARD_FILES = {
+    "batting": "batting_scorecards.csv",
+    "bowling": "bowling_scorecards.csv",
+    "innings": "innings_totals.csv",
+    "report": "scorecard_report.csv",
+}
+
+
+def innings_totals(df, dictionaries):
+    """The runs, wickets, balls, extras and penalty runs of every innings.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        the deliveries, with integer codes for the categorical columns
+    dictionaries : dict
+        the values of the dictionaries the codes refer to
+
+    Returns
+    -------
+    totals : pd.DataFrame
+        match_id, innings, team (the batting team, which the penalty runs of
+        a delivery are awarded to), runs, wickets, balls, extras and penalty
+    """
+
+    not_out_codes = [
+        code
+        for code, wicket_type in enumerate(dictionaries["wicket_types"])
+        if wicket_type in NOT_OUT_DISMISSALS
+    ]
+    wickets = np.zeros(len(df), dtype="int64")
+    for col in ["wicket_type", "other_wicket_type"]:
+        wicket_type = df[col].to_numpy()
+        wickets += (wicket_type >= 0) & ~np.isin(wicket_type, not_out_codes)
+    extras = df["extras"].to_numpy().astype("int64")
+
+    totals = (
+        pd.DataFrame(
+            {
+                "match_id": df["match_id"].to_numpy(),
+                "innings": df["innings"].to_numpy(),
+                "team": df["batting_team"].to_numpy(),
+                "runs": df["runs_off_bat"].to_numpy().astype("int64") + extras,
+                "wickets": wickets,
+                "balls": (
+                    (df["wides"].to_numpy() == 0) & (df["noballs"].to_numpy() == 0)
+                ).astype("int64"),
+                "extras": extras,
+                "penalty": df["penalty"].to_numpy().astype("int64"),
+            }
+        )
+        .groupby(["match_id", "innings"], sort=True)
+        .agg(
+            team=("team", "first"),
+            runs=("runs", "sum"),
+            wickets=("wickets", "sum"),
+            balls=("balls", "sum"),
+            extras=("extras", "sum"),
+            penalty=("penalty", "sum"),
+        )
+        .reset_index()
+    )
+    teams = np.asarray(dictionaries["teams"], dtype=object)
+    totals["team"] = teams[totals["team"].to_numpy()]
+
+    return totals
+
+
+def check_result(info, totals):
+    """Check the teams and result of a match against its innings totals.
+
+    Parameters
+    ----------
+    info : MatchInfo
+        the match information from the info file
+    totals : pd.DataFrame
+        the innings totals of the match (see ``innings_totals``), in order
+
+    Returns
+    -------
+    mismatches : list of tuple
+        (match_id, check, expected, found) for every failed check
+    """
+
+    mismatches = []
+
+    def check(name, expected, found):
+        if expected != found:
+            mismatches.append((info.match_id, name, str(expected), str(found)))
+
+    batting_teams = sorted(set(totals["team"]))
+    check("teams", sorted(info.teams), sorted(set(info.teams) | set(batting_teams)))
+    if info.method is not None or len(totals) == 0:
+        return mismatches
+
+    aggregates = totals.groupby("team")["runs"].sum()
+    if info.winner is not None:
+        loser = [team for team in info.teams if team != info.winner]
+        winner_runs = aggregates.get(info.winner, 0)
+        loser_runs = aggregates.get(loser[0], 0) if loser else 0
+        check("winner", info.winner, _leader(aggregates))
+        if info.win_by_runs is not None:
+            margin = winner_runs - loser_runs
+            unrecorded = info.win_by_runs - margin
+            if unrecorded != 0 and _penalty_awards(unrecorded, len(totals)):
+                check("winner_runs_penalty", 0, unrecorded)
+            else:
+                check("winner_runs", info.win_by_runs, margin)
+        if info.win_by_wickets is not None:
+            last = totals.iloc[-1]
+            check("winner_wickets", info.winner, last["team"])
+            check("winner_wickets", info.win_by_wickets, 10 - last["wickets"])
+        if info.win_by_innings:
+            check("winner_innings", 1, int((totals["team"] == info.winner).sum()))
+    elif info.outcome == "tie":
+        check("tie", 1, aggregates.nunique())
+
+    return mismatches
+
+
+def _penalty_awards(runs, n_innings):
+    """Whether runs missing from a margin can be penalty awards.
+
+    At most one award per innings is accepted, to either side.
+    """
+
+    return runs % PENALTY_RUNS == 0 and abs(runs) <= PENALTY_RUNS * n_innings
+
+
+def _leader(aggregates):
+    """The team with the most runs (None if the aggregates are level)."""
+
+    if len(aggregates) > 1 and aggregates.nunique() == 1:
+        return None
+    return aggregates.idxmax()
+
+
+def scorecard_chunk(match_files):
+    """Build the scorecards and checks of a chunk of matches.
+
+    Parameters
+    ----------
+    match_files : list of tuple
+        the (info file, delivery file) of each match
+
+    Returns
+    -------
+    tables : dict of pd.DataFrame
+        the ``batting``, ``bowling`` and ``innings`` tables and the ``report``
+        of failed checks
+    """
+
+    frames = []
+    infos = []
+    report = []
+    for info_file, delivery_file in match_files:
+        info = read_match_info(info_file)
+        if not os.path.exists(delivery_file):
+            report.append((info.match_id, "deliveries", delivery_file, None))
+            continue
+        infos.append(info)
+        frames.append(pd.read_csv(delivery_file, dtype=str))
+
+    tables = {
+        name: pd.DataFrame(columns=SCORECARD_COLUMNS[name])
+        for name in ["batting", "bowling", "innings"]
+    }
+    if frames:
+        dictionaries = {name: Dictionary() for name, _ in CATEGORICAL_COLUMNS.values()}
+        df = pd.DataFrame(
+            encode_deliveries(pd.concat(frames, ignore_index=True), dictionaries)
+        )
+        values = {name: d.values_ for name, d in dictionaries.items()}
+        tables = {
+            "batting": batting_innings(df, values),
+            "bowling": bowling_innings(df, values),
+            "innings": innings_totals(df, values),
+        }
+        totals = dict(list(tables["innings"].groupby("match_id")))
+        for info in infos:
+            match_totals = totals.get(info.match_id, tables["innings"].iloc[:0])
+            report += check_result(info, match_totals)
+
+    tables["report"] = pd.DataFrame(report, columns=REPORT_COLUMNS)
+    return tables
+
+
+def _chunk_results(chunks, n_workers):
+    """Yield the tables of each chunk in order, computing a few ahead.
+
+    With several workers at most two chunks per worker are submitted ahead
+    of the one being consumed, so the finished tables waiting in the parent
+    stay bounded.
+    """
+
+    if n_workers <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield scorecard_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(executor.submit(scorecard_chunk, chunk))
+            if len(pending) >= 2 * n_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def build_scorecards(match_datapath, output_path, n_workers=1, chunk_size=CHUNK_SIZE):
+    """Build the scorecards of every match in a directory and check them.
+
+    The tables of each chunk of matches are appended to the output files
+    (``SCORECARD_FILES``) as soon as the chunk is done, so only a few chunks
+    are in memory at a time.
+
+    Parameters
+    ----------
+    match_datapath : str
+        the directory containing the cricsheet match csv files
+    output_path : str
+        the directory to write the tables to
+    n_workers : int, optional
+        the number of worker processes
+    chunk_size : int, optional
+        the number of matches read into memory at a time by each worker
+
+    Returns
+    -------
+    n_matches : int
+        the number of matches with innings totals
+    report : pd.DataFrame
+        the failed checks (also written to the report file)
+    """
+
+    info_files = sorted(glob.glob(os.path.join(match_datapath, "*_info.csv")))
+    match_files = [
+        (info_file, info_file[: -len("_info.csv")] + ".csv") for info_file in info_files
+    ]
+    chunks = [
+        match_files[i : i + chunk_size] for i in range(0, len(match_files), chunk_size)
+    ]
+
+    os.makedirs(output_path, exist_ok=True)
+    files = {
+        name: open(os.path.join(output_path, fname), "w", newline="")
+        for name, fname in SCORECARD_FILES.items()
+    }
+    n_matches = 0
+    reports = []
+    try:
+        for name, f in files.items():
+            pd.DataFrame(columns=SCORECARD_COLUMNS[name]).to_csv(f, index=False)
+        for tables in _chunk_results(chunks, n_workers):
+            for name, f in files.items():
+                if len(tables[name]) > 0:
+                    tables[name].to_csv(
+                        f, header=False, index=False, columns=SCORECARD_COLUMNS[name]
+                    )
+            n_matches += tables["innings"]["match_id"].nunique()
+            reports.append(tables["report"])
+    finally:
+        for f in files.values():
+            f.close()
+
+    report = pd.concat(
+        [pd.DataFrame(columns=REPORT_COLUMNS)] + reports, ignore_index=True
+    )
+    return n_matches, report
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Build and check the scorecards of every match."
+    )
+    parser.add_argument("match_datapath", help="the raw match data path")
+    parser.add_argument("output_path", help="the path to write the scorecards to")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=CHUNK_SIZE,
+        help="number of matches held in memory at a time by each worker",
+    )
+    args = parser.parse_args()
+
+    n_matches, report = build_scorecards(
+        args.match_datapath,
+        args.output_path,
+        n_workers=args.workers,
+        chunk_size=args.chunk_size,
+    )
+
+    print("built the scorecards of", n_matches, "matches")
+    if len(report) > 0:
+        print(len(report), "failed checks in", report["match_id"].nunique(), "matches:")
+        for check, count in report["check"].value_counts().items():
+            print("   ", check, "(" + str(count) + ")")
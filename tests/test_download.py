@@ -0,0 +1,138 @@
+"""Tests of the downloader in src.data.download against a local HTTP server."""
+
+import glob
+import http.server
+import os
+import threading
+
+import pytest
+
+from src.data.download import Downloader, DownloadError, raw_downloads
+
+BODY = b"<html>" + b"x" * 100000 + b"</html>"
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Serves ``BODY`` with an ETag, failing as told by the server's plan.
+
+    ``server.failures`` maps a path to the failures of its next requests:
+    "503" (a busy server) or "reset" (the connection is dropped halfway
+    through the body).
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        failures = self.server.failures.get(self.path, [])
+        failure = failures.pop(0) if failures else None
+
+        if self.path.startswith("/missing"):
+            self.send_error(404)
+            return
+        if failure == "503":
+            self.send_error(503)
+            return
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.send_header("ETag", '"v1"')
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        if failure == "reset":
+            self.wfile.write(BODY[: len(BODY) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.requests = []
+    httpd.failures = {}
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def base_url(server):
+    return "http://127.0.0.1:%d" % server.server_address[1]
+
+
+def downloader(tmp_path, retries=2):
+    return Downloader(str(tmp_path / "cache.json"), retries=retries, backoff=0)
+
+
+def test_conditional_requests(server, tmp_path):
+    urls = {
+        "rankings": base_url(server) + "/rankings/{year}",
+        "series": base_url(server) + "/series/{first}_{last}",
+        "matches": base_url(server) + "/tests_male_csv2.zip",
+    }
+    raw_path = str(tmp_path) + "/"
+    downloads = raw_downloads(raw_path, 2012, 2013, urls, ("rankings", "series"))
+
+    statuses = downloader(tmp_path).fetch_all(downloads)
+    assert set(statuses.values()) == {"downloaded"}
+    for _, fname in downloads:
+        with open(fname, "rb") as f:
+            assert f.read() == BODY
+
+    # a new downloader reads the cached ETags and sends conditional requests
+    statuses = downloader(tmp_path).fetch_all(downloads)
+    assert set(statuses.values()) == {"not modified"}
+
+    # a file changed locally is downloaded again
+    fname = downloads[0][1]
+    with open(fname, "wb") as f:
+        f.write(b"edited")
+    statuses = downloader(tmp_path).fetch_all(downloads)
+    assert statuses[fname] == "downloaded"
+    with open(fname, "rb") as f:
+        assert f.read() == BODY
+
+
+@pytest.mark.parametrize("failure", ["503", "reset"])
+def test_transient_failures_retried(server, tmp_path, failure):
+    server.failures["/file"] = [failure, failure]
+    fname = str(tmp_path / "file.html")
+
+    status = downloader(tmp_path).fetch(base_url(server) + "/file", fname)
+
+    assert status == "downloaded"
+    assert server.requests == ["/file"] * 3
+    with open(fname, "rb") as f:
+        assert f.read() == BODY
+    assert glob.glob(str(tmp_path / "*.part")) == []
+
+
+def test_failed_download_leaves_no_file(server, tmp_path):
+    server.failures["/file"] = ["reset"] * 3
+    fname = str(tmp_path / "file.html")
+
+    with pytest.raises(DownloadError):
+        downloader(tmp_path).fetch(base_url(server) + "/file", fname)
+
+    assert server.requests == ["/file"] * 3
+    assert os.listdir(tmp_path) == []
+
+
+def test_client_error_not_retried(server, tmp_path):
+    fname = str(tmp_path / "missing.html")
+
+    with pytest.raises(DownloadError):
+        downloader(tmp_path).fetch(base_url(server) + "/missing", fname)
+
+    assert server.requests == ["/missing"]
+    assert not os.path.exists(fname)
@@ -0,0 +1,193 @@
+"""Tests of the ratings points rules in src.data.ratings."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data.make_rankings_data import calc_points
+from src.data.ratings import (
+    PointsTable,
+    RatingsEngine,
+    calc_points_batch,
+    monthly_rankings,
+)
+
+
+def reference_points(num_matches, home_score, away_score, home_rating, away_rating):
+    """The ICC points rules for a single series, written out case by case."""
+
+    draws = num_matches - home_score - away_score
+    home_wins = home_score + 0.5 * draws
+    away_wins = away_score + 0.5 * draws
+
+    if home_wins > away_wins:
+        home_wins += 1
+    elif home_wins < away_wins:
+        away_wins += 1
+    else:
+        home_wins += 0.5
+        away_wins += 0.5
+
+    if abs(home_rating - away_rating) < 40:
+        home_points = home_wins * (away_rating + 50) + away_wins * (away_rating - 50)
+        away_points = away_wins * (home_rating + 50) + home_wins * (home_rating - 50)
+        return home_points, away_points
+
+    def own_rating_points(rating, stronger, wins, losses):
+        if stronger:
+            return wins * (rating + 10) + losses * (rating - 90)
+        return wins * (rating + 90) + losses * (rating - 10)
+
+    home_points = own_rating_points(
+        home_rating, home_rating > away_rating, home_wins, away_wins
+    )
+    away_points = own_rating_points(
+        away_rating, away_rating > home_rating, away_wins, home_wins
+    )
+    return home_points, away_points
+
+
+def random_series(rng, n):
+    """Random series results and ratings, with many gaps near 40 points."""
+
+    num_matches = rng.integers(1, 6, n)
+    home_score = rng.integers(0, num_matches + 1)
+    away_score = rng.integers(0, num_matches - home_score + 1)
+    home_rating = rng.integers(0, 140, n).astype("float64")
+    gap = rng.choice([0, 1, 25, 39, 39.5, 40, 40.5, 41, 60, 100], n)
+    away_rating = home_rating + rng.choice([-1, 1], n) * gap
+    # some ratings with fractional parts, as in the rankings tables
+    fractional = rng.random(n) < 0.3
+    home_rating[fractional] += rng.random(fractional.sum())
+    return num_matches, home_score, away_score, home_rating, away_rating
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_batch_matches_reference(seed):
+    series = random_series(np.random.default_rng(seed), 2000)
+    home_points, away_points = calc_points_batch(*series)
+
+    expected = np.array([reference_points(*row) for row in zip(*series)])
+    np.testing.assert_allclose(home_points, expected[:, 0])
+    np.testing.assert_allclose(away_points, expected[:, 1])
+
+
+@pytest.mark.parametrize(
+    "series, expected",
+    [
+        # within 40 points: relative to the opponent's rating
+        ((3, 2, 0, 100, 80), (3.5 * 130 + 0.5 * 30, 0.5 * 150 + 3.5 * 50)),
+        # all draws: half a win each, plus half the series bonus each
+        ((2, 0, 0, 100, 90), (1.5 * 140 + 1.5 * 40, 1.5 * 150 + 1.5 * 50)),
+        # stronger home team beats a team 50 points below it
+        ((1, 1, 0, 130, 80), (2 * 140, 2 * 70)),
+        # stronger home team loses to a team 50 points below it
+        ((1, 0, 1, 130, 80), (2 * 40, 2 * 170)),
+        # stronger away team, beaten by the home team
+        ((1, 1, 0, 80, 130), (2 * 170, 2 * 40)),
+        # a gap of exactly 40 uses the own rating rules, in both orientations
+        ((1, 1, 0, 140, 100), (2 * 150, 2 * 90)),
+        ((1, 1, 0, 100, 140), (2 * 190, 2 * 50)),
+        # just under 40 uses the opponent's rating
+        ((1, 1, 0, 139.5, 100), (2 * 150, 2 * 89.5)),
+        # a drawn series (one win each) between teams 50 points apart
+        ((2, 1, 1, 150, 100), (1.5 * 160 + 1.5 * 60, 1.5 * 190 + 1.5 * 90)),
+    ],
+)
+def test_points_rules(series, expected):
+    home_points, away_points = calc_points_batch(*series)
+
+    assert (float(home_points), float(away_points)) == pytest.approx(expected)
+    assert reference_points(*series) == pytest.approx(expected)
+
+    # the single series wrapper returns the same points as a list of floats
+    points_won = calc_points(*series)
+    assert isinstance(points_won, list)
+    assert all(isinstance(points, float) for points in points_won)
+    assert points_won == pytest.approx(list(expected))
+
+
+def test_scalar_wrapper_matches_reference():
+    series = random_series(np.random.default_rng(0), 500)
+
+    for row in zip(*series):
+        row = [int(value) for value in row[:3]] + [float(value) for value in row[3:]]
+        assert calc_points(*row) == pytest.approx(list(reference_points(*row)))
+
+
+def points_frame(rows):
+    """A series points table from (date, home, away, num_matches, home
+    points, away points) rows."""
+
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "date",
+            "home_team",
+            "away_team",
+            "num_matches",
+            "home_tot_points",
+            "away_tot_points",
+        ],
+    )
+
+
+def test_single_match_series_not_counted():
+    points_df = points_frame(
+        [
+            ("2015-06-01", "A", "B", 2, 300.0, 90.0),
+            # a one-Test series counts for no matches, so none of its points
+            ("2015-08-01", "A", "B", 1, 250.0, 10.0),
+        ]
+    )
+    points, matches = PointsTable(points_df).totals_at("2015-09-01")
+    np.testing.assert_allclose(points, [[300.0, 90.0]])
+    np.testing.assert_allclose(matches, [[3.0, 3.0]])
+
+    df = monthly_rankings(points_df, 2015, 10, 2015, 10)
+    assert df["rating"].tolist() == pytest.approx([100.0, 30.0])
+
+
+def test_engine_snapshots_match_monthly_rankings():
+    rng = np.random.default_rng(0)
+    teams = ["A", "B", "C", "D"]
+    n = 60
+    dates = pd.Timestamp("2013-03-10") + pd.to_timedelta(
+        np.sort(rng.integers(0, 5 * 365, n)), unit="D"
+    )
+    pairs = [rng.choice(teams, 2, replace=False) for _ in range(n)]
+    # about a third of the series are single matches
+    num_matches = rng.choice([1, 1, 2, 3, 4, 5], n)
+    home_score = rng.integers(0, num_matches + 1)
+    away_score = rng.integers(0, num_matches - home_score + 1)
+    series_df = pd.DataFrame(
+        {
+            "date": dates,
+            "home_team": [pair[0] for pair in pairs],
+            "away_team": [pair[1] for pair in pairs],
+            "num_matches": num_matches,
+            "home_score": home_score,
+            "away_score": away_score,
+        }
+    )
+
+    engine = RatingsEngine("2013-03-01")
+    points = [
+        engine.apply_series(*row)
+        for row in series_df.itertuples(index=False, name=None)
+    ]
+    engine.advance("2018-06-01")
+    snapshots = engine.snapshots()
+
+    points_df = series_df.assign(
+        date=series_df["date"].dt.strftime("%Y-%m-01"),
+        home_tot_points=[home for home, _ in points],
+        away_tot_points=[away for _, away in points],
+    )
+    expected = monthly_rankings(points_df, 2013, 4, 2018, 6)
+
+    pd.testing.assert_frame_equal(
+        snapshots.reset_index(drop=True),
+        expected[snapshots.columns],
+        check_dtype=False,
+    )